@@ -0,0 +1,77 @@
+"""
+Contexte d'un tour de conversation
+
+Objet passé à `Runner.run(context=...)`: les hooks du run et les outils qui
+prennent un RunContextWrapper y retrouvent l'état de la session, le message
+du tour et les données préchargées, sans variable globale.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+from app.models.schemas import ClientInDB, SouscriptionInDB
+from app.models.state import ConversationState
+
+logger = logging.getLogger(__name__)
+
+
+ClientPrefetch = Tuple[Optional[ClientInDB], Optional[SouscriptionInDB]]
+
+
+async def prefetch_client(user_phone: str) -> ClientPrefetch:
+    """
+    Charge la fiche client et sa souscription ouverte à partir du téléphone
+
+    Args:
+        user_phone: Numéro de téléphone du client
+
+    Returns:
+        (client, souscription ouverte), chacun pouvant être None
+    """
+    from app.services.supabase_client import supabase_service
+
+    client = await supabase_service.get_client_by_phone(user_phone)
+    if client is None:
+        return None, None
+
+    souscription = await supabase_service.get_open_souscription(client.id)
+    return client, souscription
+
+
+@dataclass
+class TurnContext:
+    """État partagé pendant un tour de conversation"""
+    state: ConversationState
+    user_message: str
+    # Préchargement client lancé en début de tour, en parallèle du state Redis
+    client_prefetch: Optional["asyncio.Task[ClientPrefetch]"] = None
+    # Numéro pour lequel le préchargement a été lancé (celui du tour, pas forcément celui du state)
+    prefetch_phone: Optional[str] = None
+    # Chronologie du tour (appels LLM et outils enregistrés par les hooks)
+    timeline: Optional[Any] = None
+    # Étapes du tour pour l'enregistreur de vol (outils avec arguments et résultats, appels LLM)
+    steps: List[Dict[str, Any]] = field(default_factory=list)
+    # Résultats produits en cours de tour par les hooks (devis précalculés, ...)
+    extras: Dict[str, Any] = field(default_factory=dict)
+
+    async def prefetched_client(self, phone: str) -> Optional[ClientPrefetch]:
+        """
+        Résultat du préchargement client pour ce numéro
+
+        Args:
+            phone: Numéro demandé par l'outil
+
+        Returns:
+            (client, souscription ouverte) - client None si inconnu en base -,
+            ou None si pas de préchargement utilisable (autre numéro, échec):
+            l'outil interroge alors la base
+        """
+        if self.client_prefetch is None or phone != self.prefetch_phone:
+            return None
+
+        try:
+            return await asyncio.shield(self.client_prefetch)
+        except Exception as e:
+            logger.warning(f"⚠️ Préchargement client indisponible: {e}")
+            return None
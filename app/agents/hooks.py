@@ -0,0 +1,115 @@
+"""
+Hooks du run AYA (openai-agents RunHooks)
+
+Réagissent aux événements du run pendant le tour lui-même, sans attendre
+la réponse finale du LLM.
+"""
+from typing import Any, Dict, Optional
+import ast
+import json
+import logging
+
+from agents import RunHooks
+
+from app.config import settings
+from app.services.flight_recorder import flight_recorder
+from app.tools.speculation import quote_speculator
+
+logger = logging.getLogger(__name__)
+
+
+# Sorties d'outils de vision conservées dans collected_data
+VISION_DOCUMENTS = {
+    "analyze_carte_grise": "carte_grise",
+    "analyze_passport": "passport",
+}
+
+
+def _as_dict(result: Any) -> Optional[Dict[str, Any]]:
+    """Sortie d'outil sous forme de dict (le SDK peut la transmettre en texte)"""
+    if isinstance(result, dict):
+        return result
+    if isinstance(result, str):
+        for parse in (json.loads, ast.literal_eval):
+            try:
+                value = parse(result)
+                return value if isinstance(value, dict) else None
+            except Exception:
+                continue
+    return None
+
+
+def _tool_key(context, tool) -> str:
+    """Clé d'un appel d'outil (plusieurs appels du même outil peuvent être parallèles)"""
+    return f"tool:{getattr(context, 'tool_call_id', None) or tool.name}"
+
+
+def _model_name(agent) -> str:
+    model = getattr(agent, "model", None)
+    if isinstance(model, str):
+        return model
+    return getattr(model, "model", None) or "default"
+
+
+class AYARunHooks(RunHooks):
+    """
+    Hooks d'un tour: chronologie (LLM, outils) et spéculation de devis
+    dès la fin d'une analyse de document
+    """
+
+    async def on_llm_start(self, context, agent, system_prompt, input_items) -> None:
+        timeline = getattr(context.context, "timeline", None)
+        if timeline is not None:
+            timeline.start(f"llm:{agent.name}")
+
+    async def on_llm_end(self, context, agent, response) -> None:
+        timeline = getattr(context.context, "timeline", None)
+        if timeline is None:
+            return
+
+        event = timeline.llm_call(f"llm:{agent.name}", _model_name(agent), getattr(response, "usage", None))
+        steps = getattr(context.context, "steps", None)
+        if event is not None and steps is not None and settings.FLIGHT_RECORDER_ENABLED:
+            steps.append(flight_recorder.llm_step(event))
+
+    async def on_tool_start(self, context, agent, tool) -> None:
+        timeline = getattr(context.context, "timeline", None)
+        if timeline is not None:
+            timeline.start(_tool_key(context, tool))
+
+    async def on_tool_end(self, context, agent, tool, result) -> None:
+        output = _as_dict(result)
+
+        timeline = getattr(context.context, "timeline", None)
+        if timeline is not None:
+            failed = output is not None and (output.get("error") or output.get("success") is False)
+            outcome = "error" if failed else "ok"
+            event = timeline.tool_call(_tool_key(context, tool), tool.name, outcome)
+
+            steps = getattr(context.context, "steps", None)
+            if steps is not None and settings.FLIGHT_RECORDER_ENABLED:
+                steps.append(flight_recorder.tool_step(
+                    tool.name,
+                    getattr(context, "tool_arguments", None),
+                    result,
+                    event["duration_ms"] if event else None,
+                    outcome
+                ))
+
+        document = VISION_DOCUMENTS.get(tool.name)
+        state = getattr(context.context, "state", None)
+        if document is None or state is None:
+            return
+
+        if not output or output.get("error"):
+            return
+
+        try:
+            state.collected_data[document] = output
+            quote_speculator.speculate_for_state(state)
+        except Exception as e:
+            logger.error(f"Erreur spéculation après {tool.name}: {e}")
+
+
+# Instance globale
+aya_run_hooks = AYARunHooks()
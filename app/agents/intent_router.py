@@ -0,0 +1,365 @@
+"""
+INTENT ROUTER - Réponses déterministes pour les intentions fréquentes
+
+Une grande partie du trafic (salutations, liste des produits, grilles tarifaires
+MRH/IAC, suivi de paiement) a une réponse connue à l'avance. Le routeur classe
+le message par mots-clés, avec un score de confiance, et répond directement
+sans invoquer le LLM. Tout ce qu'il refuse est transmis à l'orchestrateur.
+"""
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import List, Optional, Set
+
+from app.config import settings
+from app.models.state import ConversationState
+from app.tools.quotation import format_mrh_quotation_response, format_iac_quotation_response
+
+logger = logging.getLogger(__name__)
+
+
+PRODUCTS_MENU = """🏢 Produits disponibles:
+1️⃣ Assurance Auto 🚗
+2️⃣ Assurance Voyage ✈️
+3️⃣ Individuelle Accident 👨‍💼
+4️⃣ Multirisque Habitation 🏠
+
+Quel produit vous intéresse?"""
+
+GREETING_REPLY = f"""Bonjour! 👋 Je suis AYA, votre conseillère digitale NSIA Assurances.
+Je vous aide à souscrire en 3 minutes!
+
+{PRODUCTS_MENU}"""
+
+
+# ============================================================================
+# NORMALISATION
+# ============================================================================
+
+def normalize_text(text: str) -> str:
+    """Met en minuscules, retire les accents, la ponctuation et les emojis"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    """Découpe un texte normalisé en mots"""
+    return normalize_text(text).split()
+
+
+PRODUCT_KEYWORDS = {
+    "auto": {"auto", "automobile", "voiture", "vehicule", "taxi", "moto", "camion", "grise", "minibus", "bus"},
+    "voyage": {"voyage", "voyager", "schengen", "visa", "etudiant", "pelerinage", "passeport"},
+    "iac": {"iac", "individuelle", "individuel", "accident", "accidents"},
+    "mrh": {"mrh", "multirisque", "multirisques", "habitation", "maison", "logement"},
+}
+
+
+def detect_product_types(message: str) -> List[str]:
+    """
+    Produits mentionnés dans un message (détection par mots-clés).
+
+    Args:
+        message: Message brut de l'utilisateur
+
+    Returns:
+        Liste des produits (auto, voyage, iac, mrh) mentionnés
+    """
+    tokens = set(tokenize(message or ""))
+    return [product for product, words in PRODUCT_KEYWORDS.items() if tokens & words]
+
+
+@dataclass
+class IntentMatch:
+    """Résultat d'un routage réussi"""
+    intent: str
+    confidence: float
+    reply: str
+
+
+# ============================================================================
+# HANDLERS
+# ============================================================================
+
+class IntentHandler:
+    """
+    Classe de base d'un handler d'intention.
+
+    `classify` retourne un score entre 0 et 1; `respond` produit la réponse
+    ou None pour laisser la main au LLM.
+    """
+    name: str = "base"
+    min_confidence: Optional[float] = None  # Défaut: settings.INTENT_ROUTER_MIN_CONFIDENCE
+
+    def classify(self, tokens: List[str], state: Optional[ConversationState]) -> float:
+        raise NotImplementedError
+
+    async def respond(
+        self,
+        tokens: List[str],
+        state: Optional[ConversationState]
+    ) -> Optional[str]:
+        raise NotImplementedError
+
+
+PRICE_WORDS = {
+    "prix", "tarif", "tarifs", "combien", "cout", "coute", "coutent", "forfait",
+    "forfaits", "devis", "cotisation", "prime", "grille", "montant"
+}
+
+# Mots sans valeur discriminante, tolérés autour d'une salutation ou d'une question
+FILLER_WORDS = {
+    "aya", "madame", "monsieur", "mr", "mme", "svp", "stp", "merci", "a", "vous",
+    "tous", "tout", "le", "la", "les", "de", "des", "du", "d", "l", "et", "c",
+    "est", "quel", "quels", "quelle", "quelles", "votre", "vos", "pour", "une",
+    "un", "assurance", "assurances", "je", "j", "voudrais", "veux", "aimerais",
+    "connaitre", "savoir", "avoir", "me", "donner", "donnez", "moi", "sont",
+    "en", "sur", "nsia", "offre", "offres", "ca", "cela", "proposez", "liste",
+    "bien", "ok", "oui", "s", "il", "plait", "qu", "que", "quoi", "y"
+}
+
+
+def _has_phrase(tokens: List[str], phrase: tuple) -> bool:
+    """La suite de mots apparaît telle quelle dans le message"""
+    size = len(phrase)
+    return any(tuple(tokens[i:i + size]) == phrase for i in range(len(tokens) - size + 1))
+
+
+def _unknown_ratio(tokens: List[str], known: Set[str]) -> float:
+    """Proportion de mots non reconnus (plus elle est élevée, plus le message est complexe)"""
+    if not tokens:
+        return 1.0
+    return sum(1 for t in tokens if t not in known) / len(tokens)
+
+
+class GreetingHandler(IntentHandler):
+    """Salutation seule en début de conversation"""
+    name = "greeting"
+
+    GREETINGS = {
+        "bonjour", "bonsoir", "salut", "hello", "hi", "bjr", "bsr", "slt",
+        "coucou", "hey", "yo", "cc"
+    }
+
+    def classify(self, tokens, state):
+        # En cours de souscription, une salutation ne doit pas réinitialiser le dialogue
+        if state and state.message_history:
+            return 0.0
+        if not any(t in self.GREETINGS for t in tokens):
+            return 0.0
+        return 0.95 if _unknown_ratio(tokens, self.GREETINGS | FILLER_WORDS) == 0 else 0.3
+
+    async def respond(self, tokens, state):
+        return GREETING_REPLY
+
+
+class ProductListHandler(IntentHandler):
+    """Demande de la liste des produits"""
+    name = "product_list"
+
+    PRODUCT_WORDS = {"produit", "produits", "assurance", "assurances", "offre", "offres", "services"}
+    QUESTION_WORDS = {"quels", "quelles", "liste", "proposez", "avez", "disponibles", "vendez", "faites"}
+
+    def classify(self, tokens, state):
+        if not any(t in self.PRODUCT_WORDS for t in tokens):
+            return 0.0
+        if not any(t in self.QUESTION_WORDS for t in tokens):
+            return 0.0
+        known = self.PRODUCT_WORDS | self.QUESTION_WORDS | FILLER_WORDS
+        return 0.9 if _unknown_ratio(tokens, known) <= 0.2 else 0.4
+
+    async def respond(self, tokens, state):
+        return PRODUCTS_MENU
+
+
+class MRHPricesHandler(IntentHandler):
+    """Grille tarifaire Multirisque Habitation"""
+    name = "mrh_prices"
+
+    PRODUCT_WORDS = {"mrh", "multirisque", "multirisques", "habitation", "maison", "logement"}
+    FORFAITS = {"standard", "equilibre", "confort", "premium"}
+
+    def classify(self, tokens, state):
+        if not any(t in self.PRODUCT_WORDS for t in tokens):
+            return 0.0
+        if not any(t in PRICE_WORDS for t in tokens):
+            # "MRH" seul: le client veut peut-être souscrire, on laisse le LLM guider
+            return 0.5
+        known = self.PRODUCT_WORDS | self.FORFAITS | PRICE_WORDS | FILLER_WORDS
+        return 0.9 if _unknown_ratio(tokens, known) <= 0.2 else 0.5
+
+    async def respond(self, tokens, state):
+        forfaits = [t for t in tokens if t in self.FORFAITS]
+        if len(forfaits) > 1:
+            return None
+        return format_mrh_quotation_response(forfaits[0] if forfaits else None)
+
+
+class IACPricesHandler(IntentHandler):
+    """Tarif Individuelle Accident"""
+    name = "iac_prices"
+
+    PRODUCT_WORDS = {"iac", "individuelle", "individuel", "accident", "accidents"}
+
+    def classify(self, tokens, state):
+        if not any(t in self.PRODUCT_WORDS for t in tokens):
+            return 0.0
+        if not any(t in PRICE_WORDS for t in tokens):
+            return 0.5
+        known = self.PRODUCT_WORDS | PRICE_WORDS | FILLER_WORDS
+        return 0.9 if _unknown_ratio(tokens, known) <= 0.2 else 0.5
+
+    async def respond(self, tokens, state):
+        return format_iac_quotation_response()
+
+
+class PaymentStatusHandler(IntentHandler):
+    """Suivi d'un paiement Mobile Money déjà initié"""
+    name = "payment_status"
+
+    PAYMENT_WORDS = {"paiement", "paiements", "payement", "paye", "payer", "transaction", "reglement"}
+    STATUS_WORDS = {"statut", "etat", "recu", "valide", "confirme", "passe", "abouti", "attente", "nouvelles"}
+    # "où" seul est trop ambigu ("airtel ou momo?"): seulement dans une tournure de suivi
+    STATUS_PHRASES = [("ou", "en", "est"), ("ou", "en", "sommes"), ("ou", "ca", "en", "est")]
+    # Mots attendus autour d'une question de suivi (sans valeur d'intention à eux seuls)
+    CONTEXT_WORDS = {
+        "ou", "mon", "ma", "mes", "ce", "ete", "sommes", "bonjour", "bonsoir", "momo", "airtel",
+        "mobile", "money", "confirmation", "attends", "toujours", "encore", "deja", "reference"
+    }
+
+    def classify(self, tokens, state):
+        if not state or not state.payment_reference:
+            return 0.0
+        if not any(t in self.PAYMENT_WORDS for t in tokens):
+            return 0.0
+        if not any(t in self.STATUS_WORDS for t in tokens) and not any(_has_phrase(tokens, p) for p in self.STATUS_PHRASES):
+            return 0.5
+        known = self.PAYMENT_WORDS | self.STATUS_WORDS | FILLER_WORDS | self.CONTEXT_WORDS
+        return 0.85 if _unknown_ratio(tokens, known) <= 0.2 else 0.5
+
+    async def respond(self, tokens, state):
+        from app.services.redis_client import redis_service
+        from app.services.supabase_client import supabase_service
+
+        reference = state.payment_reference
+        # Statut reporté dans la session par le callback ePay
+        status = state.payment_status
+
+        if status == "valide" or await redis_service.get_payment_confirmation(reference):
+            return (
+                f"✅ Votre paiement (réf. {reference}) a bien été confirmé!\n\n"
+                "Votre reçu et votre attestation vous sont envoyés. Merci de votre confiance! 🙏"
+            )
+
+        if status is None:
+            transaction = await supabase_service.get_transaction_by_reference(reference)
+            status = transaction.get("status") if transaction else None
+
+        if status == "valide":
+            return f"✅ Votre paiement (réf. {reference}) a bien été confirmé! Merci de votre confiance! 🙏"
+        if status == "annulée":
+            return (
+                f"❌ Le paiement (réf. {reference}) n'a pas abouti.\n\n"
+                "Souhaitez-vous réessayer ou choisir un autre mode de paiement?"
+            )
+        if status in ("en_attente", "en_cours"):
+            return (
+                f"⏳ Votre paiement (réf. {reference}) est en attente de validation.\n\n"
+                "📲 Validez-le sur votre téléphone en composant votre code PIN. "
+                "Le reçu sera envoyé automatiquement après confirmation."
+            )
+
+        # Statut inconnu: le LLM saura mieux expliquer
+        return None
+
+
+# ============================================================================
+# ROUTER
+# ============================================================================
+
+class IntentRouter:
+    """
+    Routeur d'intentions placé devant l'orchestrateur.
+
+    Les handlers sont évalués dans l'ordre d'enregistrement; le meilleur score
+    au-dessus de son seuil l'emporte. En cas d'égalité entre deux intentions
+    différentes, le routeur s'abstient.
+    """
+
+    def __init__(self, handlers: Optional[List[IntentHandler]] = None):
+        self.handlers: List[IntentHandler] = list(handlers or [])
+
+    def register(self, handler: IntentHandler) -> None:
+        """Ajoute un handler au routeur"""
+        self.handlers.append(handler)
+
+    async def route(
+        self,
+        message: str,
+        state: Optional[ConversationState] = None,
+        media_url: Optional[str] = None
+    ) -> Optional[IntentMatch]:
+        """
+        Tente de répondre au message sans LLM.
+
+        Args:
+            message: Message brut de l'utilisateur
+            state: État de conversation courant (peut être None)
+            media_url: URL d'un média (les médias passent toujours par le LLM)
+
+        Returns:
+            IntentMatch si une réponse déterministe a été produite, sinon None
+        """
+        if media_url or not message:
+            return None
+
+        tokens = tokenize(message)
+        if not tokens:
+            return None
+
+        scored = []
+        for handler in self.handlers:
+            try:
+                confidence = handler.classify(tokens, state)
+            except Exception as e:
+                logger.error(f"Erreur classification intent {handler.name}: {e}")
+                continue
+
+            threshold = handler.min_confidence
+            if threshold is None:
+                threshold = settings.INTENT_ROUTER_MIN_CONFIDENCE
+            if confidence >= threshold:
+                scored.append((confidence, handler))
+
+        if not scored:
+            return None
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        if len(scored) > 1 and scored[0][0] == scored[1][0]:
+            logger.info(f"🔀 Intent ambigu ({scored[0][1].name} / {scored[1][1].name}), délégué au LLM")
+            return None
+
+        confidence, handler = scored[0]
+        try:
+            reply = await handler.respond(tokens, state)
+        except Exception as e:
+            logger.error(f"Erreur réponse intent {handler.name}: {e}")
+            return None
+
+        if not reply:
+            return None
+
+        logger.info(f"⚡ Intent '{handler.name}' routé sans LLM (confiance {confidence:.2f})")
+        return IntentMatch(intent=handler.name, confidence=confidence, reply=reply)
+
+
+# Instance globale
+intent_router = IntentRouter([
+    GreetingHandler(),
+    ProductListHandler(),
+    MRHPricesHandler(),
+    IACPricesHandler(),
+    PaymentStatusHandler(),
+])
@@ -4,16 +4,71 @@ ORCHESTRATEUR PRINCIPAL - Système agentique AYA basé sur OpenAI Agent SDK
 Cet orchestrateur coordonne automatiquement tous les agents spécialisés pour gérer
 l'ensemble du processus de souscription, de la discussion initiale au paiement.
 """
+import asyncio
 import logging
+import time
 from typing import List, Dict, Any, Optional
-from agents import Agent, Runner
-from app.tools.agent_tools import ALL_AGENT_TOOLS
-from app.services.redis_client import redis_service
+from uuid import UUID
+from agents import Agent, Runner, ModelSettings
+from app.tools.agent_tools import ALL_AGENT_TOOLS, select_tools
+from app.agents.intent_router import intent_router, detect_product_types
+from app.agents.prompts import (
+    FULL_INSTRUCTIONS, build_instructions, resolve_sections, resolve_products,
+    prefix_fingerprint
+)
+from app.services.redis_client import session_store
+from app.services.usage_tracker import prompt_cache_stats, extract_usage
+from app.agents.context import TurnContext, prefetch_client
+from app.agents.hooks import aya_run_hooks
+from app.agents.timeline import TurnTimeline
+from app.utils.instrumentation import AGENT_RUNS_IN_FLIGHT
+from app.utils.concurrency import agent_run_admission, AgentRunRejected
+from app.services.flight_recorder import flight_recorder
+from app.utils.tracing import span
+from app.tools.quotation import TARIFF_VERSION
+from app.tools.speculation import quote_speculator, parse_trip_duration, parse_voyage_client_type
+from app.models.state import ConversationState, db_to_product_type
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
 
+# Réponse renvoyée quand un tour échoue (jamais mise en cache par la déduplication)
+ERROR_REPLY = "Désolée, j'ai rencontré une erreur. Pouvez-vous reformuler votre demande?"
+
+# Réponse immédiate quand le worker n'a pas de créneau de run d'agent (ni mise en cache, ni sauvegardée)
+BUSY_REPLY = "Désolée, je reçois beaucoup de demandes en ce moment. Pouvez-vous renvoyer votre message dans un instant?"
+
+# Ordre des étapes du workflow (ConversationState.current_step)
+STEP_ORDER = [
+    "greeting", "product_discovery", "info_collection",
+    "quotation", "payment", "confirmation", "completed"
+]
+
+# Étape atteinte quand un outil réussit (par préfixe de nom d'outil)
+TOOL_STEPS = [
+    ("analyze_", "info_collection"),
+    ("calculate_", "quotation"),
+    ("get_or_create_client", "payment"),
+    ("create_souscription", "payment"),
+    ("save_", "payment"),
+    ("initiate_", "confirmation"),
+]
+
+# Produit identifié par un outil
+TOOL_PRODUCTS = {
+    "analyze_carte_grise": "auto",
+    "calculate_auto_quotation": "auto",
+    "calculate_voyage_quotation": "voyage",
+    "calculate_iac_quotation": "iac",
+    "calculate_mrh_quotation": "mrh",
+    "save_auto_details": "auto",
+    "save_voyage_details": "voyage",
+    "save_iac_details": "iac",
+    "save_mrh_details": "mrh",
+}
+
+
 class AYAOrchestrator:
     """
     Orchestrateur principal qui coordonne tous les agents spécialisés
@@ -24,470 +79,13 @@ class AYAOrchestrator:
         """Initialise l'orchestrateur AYA"""
         self.model = settings.DEFAULT_MODEL
 
-        # Instructions système complètes pour l'agent
-        self.system_instructions = """Tu es AYA, la conseillère digitale IA de NSIA Assurances Congo.
-
-🎯 **TON RÔLE:**
-Tu accompagnes les clients du début à la fin dans la souscription d'assurances:
-1. **Accueil et découverte** - Identifier le besoin du client
-2. **Collecte d'informations** - Demander et analyser les documents nécessaires
-3. **Calcul de devis** - Utiliser les outils de quotation pour calculer les tarifs
-4. **Gestion client** - Créer ou retrouver le profil client dans la base de données
-5. **Souscription** - Enregistrer la souscription
-6. **Paiement** - Initier le paiement Mobile Money
-7. **Confirmation** - Confirmer et rassurer le client
-
-📋 **PRODUITS DISPONIBLES:**
-1. **Assurance Auto** 🚗 - Protection véhicules (personnels, taxis, transport public)
-2. **Assurance Voyage** ✈️ - Couverture internationale
-3. **Individuelle Accident (IAC)** 👨‍💼 - Protection personnelle
-4. **Multirisque Habitation (MRH)** 🏠 - Protection du logement
-
-🛠️ **OUTILS À TA DISPOSITION:**
-
-**Vision & Analyse:**
-- `analyze_carte_grise(image_url)` - Extrait les infos d'une carte grise
-- `analyze_passport(image_url)` - Extrait les infos d'un passeport
-- `analyze_cni(image_url)` - Extrait les infos d'une CNI
-- `analyze_niu(image_url)` - Extrait les infos d'un NIU
-
-**Quotations:**
-- `calculate_auto_quotation(power, seat_number, fuel_type, modele, usage)` - Calcule les tarifs AUTO
-- `calculate_voyage_quotation(client_type, zone, product, duration_days)` - Calcule les tarifs VOYAGE
-- `calculate_iac_quotation(statut)` - Calcule les tarifs IAC (Individuelle Accident)
-- `calculate_mrh_quotation(forfait)` - Calcule les tarifs MRH (Multirisque Habitation)
-
-**Base de données:**
-- `get_or_create_client(phone_number, fullname)` - Récupère ou crée un client
-- `create_souscription(client_id, product_type, prime_ttc, coverage_duration)` - Crée une souscription
-
-**Enregistrement des détails produits:**
-- `save_auto_details(souscription_id, fullname, immatriculation, power, seat_number, fuel_type, brand, phone, prime_ttc, coverage, quotation, ...)` - Enregistre les détails AUTO
-- `save_voyage_details(souscription_id, full_name, passport_number, prime_ttc, coverage, ...)` - Enregistre les détails VOYAGE
-- `save_iac_details(souscription_id, fullname, statutPro, secteurActivite, lieuTravail, prime_ttc, coverage, typeDocument, ...)` - Enregistre les détails IAC
-- `save_mrh_details(souscription_id, fullname, forfaitMrh, prime_ttc, coverage, typeDocument, ...)` - Enregistre les détails MRH
-
-**Paiements:**
-- `initiate_momo_payment(amount, phone_number, souscription_id, product_type)` - Initie paiement MTN Mobile Money
-- `initiate_airtel_payment(amount, phone_number, souscription_id, product_type)` - Initie paiement Airtel Money
-- `initiate_pay_on_delivery(amount, souscription_id, product_type, client_name, client_phone)` - **FONCTION COMPLÈTE** qui fait TOUT automatiquement:
-  • Génère référence unique
-  • Enregistre transaction dans DB
-  • Génère PDF de proposition
-  • Upload PDF vers Supabase Storage
-  • Enregistre document dans DB
-  • Retourne l'URL du PDF dans le résultat
-- `initiate_pay_on_agency(amount, souscription_id, product_type, client_name, client_phone)` - **FONCTION COMPLÈTE** qui fait TOUT automatiquement:
-  • Génère référence unique
-  • Enregistre transaction dans DB
-  • Génère PDF de proposition
-  • Upload PDF vers Supabase Storage
-  • Enregistre document dans DB
-  • Retourne l'URL du PDF dans le résultat
-
-Séquence métier correcte (OBLIGATOIRE)
-1. rechercher/créer client
-2. valider client_id (UUID)
-3. créer souscription
-4. créer détails produit
-5. initier paiement
-❌ Jamais l’inverse
-
-💳 **MODES DE PAIEMENT DISPONIBLES:**
-
-**1. MTN MOBILE MONEY** (MTN_MOBILE_MONEY):
-- ✅ Demander le numéro à débiter
-- ✅ Appeler `initiate_momo_payment()`
-- ✅ Enregistre transaction avec status="en_attente"
-- ⏳ Attendre la validation du callback
-- ✅ Envoyer le reçu UNIQUEMENT après validation (status="valide")
-
-**2. AIRTEL MOBILE MONEY** (AIRTEL_MOBILE_MONEY):
-- ✅ Demander le numéro à débiter
-- ✅ Appeler `initiate_airtel_payment()`
-- ✅ Enregistre transaction avec status="en_attente"
-- ⏳ Attendre la validation du callback
-- ✅ Envoyer le reçu UNIQUEMENT après validation (status="valide")
-
-**3. PAIEMENT À LA LIVRAISON** (PAY_ON_DELIVERY):
-- ✅ Appeler UNIQUEMENT `initiate_pay_on_delivery(amount, souscription_id, product_type, client_name, client_phone)`
-- 🤖 La fonction fait TOUT automatiquement:
-  • Enregistre transaction avec status="en_attente"
-  • Génère et upload le PDF de proposition
-  • Retourne l'URL du PDF dans `result["pdf_url"]`
-- ✅ Envoyer le message de confirmation avec l'URL du PDF au client
-- ℹ️  Le client paiera lors de la livraison du document
-
-**4. PAIEMENT EN AGENCE** (PAY_ON_AGENCY):
-- ✅ Appeler UNIQUEMENT `initiate_pay_on_agency(amount, souscription_id, product_type, client_name, client_phone)`
-- 🤖 La fonction fait TOUT automatiquement:
-  • Enregistre transaction avec status="en_attente"
-  • Génère et upload le PDF de proposition
-  • Retourne l'URL du PDF dans `result["pdf_url"]`
-- ✅ Envoyer le message de confirmation avec l'URL du PDF au client
-- ℹ️  Le client paiera directement en agence NSIA
-
-⚠️ **RÈGLES CRITIQUES PAIEMENT:**
-
-1. **TOUJOURS proposer les 4 modes** dans cet ordre:
-   ```
-   💳 Choisissez votre mode de paiement:
-   1️⃣ MTN Mobile Money
-   2️⃣ Airtel Money
-   3️⃣ Paiement à la livraison
-   4️⃣ Paiement en agence
-   ```
-
-2. **Pour MTN/Airtel:**
-   - TOUJOURS demander: "Quel numéro souhaitez-vous débiter?"
-   - Le numéro peut être différent du WhatsApp
-   - Attendre confirmation callback avant d'envoyer le reçu
-   - Message: "Validez le paiement sur votre téléphone, le reçu sera envoyé automatiquement"
-
-3. **Pour Livraison/Agence:**
-   - PAS besoin de demander autre chose que ce qui est déjà collecté
-   - Appeler DIRECTEMENT la fonction appropriée avec les paramètres
-   - La fonction retourne `result["success"]` et `result["pdf_url"]`
-   - Si `success == True`, envoyer le message de confirmation avec le PDF au client
-   - Le message est déjà inclus dans `result["message"]` - l'envoyer tel quel
-   - IMPORTANT: La fonction fait TOUT (transaction + PDF + upload), ne rien faire manuellement
-
-📖 **WORKFLOWS PAR PRODUIT:**
-
-**🚗 ASSURANCE AUTO:**
-1. Demander la carte grise → Appeler `analyze_carte_grise(image_url)`
-2. Identifier l'usage et le modèle → Convertir selon les valeurs ci-dessous
-3. Calculer → `calculate_auto_quotation(power, seat_number, fuel_type, modele, usage)`
-4. Présenter les 3 offres (3M, 6M, 12M) → Demander la période
-5. Créer client → `get_or_create_client(phone, fullname)`
-   ⚠️ RÉCUPÉRER: `client_id` depuis le résultat (ex: result["client_id"])
-6. Créer souscription → `create_souscription(client_id, "NSIA AUTO", prime_ttc, periode)`
-   ⚠️ IMPORTANT: product_type DOIT être "NSIA AUTO" (valeur exacte de la DB)
-   ⚠️ RÉCUPÉRER: `souscription_id` depuis le résultat (ex: result["souscription_id"]) - C'est un UUID!
-7. Enregistrer détails → `save_auto_details(souscription_id, fullname, immatriculation, ...)`
-   ⚠️ UTILISER le souscription_id récupéré à l'étape 6 (pas une chaîne littérale!)
-8. Proposer les 4 modes de paiement → Selon le choix:
-   - MTN: `initiate_momo_payment(amount, phone_number, souscription_id, product_type)`
-   - Airtel: `initiate_airtel_payment(amount, phone_number, souscription_id, product_type)`
-   - Livraison: `initiate_pay_on_delivery(amount, souscription_id, product_type, client_name, client_phone)` ← Génère PDF auto
-   - Agence: `initiate_pay_on_agency(amount, souscription_id, product_type, client_name, client_phone)` ← Génère PDF auto
-
-**CONVERSION USAGE AUTO** (le client dit → tu utilises):
-- "voiture personnelle", "usage personnel", "promenade" → usage="PROMENADE/AFFAIRES"
-- "transport de marchandises pour mon compte" → usage="TRANSPORT POUR PROPRE COMPTE"
-- "transport de marchandises" → usage="TRANSPORT PUBLIC DE MARCHANDISES"
-- "taxi", "transport de personnes" → usage="TRANSPORT PUBLIC VOYAGEURS" (modele="TAXI")
-
-**CONVERSION MODELE AUTO** (le client dit → tu utilises):
-- "voiture", "berline", "4x4", "SUV" → modele="VOITURE"
-- "taxi" → modele="TAXI" (usage obligatoire: "TRANSPORT PUBLIC VOYAGEURS")
-- "picnic", "minibus 9 places" → modele="PICNIC" (usage obligatoire: "TRANSPORT PUBLIC VOYAGEURS")
-- "mini-bus", "minibus" → modele="MINI-BUS" (usage obligatoire: "TRANSPORT PUBLIC VOYAGEURS")
-- "coaster", "bus" → modele="COASTER" (usage obligatoire: "TRANSPORT PUBLIC VOYAGEURS")
-- "pick-up", "camionnette" → modele="PICK-UP"
-- "camion", "poids lourd" → modele="CAMION"
-
-**CONVERSION ENERGIE AUTO** (le client dit → tu utilises):
-- "essence", "super", "SP95" → fuel_type="ESSENCE"
-- "diesel", "gasoil", "mazout" → fuel_type="DIESEL"
-
-**💡 RECOMMANDATIONS INTELLIGENTES AUTO:**
-
-Aide le client à choisir la meilleure période de couverture:
-
-**Analyse du budget:**
-- Si budget serré → Recommande 3 MOIS (paiement fractionné, renouvellement flexible)
-- Si budget moyen → Recommande 6 MOIS (bon compromis)
-- Si budget confortable → Recommande 12 MOIS (meilleur rapport qualité/prix, pas de souci de renouvellement)
-
-**Conseils selon le véhicule:**
-- Véhicule neuf ou récent → Recommande 12 MOIS (protection continue optimale)
-- Véhicule ancien → Propose 3 ou 6 MOIS selon budget
-- Taxi/Transport public → Recommande fortement 12 MOIS (continuité d'activité professionnelle)
-
-**Mise en avant des économies:**
-- TOUJOURS présenter les 3 options (3M, 6M, 12M) avec les tarifs
-- Calculer et mentionner l'économie sur 12 mois vs 4x3 mois (environ 10-15% d'économie)
-- Exemple: "Sur 12 mois, vous économisez X FCFA par rapport à 4 renouvellements de 3 mois"
-
-**✈️ ASSURANCE VOYAGE:**
-1. Demander le passeport → Appeler `analyze_passport(image_url)`
-2. Identifier le TYPE DE CLIENT → Convertir selon les valeurs ci-dessous
-3. Proposer les ZONES disponibles pour ce type de client
-4. Proposer les PRODUITS disponibles pour la combinaison client_type + zone
-5. Demander la DURÉE du séjour en jours
-6. Calculer → `calculate_voyage_quotation(client_type, zone, product, duration_days)`
-7. Présenter le tarif → Confirmer
-8. Créer client → `get_or_create_client(phone, fullname)`
-   ⚠️ RÉCUPÉRER: `client_id` depuis le résultat
-9. Créer souscription → `create_souscription(client_id, "NSIA VOYAGE", tarif_ttc, duree)`
-   ⚠️ IMPORTANT: product_type DOIT être "NSIA VOYAGE" (valeur exacte de la DB)
-   ⚠️ RÉCUPÉRER: `souscription_id` depuis le résultat - C'est un UUID!
-10. Enregistrer détails → `save_voyage_details(souscription_id, full_name, passport_number, prime_ttc, coverage, ...)`
-    ⚠️ UTILISER le souscription_id récupéré à l'étape 9
-11. Proposer les 4 modes de paiement → Selon le choix:
-    - MTN: `initiate_momo_payment(amount, phone_number, souscription_id, product_type)`
-    - Airtel: `initiate_airtel_payment(amount, phone_number, souscription_id, product_type)`
-    - Livraison: `initiate_pay_on_delivery(amount, souscription_id, product_type, client_name, client_phone)` ← Génère PDF auto
-    - Agence: `initiate_pay_on_agency(amount, souscription_id, product_type, client_name, client_phone)` ← Génère PDF auto
-
-**🔑 COMBINAISONS VALIDES VOYAGE (CLIENT → ZONE → PRODUITS):**
-
-**1. PARTICULIER** (voyages personnels, familles, tourisme):
-
-   📍 **Zone: EUROPE**
-   - Produits disponibles:
-     • "EUROPE ET SCHENGEN" - Couverture complète Europe + espace Schengen
-     • "SCHENGEN EXCLUSIF" - Couverture espace Schengen uniquement
-   - Durées: 0-730 jours (jusqu'à 2 ans)
-
-   📍 **Zone: MONDE ENTIER (EXCEPTÉ Le Congo)**
-   - Produits disponibles:
-     • "ECONOMIE" - Formule économique basique
-     • "FAMILLE" - Formule famille avec garanties étendues
-     • "PERLE" - Formule intermédiaire confort
-     • "VOYAGEUR" - Formule premium tout compris
-   - Durées: 0-730 jours (jusqu'à 2 ans)
-
-**2. ETUDIANT** (études à l'étranger):
-
-   📍 **Zone: MONDE ENTIER** (uniquement cette zone disponible pour étudiants)
-   - Produits disponibles:
-     • "ETUDIANT ECONOMIQUE" - Formule économique
-     • "ETUDIANT CLASSIQUE" - Formule standard
-     • "ETUDIANT PREMIUM" - Formule premium
-   - Durées: 0-365 jours (année scolaire)
-
-**3. PELERIN** (pèlerinages religieux):
-
-   📍 **Zone: MONDE ENTIER (EX. Lieux Saints Schengen)** (uniquement cette zone pour pèlerins)
-   - Produits disponibles:
-     • "PÈLERINAGE BASIC" - Couverture basique
-     • "PÈLERINAGE PLUS" - Couverture intermédiaire
-     • "PÈLERINAGE EXTRA" - Couverture maximale
-   - Durées: 0-45 jours
-
-**🎯 WORKFLOW INTELLIGENT VOYAGE:**
-
-1. **Identifier le type de client:**
-   - Le client dit "étudiant" → client_type="ETUDIANT"
-   - Le client dit "pèlerinage", "hadj", "omra" → client_type="PELERIN"
-   - Le client dit "voyage", "tourisme", "famille" → client_type="PARTICULIER"
-
-2. **Proposer UNIQUEMENT les zones valides pour ce client:**
-   - PARTICULIER → Propose "EUROPE" OU "MONDE ENTIER (EXCEPTÉ Le Congo)"
-   - ETUDIANT → Utilise directement "MONDE ENTIER" (zone unique)
-   - PELERIN → Utilise directement "MONDE ENTIER (EX. Lieux Saints Schengen)" (zone unique)
-
-3. **Proposer UNIQUEMENT les produits valides pour la combinaison client_type + zone:**
-   - PARTICULIER + EUROPE → Propose "EUROPE ET SCHENGEN" ou "SCHENGEN EXCLUSIF"
-   - PARTICULIER + MONDE ENTIER (EXCEPTÉ Le Congo) → Propose "ECONOMIE", "FAMILLE", "PERLE", "VOYAGEUR"
-   - ETUDIANT + MONDE ENTIER → Propose "ETUDIANT ECONOMIQUE", "ETUDIANT CLASSIQUE", "ETUDIANT PREMIUM"
-   - PELERIN + MONDE ENTIER (EX. Lieux Saints Schengen) → Propose "PÈLERINAGE BASIC", "PÈLERINAGE PLUS", "PÈLERINAGE EXTRA"
-
-⚠️ **RÈGLES CRITIQUES VOYAGE:**
-- NE JAMAIS proposer une combinaison client_type/zone/product qui n'existe pas dans le tableau ci-dessus
-- TOUJOURS utiliser les valeurs EXACTES (majuscules, accents, espaces)
-- Si le client demande une combinaison invalide, expliquer gentiment les options disponibles
-
-**💡 RECOMMANDATIONS INTELLIGENTES VOYAGE:**
-
-Fais des recommandations personnalisées selon le profil du client:
-
-**Pour PARTICULIER → EUROPE:**
-- Courte durée (0-15 jours) → Recommande "SCHENGEN EXCLUSIF" (moins cher, suffit pour la plupart des visas)
-- Longue durée (>15 jours) ou multi-pays → Recommande "EUROPE ET SCHENGEN" (couverture plus large)
-
-**Pour PARTICULIER → MONDE ENTIER (EXCEPTÉ Le Congo):**
-- Budget limité → Recommande "ECONOMIE" (couverture basique économique)
-- Voyage en famille avec enfants → Recommande "FAMILLE" (garanties familiales étendues)
-- Voyageur régulier → Recommande "PERLE" (bon rapport qualité/prix)
-- Besoin de couverture maximale → Recommande "VOYAGEUR" (formule premium complète)
-
-**Pour ETUDIANT → MONDE ENTIER:**
-- Budget très limité → Recommande "ETUDIANT ECONOMIQUE"
-- Budget moyen, séjour standard → Recommande "ETUDIANT CLASSIQUE"
-- Besoin de garanties étendues, sports/activités → Recommande "ETUDIANT PREMIUM"
-
-**Pour PELERIN → MONDE ENTIER (EX. Lieux Saints Schengen):**
-- Pèlerinage simple, budget limité → Recommande "PÈLERINAGE BASIC"
-- Séjour standard → Recommande "PÈLERINAGE PLUS"
-- Personne âgée ou besoins médicaux → Recommande "PÈLERINAGE EXTRA" (couverture maximale)
-
-**CONSEILS TARIFAIRES:**
-- Durées courtes: Explique qu'au-delà de certains seuils (7j, 15j, 21j, 31j, etc.), le tarif change
-- Durées longues: Propose d'optimiser la durée pour tomber dans une tranche moins chère si proche d'un seuil
-- Exemple: Si client demande 32 jours, propose 31 jours si possible (économie sur le tarif)
-
-**👨‍💼 INDIVIDUELLE ACCIDENT (IAC):**
-1. Demander le statut professionnel et les informations (secteur d'activité, lieu de travail)
-2. Calculer → `calculate_iac_quotation(statut)` ou `calculate_iac_quotation()` pour tous
-3. Présenter les offres par statut
-4. Demander le document d'identité (Passeport/NIU/CNI) → Appeler l'outil d'analyse correspondant
-5. Créer client → `get_or_create_client(phone, fullname)`
-   ⚠️ RÉCUPÉRER: `client_id` depuis le résultat
-6. Créer souscription → `create_souscription(client_id, "NSIA INDIVIDUEL ACCIDENTS", prime_ttc, "12M")`
-   ⚠️ IMPORTANT: product_type DOIT être "NSIA INDIVIDUEL ACCIDENTS" (valeur exacte de la DB)
-   ⚠️ RÉCUPÉRER: `souscription_id` depuis le résultat - C'est un UUID!
-7. Enregistrer détails → `save_iac_details(souscription_id, fullname, statutPro, secteurActivite, lieuTravail, prime_ttc, coverage, typeDocument, ...)`
-   ⚠️ UTILISER le souscription_id récupéré à l'étape 6
-8. Proposer les 4 modes de paiement → Selon le choix:
-   - MTN: `initiate_momo_payment(amount, phone_number, souscription_id, product_type)`
-   - Airtel: `initiate_airtel_payment(amount, phone_number, souscription_id, product_type)`
-   - Livraison: `initiate_pay_on_delivery(amount, souscription_id, product_type, client_name, client_phone)` ← Génère PDF auto
-   - Agence: `initiate_pay_on_agency(amount, souscription_id, product_type, client_name, client_phone)` ← Génère PDF auto
-
-**💡 RECOMMANDATIONS INTELLIGENTES IAC:**
-
-**Tarif unique: 12,500 FCFA/an pour tous les statuts professionnels**
-
-**Profils particulièrement concernés:**
-- Commerçants → Recommande fortement (risques liés à l'activité commerciale)
-- Travailleurs indépendants → Recommande fortement (pas de protection employeur)
-- Entrepreneurs → Recommande fortement (protection personnelle essentielle)
-
-**Arguments de vente:**
-- Couverture complète 24h/24, 7j/7 (accidents professionnels ET vie privée)
-- Garanties incluses: Décès, Invalidité, Frais médicaux, Indemnités hospitalisation, Capital incapacité
-- Tarif unique très abordable: seulement 1,042 FCFA/mois
-- Protection indispensable pour les indépendants sans couverture employeur
-
-**Documents acceptés:**
-- Passeport (recommandé pour identification internationale)
-- NIU (Numéro d'Identification Unique)
-- CNI (Carte Nationale d'Identité)
-
-**🏠 MULTIRISQUE HABITATION (MRH):**
-1. Présenter les forfaits → `calculate_mrh_quotation()` pour tous les forfaits
-2. Demander quel forfait intéresse → `calculate_mrh_quotation(forfait)` pour les détails
-3. Confirmer le choix
-4. Demander le document d'identité (Passeport/NIU/CNI) → Appeler l'outil d'analyse correspondant
-5. Créer client → `get_or_create_client(phone, fullname)`
-   ⚠️ RÉCUPÉRER: `client_id` depuis le résultat
-6. Créer souscription → `create_souscription(client_id, "NSIA MULTIRISQUE HABITATION", prime_annuelle, "12M")`
-   ⚠️ IMPORTANT: product_type DOIT être "NSIA MULTIRISQUE HABITATION" (valeur exacte de la DB)
-   ⚠️ RÉCUPÉRER: `souscription_id` depuis le résultat - C'est un UUID!
-7. Enregistrer détails → `save_mrh_details(souscription_id, fullname, forfaitMrh, prime_ttc, coverage, typeDocument, ...)`
-   ⚠️ UTILISER le souscription_id récupéré à l'étape 6
-8. Proposer les 4 modes de paiement → Selon le choix:
-   - MTN: `initiate_momo_payment(amount, phone_number, souscription_id, product_type)`
-   - Airtel: `initiate_airtel_payment(amount, phone_number, souscription_id, product_type)`
-   - Livraison: `initiate_pay_on_delivery(amount, souscription_id, product_type, client_name, client_phone)` ← Génère PDF auto
-   - Agence: `initiate_pay_on_agency(amount, souscription_id, product_type, client_name, client_phone)` ← Génère PDF auto
-
-**💡 RECOMMANDATIONS INTELLIGENTES MRH:**
-
-**4 FORFAITS DISPONIBLES:**
-
-**1. STANDARD - 25,500 FCFA/an** (Couverture: 22M FCFA)
-- Recommandé pour: Studio, petit appartement, locataires, budget limité
-- Garanties: Incendie, Dégâts eaux, Vol, RC vie privée, Bris de glace
-- Arguments: Protection essentielle à prix abordable, idéal pour débuter
-
-**2. ÉQUILIBRE - 35,000 FCFA/an** (Couverture: 33M FCFA)
-- Recommandé pour: Appartements moyens, petites maisons, familles
-- Garanties: + Catastrophes naturelles, Dommages électriques
-- Arguments: Meilleur rapport qualité/prix, protection étendue aux risques climatiques
-
-**3. CONFORT - 50,000 FCFA/an** (Couverture: 55M FCFA)
-- Recommandé pour: Grandes maisons, biens de valeur, familles avec enfants
-- Garanties: + Protection juridique, Assistance habitation 24h/24
-- Arguments: Protection complète avec services premium, assistance 24h/24
-
-**4. PREMIUM - 120,750 FCFA/an** (Couverture: 115M FCFA)
-- Recommandé pour: Villas de luxe, biens de grande valeur, piscine/jardin
-- Garanties: + Objets de valeur, Jardin et dépendances, Piscine
-- Arguments: Couverture maximale pour patrimoines importants, tous risques
-
-**CONSEILS DE VENTE:**
-- Toujours demander: Type de logement (studio/appartement/villa), Superficie, Présence piscine/jardin
-- Comparer avec le loyer: "Pour seulement X% de votre loyer mensuel, protégez tous vos biens"
-- Mettre en avant la RC vie privée (obligatoire pour locataires, protège des dommages causés)
-- Mentionner l'assistance 24h/24 pour Confort et Premium (plombier, serrurier, etc.)
-
-⚠️ **RÈGLES CRITIQUES:**
-
-1. **Utilise TOUJOURS les outils** - Ne devine JAMAIS les prix ou infos
-2. **Convertis le langage naturel** - TOUJOURS utiliser les valeurs EXACTES des tableaux de conversion ci-dessus
-   - Client dit "voiture personnelle" → TU UTILISES usage="PROMENADE/AFFAIRES" (JAMAIS "personnel" ou autre)
-   - Client dit "étudiant" → TU UTILISES client_type="ETUDIANT" (EN MAJUSCULES)
-   - Client dit "Europe" → TU UTILISES zone="EUROPE" (EN MAJUSCULES)
-3. **Valeurs exactes pour la base de données** - TOUJOURS utiliser les valeurs EXACTES suivantes:
-   - **product_type**: "NSIA AUTO", "NSIA VOYAGE", "NSIA INDIVIDUEL ACCIDENTS", "NSIA MULTIRISQUE HABITATION"
-   - **status**: "en_cours" (défaut à la création), "valide", "expirée", "annulée", "en_attente"
-   - **payment_method**: "MTN_MOBILE_MONEY", "AIRTEL_MOBILE_MONEY", "PAY_ON_DELIVERY", "PAY_ON_AGENCY"
-4. **Une question à la fois** - Ne submerge pas le client
-5. **Confirme chaque étape** - Avant de passer à la suivante
-6. **Sois précise** - Donne les montants exacts, pas d'approximations
-7. **Garde le contexte** - L'historique de la conversation est préservé
-8. **Gère les erreurs** - Si un outil échoue, demande poliment de réessayer
-9. **Sois chaleureuse** - Tout en restant professionnelle
-
-💡 **EXEMPLE CONVERSATION:**
-
-Client: "Bonjour"
-AYA: "Bonjour! 👋 Je suis AYA, votre conseillère digitale NSIA Assurances.
-Je vous aide à souscrire en 3 minutes!
-
-🏢 Produits disponibles:
-1️⃣ Assurance Auto 🚗
-2️⃣ Assurance Voyage ✈️
-3️⃣ Individuelle Accident 👨‍💼
-4️⃣ Multirisque Habitation 🏠
-
-Quel produit vous intéresse?"
-
-Client: "1"
-AYA: "Parfait! Assurance Auto 🚗
-
-Pour calculer votre devis, j'ai besoin de votre carte grise.
-📸 Envoyez-moi une photo claire de votre carte grise."
-
-[Client envoie photo]
-AYA: [Appelle analyze_carte_grise(url)]
-"✅ Carte grise analysée!
-Voiture de 7CV, 5 places, ESSENCE
-[Appelle calculate_auto_quotation(...)]
-
-🎯 Votre Devis NSIA Auto:
-✅ 3 MOIS: 75,000 FCFA
-✅ 6 MOIS: 142,500 FCFA
-✅ 12 MOIS: 270,000 FCFA
-
-Quelle période choisissez-vous? (3M, 6M ou 12M)"
-
-Client: "12M"
-AYA: [Appelle get_or_create_client(...)]
-[Appelle create_souscription(...)]
-"✅ Souscription enregistrée!
-
-💳 Choisissez votre mode de paiement:
-1️⃣ MTN Mobile Money
-2️⃣ Airtel Money
-
-Répondez 1 ou 2"
-
-Client: "1"
-AYA: [Appelle initiate_momo_payment(...)]
-"✅ Paiement initié!
-
-💰 Montant: 270,000 FCFA
-📱 Provider: MTN Mobile Money
-🔑 Référence: REF123456
-
-📲 Vous allez recevoir un message USSD
-Composez votre code PIN pour valider.
-
-Après paiement, vous recevrez:
-- Reçu de paiement
-- Attestation d'assurance
-
-Merci de votre confiance! 🙏"
-
-🎯 **TON OBJECTIF:**
-Mener CHAQUE client du début à la fin avec succès.
-Utilise intelligemment tes outils pour automatiser le processus.
-"""
+        # Instructions système complètes (toutes étapes, tous produits).
+        # Les runs de process_conversation n'en chargent que les sections utiles.
+        self.system_instructions = FULL_INSTRUCTIONS
+
+        # Agents par (sections, produits): instructions, outils et réglages
+        # construits une seule fois pour garder un préfixe identique entre sessions
+        self._agents: Dict[tuple, Agent] = {}
 
         logger.info("✅ AYA Orchestrator initialisé")
 
@@ -496,7 +94,8 @@ Utilise intelligemment tes outils pour automatiser le processus.
         user_message: str,
         session_id: str,
         user_phone: str,
-        media_url: Optional[str] = None
+        media_url: Optional[str] = None,
+        timeline: Optional[TurnTimeline] = None
     ) -> str:
         """
         Traite un message utilisateur dans le contexte de la conversation.
@@ -506,64 +105,217 @@ Utilise intelligemment tes outils pour automatiser le processus.
             session_id: ID de session pour l'historique
             user_phone: Numéro de téléphone de l'utilisateur
             media_url: URL d'un média (image) si présent
+            timeline: Chronologie à remplir (créée en interne si absente)
 
         Returns:
             Réponse de l'agent
         """
+        timeline = timeline if timeline is not None else TurnTimeline()
+        turn_started = time.perf_counter()
+        turn_context = None
+        client_prefetch = None
+
         try:
             # Construire le message complet
             full_message = self._build_message_with_context(
                 user_message, user_phone, media_url
             )
 
-            # Récupérer l'historique de conversation depuis Redis
-            history = await self._get_conversation_history(session_id)
+            # Précharger le client (Supabase, dans un thread) pendant la lecture du state Redis
+            if settings.CLIENT_PREFETCH_ENABLED and user_phone:
+                client_prefetch = asyncio.create_task(prefetch_client(user_phone))
+                await asyncio.sleep(0)  # Laisser la requête partir avant la lecture Redis
+
+            # Récupérer l'état de conversation depuis Redis
+            with timeline.stage("redis_load"):
+                state = await self._get_conversation_state(session_id, user_phone)
 
-            # Ajouter le nouveau message utilisateur à l'historique
             new_user_message = {
                 "role": "user",
                 "content": full_message
             }
-            history.append(new_user_message)
+
+            # Fast-path: intentions fréquentes traitées sans LLM
+            if settings.INTENT_ROUTER_ENABLED:
+                with timeline.stage("intent_router"):
+                    match = await intent_router.route(user_message, state, media_url)
+                if match:
+                    records = flight_recorder.turn_records(
+                        user_message, match.reply, "intent_router", [], self._elapsed_ms(turn_started)
+                    )
+                    with timeline.stage("history_save"):
+                        await self._save_conversation_history(state, new_user_message, match.reply, records)
+                    timeline.record("turn", turn_started, route="intent_router")
+                    return match.reply
+
+            # Lancer en arrière-plan les devis déjà déductibles (carte grise, passeport + durée)
+            self._collect_turn_facts(state, user_message)
+            quote_speculator.speculate_for_state(state)
+
+            # Ajouter le nouveau message utilisateur à l'historique
+            # (un devis précalculé est ajouté pour ce tour seulement, jamais sauvegardé)
+            history = self._history_from_state(state)
+            fact = quote_speculator.precomputed_fact(state)
+            if fact:
+                history.append({"role": "user", "content": f"{full_message}\n\n{fact}"})
+            else:
+                history.append(new_user_message)
 
             logger.info(f"💬 Traitement message pour session {session_id}: {user_message[:50]}...")
             if media_url:
                 logger.info(f"🖼️  Media URL fourni: {media_url[:100]}...")
             logger.info(f"📚 Historique: {len(history)} message(s)")
 
-            # Créer l'agent AYA avec tous les outils
-            aya_agent = Agent(
-                name="AYA",
-                instructions=self.system_instructions,
-                model=self.model,
-                tools=ALL_AGENT_TOOLS
-            )
+            # Ne charger que les instructions et outils utiles à l'étape courante
+            turn_products = self._turn_products(state, user_message)
+            sections = resolve_sections(state.current_step)
+            products = resolve_products(sections, turn_products)
+            logger.info(f"🧭 Étape: {state.current_step}, sections: {sections}, produits: {products or 'tous'}")
+
+            aya_agent = self._get_agent(sections, products)
 
             # Exécuter l'agent avec l'historique complet depuis Redis
             # IMPORTANT: On passe l'historique complet et on ne utilise PAS conversation_id
             # Redis gère la mémoire, pas le SDK OpenAI
-            result = await Runner.run(
-                starting_agent=aya_agent,
-                input=history  # Historique complet depuis Redis
+            turn_context = TurnContext(
+                state=state,
+                user_message=user_message,
+                client_prefetch=client_prefetch,
+                prefetch_phone=user_phone if client_prefetch else None,
+                timeline=timeline
             )
+            # Plafond des runs simultanés du worker: au-delà, attente bornée puis refus rapide
+            try:
+                with timeline.stage("admission"):
+                    await agent_run_admission.acquire()
+            except AgentRunRejected as e:
+                logger.warning(f"🚦 Run refusé pour session {session_id}: {e}")
+                timeline.record("turn", turn_started, route="overloaded")
+                return BUSY_REPLY
+
+            AGENT_RUNS_IN_FLIGHT.inc()
+            try:
+                with timeline.stage("agent_run"), span("agent.run", **{
+                    "aya.session_id": session_id,
+                    "aya.product_type": state.product_type,
+                    "aya.current_step": state.current_step,
+                    "aya.tariff_version": TARIFF_VERSION,
+                    "aya.model": self.model_name,
+                }):
+                    result = await Runner.run(
+                        starting_agent=aya_agent,
+                        input=history,  # Historique complet depuis Redis
+                        context=turn_context,
+                        hooks=aya_run_hooks
+                    )
+            finally:
+                AGENT_RUNS_IN_FLIGHT.dec()
+                agent_run_admission.release()
 
             # Extraire la réponse
             response = result.final_output if hasattr(result, 'final_output') else str(result)
 
+            # Reporter dans l'état ce que les outils ont produit (référence de paiement, ...)
+            self._record_tool_outcomes(state, result)
+            quote_speculator.record(state)
+
+            # Comptabiliser les tokens servis depuis le cache du provider
+            usage = extract_usage(getattr(result, "raw_responses", []))
+            prompt_cache_stats.record(self.model_name, usage)
+            state.add_token_usage(usage)
+
             # Sauvegarder l'historique mis à jour avec la réponse de l'assistant
-            await self._save_conversation_history(
-                session_id,
-                new_user_message,
-                response
+            # (les étapes du tour partent dans le même aller-retour Redis)
+            records = flight_recorder.turn_records(
+                user_message, response, "agent", turn_context.steps, self._elapsed_ms(turn_started)
             )
+            with timeline.stage("history_save"):
+                await self._save_conversation_history(
+                    state,
+                    new_user_message,
+                    response,
+                    records
+                )
 
+            timeline.record("turn", turn_started, route="agent")
             logger.info(f"✅ Réponse générée pour session {session_id}")
 
             return response
 
         except Exception as e:
             logger.error(f"❌ Erreur process_conversation: {e}", exc_info=True)
-            return "Désolée, j'ai rencontré une erreur. Pouvez-vous reformuler votre demande?"
+            turn = timeline.record("turn", turn_started, route="error", error=str(e)[:200])
+            await flight_recorder.record_turn(
+                session_id, user_message, ERROR_REPLY, "error",
+                turn_context.steps if turn_context else [], turn["duration_ms"]
+            )
+            return ERROR_REPLY
+
+        finally:
+            # Tour terminé sans LLM (intent router, refus d'admission) ou sans l'outil client
+            self._discard_prefetch(client_prefetch)
+
+    @staticmethod
+    def _discard_prefetch(task: Optional[asyncio.Task]) -> None:
+        """Annule un préchargement client non utilisé, ou récupère son exception"""
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ Préchargement client en échec: {task.exception()}")
+
+    @staticmethod
+    def _elapsed_ms(started: float) -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    @property
+    def model_name(self) -> str:
+        """Nom du modèle (self.model peut être un nom ou une instance de Model)"""
+        if isinstance(self.model, str):
+            return self.model
+        return getattr(self.model, "model", type(self.model).__name__)
+
+    def _get_agent(self, sections: tuple, products: tuple) -> Agent:
+        """
+        Retourne l'agent AYA pour un jeu de sections et de produits.
+
+        Le contenu dynamique (téléphone, média, historique) n'entre jamais dans
+        les instructions: il est porté par les messages, après le préfixe statique.
+
+        Args:
+            sections: Sections du workflow
+            products: Produits concernés
+
+        Returns:
+            Agent configuré (mis en cache)
+        """
+        key = (sections, products, self.model_name)
+        agent = self._agents.get(key)
+        if agent is not None:
+            return agent
+
+        instructions = build_instructions(sections, products)
+        tools = select_tools(sections, products)
+        fingerprint = prefix_fingerprint(instructions, tools)
+
+        # Les appels d'outils indépendants d'une même étape sont exécutés en parallèle
+        model_settings = ModelSettings(parallel_tool_calls=settings.PARALLEL_TOOL_CALLS)
+        if settings.PROMPT_CACHE_KEY_ENABLED:
+            model_settings = model_settings.resolve(
+                ModelSettings(extra_args={"prompt_cache_key": f"aya-{fingerprint}"})
+            )
+
+        agent = Agent(
+            name="AYA",
+            instructions=instructions,
+            model=self.model,
+            tools=tools,
+            model_settings=model_settings
+        )
+        self._agents[key] = agent
+        logger.info(f"🧱 Préfixe {fingerprint}: {len(instructions)} caractères, {len(tools)} outils")
+        return agent
 
     def _build_message_with_context(
         self,
@@ -604,61 +356,172 @@ Utilise intelligemment tes outils pour automatiser le processus.
 
         return "\n".join(context_parts)
 
-    async def _get_conversation_history(self, session_id: str) -> List[Dict[str, str]]:
+    async def _get_conversation_state(self, session_id: str, user_phone: str) -> ConversationState:
         """
-        Récupère l'historique de conversation depuis Redis.
+        Récupère l'état de conversation depuis Redis, ou en crée un nouveau.
 
         Args:
             session_id: ID de session
+            user_phone: Numéro de téléphone du client
 
         Returns:
-            Liste de messages
+            État de conversation
         """
         try:
-            state = await redis_service.get_conversation_state(session_id)
-
-            if state and state.message_history:
-                # Convertir au format attendu par le SDK
-                return [
-                    {
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    }
-                    for msg in state.message_history
-                ]
+            # TTL glissant prolongé à la lecture (même si le tour échoue ensuite)
+            state = await session_store.get_conversation_state(session_id, touch=True)
+        except Exception as e:
+            logger.error(f"Erreur récupération historique: {e}")
+            state = None
 
+        if state is None:
             # Nouvelle conversation
-            return []
+            state = ConversationState(session_id=session_id, user_phone=user_phone)
+        elif not state.user_phone:
+            state.user_phone = user_phone
 
-        except Exception as e:
-            logger.error(f"Erreur récupération historique: {e}")
-            return []
+        return state
+
+    def _history_from_state(self, state: ConversationState) -> List[Dict[str, str]]:
+        """
+        Convertit l'historique de l'état au format attendu par le SDK.
+
+        Args:
+            state: État de conversation
+
+        Returns:
+            Liste de messages
+        """
+        return [
+            {
+                "role": msg["role"],
+                "content": msg["content"]
+            }
+            for msg in state.message_history
+        ]
+
+    def _turn_products(self, state: ConversationState, user_message: str) -> List[str]:
+        """
+        Produits concernés par ce tour: celui de la session et ceux mentionnés.
+
+        Args:
+            state: État de conversation
+            user_message: Message brut de l'utilisateur
+
+        Returns:
+            Liste des produits (auto, voyage, iac, mrh)
+        """
+        mentioned = detect_product_types(user_message)
+
+        # Un seul produit cité: il devient le produit de la session
+        if len(mentioned) == 1 and mentioned[0] != state.product_type:
+            if state.product_type is None:
+                state.product_type = mentioned[0]
+            elif state.current_step in ("confirmation", "completed"):
+                # Nouvelle souscription après une souscription terminée
+                state.product_type = mentioned[0]
+                state.update_step("product_discovery")
+
+        products = set(mentioned)
+        if state.product_type:
+            products.add(state.product_type)
+        return list(products)
+
+    def _collect_turn_facts(self, state: ConversationState, user_message: str) -> None:
+        """
+        Extrait du message les paramètres de devis donnés en clair (durée et type de voyage).
+
+        Args:
+            state: État de conversation
+            user_message: Message brut de l'utilisateur
+        """
+        if state.product_type not in (None, "voyage"):
+            return
+
+        duration = parse_trip_duration(user_message)
+        if duration:
+            state.collected_data["trip_duration"] = duration
+
+        client_type = parse_voyage_client_type(user_message)
+        if client_type:
+            state.collected_data["voyage_client_type"] = client_type
+
+    def _record_tool_outcomes(self, state: ConversationState, result: Any) -> None:
+        """
+        Reporte dans l'état les résultats d'outils utiles aux tours suivants:
+        étape du workflow, produit, référence de paiement.
+
+        Args:
+            state: État de conversation
+            result: Résultat du Runner
+        """
+        tool_names = {}
+        for item in getattr(result, "new_items", []):
+            if getattr(item, "type", None) == "tool_call_item":
+                raw = item.raw_item
+                call_id = getattr(raw, "call_id", None)
+                if call_id:
+                    tool_names[call_id] = getattr(raw, "name", None)
+
+        for item in getattr(result, "new_items", []):
+            if getattr(item, "type", None) != "tool_call_output_item":
+                continue
+
+            raw = item.raw_item
+            call_id = raw.get("call_id") if isinstance(raw, dict) else getattr(raw, "call_id", None)
+            tool_name = tool_names.get(call_id) or ""
+
+            output = item.output
+            if not isinstance(output, dict) or output.get("error") or output.get("success") is False:
+                continue
+
+            # Avancer dans le workflow (jamais de retour en arrière)
+            for prefix, step in TOOL_STEPS:
+                if tool_name.startswith(prefix):
+                    if STEP_ORDER.index(step) > STEP_ORDER.index(state.current_step):
+                        state.update_step(step)
+                    break
+
+            # Identifier le produit (la carte grise ne fait que le deviner s'il est inconnu)
+            product = TOOL_PRODUCTS.get(tool_name)
+            if tool_name == "create_souscription" and output.get("product_type"):
+                product = db_to_product_type(output["product_type"])
+            if tool_name == "analyze_carte_grise" and state.product_type:
+                product = None
+            if product in ("auto", "voyage", "iac", "mrh"):
+                state.product_type = product
+
+            # Identifiants client / souscription pour les tours suivants
+            if tool_name == "get_or_create_client" and output.get("client_id"):
+                state.client_id = UUID(str(output["client_id"]))
+            if tool_name == "create_souscription" and output.get("souscription_id"):
+                state.souscription_id = UUID(str(output["souscription_id"]))
+
+            # Paiement Mobile Money initié: mémoriser la référence pour le suivi
+            provider = output.get("provider")
+            if output.get("reference") and provider in ("MTN Mobile Money", "Airtel Money"):
+                state.payment_initiated = True
+                state.payment_reference = output["reference"]
+                state.payment_status = None
+                state.payment_provider = "momo" if provider.startswith("MTN") else "airtel"
 
     async def _save_conversation_history(
         self,
-        session_id: str,
+        state: ConversationState,
         user_message: Dict[str, str],
-        assistant_response: str
+        assistant_response: str,
+        flight_records: Optional[List[Dict[str, Any]]] = None
     ) -> None:
         """
         Sauvegarde l'historique de conversation dans Redis.
 
         Args:
-            session_id: ID de session
+            state: État de conversation
             user_message: Message utilisateur à ajouter
             assistant_response: Réponse de l'assistant à ajouter
+            flight_records: Étapes du tour pour l'enregistreur de vol
         """
         try:
-            # Récupérer ou créer l'état
-            state = await redis_service.get_conversation_state(session_id)
-
-            if state is None:
-                from app.models.state import ConversationState
-                state = ConversationState(
-                    session_id=session_id,
-                    user_phone=""  # Sera mis à jour avec le contexte
-                )
-
             # Ajouter le message utilisateur
             state.add_message("user", user_message["content"])
 
@@ -666,9 +529,9 @@ Utilise intelligemment tes outils pour automatiser le processus.
             state.add_message("assistant", assistant_response)
 
             # Sauvegarder dans Redis avec TTL
-            await redis_service.save_conversation_state(session_id, state)
+            await session_store.save_conversation_state(state.session_id, state, flight_records=flight_records)
 
-            logger.info(f"💾 Historique sauvegardé: {len(state.message_history)} messages")
+            logger.info(f"💾 Historique sauvegardé: {state.message_count} messages")
 
         except Exception as e:
             logger.error(f"Erreur sauvegarde historique: {e}")
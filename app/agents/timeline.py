@@ -0,0 +1,132 @@
+"""
+Chronologie d'un tour de conversation
+
+Enregistre où un tour passe son temps: lecture du state Redis, routage
+d'intention, chaque appel LLM (modèle, tokens, latence), chaque outil (nom,
+durée, résultat) et la sauvegarde de l'historique. Chaque étape alimente un
+histogramme par étape; la chronologie complète peut être renvoyée dans
+`InferenceResponse.metadata` avec le flag `debug`.
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import time
+
+from app.utils.metrics import metrics_registry
+
+
+TURN_STAGE_SECONDS = metrics_registry.histogram(
+    "aya_turn_stage_seconds",
+    "Durée des étapes d'un tour de conversation",
+    ["stage"]
+)
+TOOL_SECONDS = metrics_registry.histogram(
+    "aya_tool_seconds",
+    "Durée des appels d'outils",
+    ["tool", "outcome"]
+)
+LLM_CALL_SECONDS = metrics_registry.histogram(
+    "aya_llm_call_seconds",
+    "Durée des appels LLM",
+    ["model"]
+)
+LLM_TOKENS = metrics_registry.counter(
+    "aya_llm_tokens_total",
+    "Tokens consommés par type",
+    ["model", "kind"]
+)
+
+
+class TurnTimeline:
+    """Événements horodatés d'un tour (millisecondes depuis le début du tour)"""
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self.events: List[Dict[str, Any]] = []
+        self._pending: Dict[str, float] = {}
+
+    def _ms(self, instant: float) -> float:
+        return round((instant - self._origin) * 1000, 1)
+
+    def record(self, stage: str, started: float, ended: Optional[float] = None, **attributes) -> Dict[str, Any]:
+        """
+        Ajoute un événement terminé et l'observe dans l'histogramme de l'étape
+
+        Args:
+            stage: Nom de l'étape (redis_load, llm, tool, history_save, ...)
+            started: time.perf_counter() au début de l'étape
+            ended: time.perf_counter() à la fin (défaut: maintenant)
+            **attributes: Détails de l'événement (modèle, tokens, outil, ...)
+
+        Returns:
+            L'événement enregistré
+        """
+        ended = ended or time.perf_counter()
+        duration = ended - started
+        event = {
+            "stage": stage,
+            "start_ms": self._ms(started),
+            "duration_ms": round(duration * 1000, 1),
+            **attributes
+        }
+        self.events.append(event)
+        TURN_STAGE_SECONDS.observe(duration, stage=stage)
+        return event
+
+    @contextmanager
+    def stage(self, stage: str, **attributes):
+        """Mesure un bloc de code comme une étape du tour"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, started, **attributes)
+
+    # ------------------------------------------------------------------------
+    # Événements ouverts par un hook et fermés par un autre (LLM, outils)
+    # ------------------------------------------------------------------------
+
+    def start(self, key: str) -> None:
+        self._pending[key] = time.perf_counter()
+
+    def end(self, key: str, stage: str, **attributes) -> Optional[Dict[str, Any]]:
+        started = self._pending.pop(key, None)
+        if started is None:
+            return None
+        return self.record(stage, started, **attributes)
+
+    def llm_call(self, key: str, model: str, usage: Any) -> Optional[Dict[str, Any]]:
+        """Ferme un appel LLM avec son usage de tokens"""
+        details = getattr(usage, "input_tokens_details", None)
+        tokens = {
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "cached_input_tokens": (getattr(details, "cached_tokens", 0) or 0) if details else 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        }
+        event = self.end(key, "llm", model=model, **tokens)
+        if event is None:
+            return None
+
+        LLM_CALL_SECONDS.observe(event["duration_ms"] / 1000, model=model)
+        for kind, value in tokens.items():
+            LLM_TOKENS.inc(value, model=model, kind=kind)
+        return event
+
+    def tool_call(self, key: str, tool: str, outcome: str) -> Optional[Dict[str, Any]]:
+        """Ferme un appel d'outil avec son résultat (ok / error)"""
+        event = self.end(key, "tool", tool=tool, outcome=outcome)
+        if event is not None:
+            TOOL_SECONDS.observe(event["duration_ms"] / 1000, tool=tool, outcome=outcome)
+        return event
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Chronologie sérialisable, avec les totaux du tour"""
+        llm_events = [e for e in self.events if e["stage"] == "llm"]
+        return {
+            "total_ms": self._ms(time.perf_counter()),
+            "llm_calls": len(llm_events),
+            "tool_calls": sum(1 for e in self.events if e["stage"] == "tool"),
+            "input_tokens": sum(e["input_tokens"] for e in llm_events),
+            "cached_input_tokens": sum(e["cached_input_tokens"] for e in llm_events),
+            "output_tokens": sum(e["output_tokens"] for e in llm_events),
+            "events": self.events,
+        }
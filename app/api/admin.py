@@ -0,0 +1,108 @@
+"""
+Endpoints d'administration et de diagnostic
+
+Protégés par la clé ADMIN_API_KEY (en-tête X-Admin-Key); désactivés si la
+clé n'est pas configurée.
+"""
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import Optional
+import hmac
+import json
+import logging
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def is_admin_key(key: Optional[str]) -> bool:
+    """Clé d'administration valide (toujours faux si ADMIN_API_KEY n'est pas configurée)"""
+    if not settings.ADMIN_API_KEY or not key:
+        return False
+    return hmac.compare_digest(key.encode(), settings.ADMIN_API_KEY.encode())
+
+
+async def verify_admin_key(x_admin_key: Optional[str] = Header(None)) -> None:
+    """Vérifie l'en-tête X-Admin-Key"""
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Endpoints d'administration désactivés")
+    if not is_admin_key(x_admin_key):
+        raise HTTPException(status_code=401, detail="Clé d'administration invalide")
+
+
+router = APIRouter(dependencies=[Depends(verify_admin_key)])
+
+
+@router.get("/loop-blocking")
+async def get_loop_blocking(limit: int = 20):
+    """
+    Blocages de la boucle asyncio détectés par le watchdog
+
+    Args:
+        limit: Nombre de sites d'appel retournés
+
+    Returns:
+        Sites classés par temps bloqué cumulé, avec un exemple de pile
+    """
+    from app.utils.loop_watchdog import loop_watchdog
+    return loop_watchdog.report(limit)
+
+
+@router.delete("/loop-blocking")
+async def reset_loop_blocking():
+    """Remet à zéro les rapports de blocage"""
+    from app.utils.loop_watchdog import loop_watchdog
+    loop_watchdog.reset()
+    return {"success": True}
+
+
+@router.get("/profiles")
+async def list_profiles():
+    """IDs des profils de requêtes disponibles (plus récent en premier)"""
+    from app.utils.profiler import request_profiler
+    return {"profiles": await request_profiler.list_ids()}
+
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "folded"):
+    """
+    Télécharge un profil de requête
+
+    Args:
+        profile_id: ID renvoyé dans l'en-tête X-AYA-Profile-Id
+        format: "folded" (piles agrégées pour speedscope / flamegraph.pl) ou "json"
+
+    Returns:
+        Piles échantillonnées, ou le profil complet avec ses métadonnées
+    """
+    from app.utils.profiler import request_profiler
+
+    profile = await request_profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profil introuvable ou expiré")
+
+    if format == "json":
+        return profile
+    return PlainTextResponse(profile["folded"] + "\n")
+
+
+@router.get("/sessions/{session_id}/flight")
+async def stream_session_flight(session_id: str):
+    """
+    Enregistreur de vol d'une session (NDJSON, une étape par ligne)
+
+    Chaque tour commence par une ligne k="turn" (message, réponse, durée),
+    suivie de ses étapes k="llm" (modèle, tokens, durée) et k="tool"
+    (nom, arguments, durée, résultat), toutes portant le même "turn".
+
+    Args:
+        session_id: ID de la session
+    """
+    from app.services.flight_recorder import flight_recorder
+
+    async def lines():
+        async for record in flight_recorder.stream(session_id):
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
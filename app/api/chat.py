@@ -5,18 +5,51 @@ Endpoint générique pour n'importe quel client (WhatsApp, Web, Mobile, etc.)
 Utilise le système agentique basé sur OpenAI Agent SDK pour gérer
 automatiquement tout le processus de souscription.
 """
-from fastapi import APIRouter, HTTPException, Form, File, UploadFile
+from fastapi import APIRouter, HTTPException, Form, File, Header, UploadFile
+from fastapi.responses import JSONResponse
 from app.models.schemas import InferenceResponse
-from app.agents.orchestrator import aya_orchestrator
+from app.api.admin import is_admin_key
+from app.agents.orchestrator import aya_orchestrator, BUSY_REPLY
+from app.agents.timeline import TurnTimeline, TURN_STAGE_SECONDS, TOOL_SECONDS, LLM_CALL_SECONDS
+from app.config import settings
+from app.services.chat_jobs import chat_job_manager, ChatJobQueueFull, InvalidCallbackURL, validate_callback_url
+from app.services.message_dedupe import message_deduplicator
+from app.services.rate_limiter import chat_rate_limiter, RateLimitExceeded
+from app.services.usage_tracker import prompt_cache_stats, cache_hit_ratio
+from app.utils.instrumentation import record_cache_lookup
+from app.utils.tracing import set_attributes
 from typing import Optional
 import logging
 import base64
+import uuid
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def _job_accepted(job_id: str, status: str, session_id: str) -> JSONResponse:
+    """Réponse 202 d'un tour traité en arrière-plan"""
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job_id,
+            "status": status,
+            "session_id": session_id,
+            "status_url": f"/api/chat/jobs/{job_id}"
+        }
+    )
+
+
+def _replayed_response(record: dict, session_id: str, message_id: str) -> InferenceResponse:
+    """Réponse mémorisée d'un message déjà traité"""
+    return InferenceResponse(
+        reply=record["reply"],
+        session_id=session_id,
+        metadata={**(record.get("metadata") or {}), "message_id": message_id, "replayed": True}
+    )
+
+
 @router.post("/chat", response_model=InferenceResponse)
 async def chat_endpoint(
     msg: str = Form(..., description="Message de l'utilisateur"),
@@ -27,7 +60,12 @@ async def chat_endpoint(
     media: Optional[UploadFile] = File(None, description="Fichier média uploadé"),
     model: str = Form("gpt-4o-mini", description="Modèle à utiliser"),
     timeline: int = Form(3600, description="Durée de vie de la session en secondes"),
-    temperature: float = Form(0.0, description="Température pour la génération")
+    temperature: float = Form(0.0, description="Température pour la génération"),
+    async_mode: bool = Form(False, description="Répondre 202 + job_id et traiter en arrière-plan"),
+    callback_url: Optional[str] = Form(None, description="URL où POSTer la réponse (implique async_mode)"),
+    message_id: Optional[str] = Form(None, description="ID du message chez la passerelle (déduplication)"),
+    debug: bool = Form(False, description="Renvoyer la chronologie du tour dans metadata (clé d'administration requise)"),
+    x_admin_key: Optional[str] = Header(None)
 ):
     """
     Endpoint principal pour communiquer avec l'orchestrateur AYA
@@ -48,10 +86,92 @@ async def chat_endpoint(
         model: Modèle à utiliser (par défaut: gpt-4o-mini)
         timeline: Durée de vie de la session en secondes
         temperature: Température pour la génération
+        async_mode: Traiter le tour en arrière-plan (réponse 202 immédiate)
+        callback_url: URL de livraison de la réponse en mode asynchrone
+        message_id: ID du message; une redélivrance renvoie la réponse
+            du premier traitement sans rappeler le LLM
+        debug: Ajouter la chronologie du tour (étapes, appels LLM et outils,
+            tokens) dans metadata["turn_timeline"]; ignoré sans clé
+            d'administration valide (en-tête X-Admin-Key)
+        x_admin_key: Clé d'administration
 
     Returns:
-        InferenceResponse avec la réponse de l'agent
+        InferenceResponse avec la réponse de l'agent, ou 202 avec le job_id
+        en mode asynchrone (réponse via callback_url ou GET /api/chat/jobs/{job_id})
     """
+    metadata = {
+        "model": model,
+        "temperature": temperature,
+        "timeline": timeline,
+        "system": "openai-agent-sdk",
+        "orchestrator": "aya"
+    }
+    run_async = bool(async_mode or callback_url)
+    set_attributes(**{"aya.session_id": session_id, "aya.message_type": message_type, "aya.async": run_async})
+    # La chronologie expose les outils appelés et leurs arguments: réservée à l'administration
+    debug = debug and settings.TURN_TIMELINE_DEBUG_ENABLED and is_admin_key(x_admin_key)
+    job_id = uuid.uuid4().hex if run_async else None
+
+    if callback_url:
+        try:
+            await validate_callback_url(callback_url)
+        except InvalidCallbackURL as e:
+            logger.warning(f"⚠️ callback_url refusé pour session {session_id}: {e}")
+            raise HTTPException(status_code=400, detail=f"callback_url refusé: {e}")
+
+    # Déduplication: seule la première livraison d'un message_id lance un tour
+    if message_id:
+        existing = await message_deduplicator.claim(session_id, message_id, job_id=job_id)
+        record_cache_lookup("message_dedupe", existing is not None)
+        if existing:
+            if existing.get("status") == "completed":
+                return _replayed_response(existing, session_id, message_id)
+
+            # Tour en cours: le doublon asynchrone reçoit le même job
+            if run_async and existing.get("job_id"):
+                return _job_accepted(existing["job_id"], "running", session_id)
+
+            record = await message_deduplicator.wait(session_id, message_id)
+            if record:
+                return _replayed_response(record, session_id, message_id)
+
+            raise HTTPException(status_code=409, detail="Message en cours de traitement, réessayez plus tard")
+
+    # Limites glissantes par numéro et par session (les redélivrances ci-dessus n'en consomment pas)
+    try:
+        await chat_rate_limiter.check(user_phone, session_id)
+    except RateLimitExceeded as e:
+        logger.warning(f"🚦 Tour refusé pour session {session_id}: {e}")
+        if message_id:
+            await message_deduplicator.release(session_id, message_id)
+        raise HTTPException(
+            status_code=429,
+            detail="Trop de messages, réessayez dans un instant",
+            headers={"Retry-After": e.retry_after_header}
+        )
+
+    if run_async:
+        try:
+            job = await chat_job_manager.submit(
+                session_id=session_id,
+                user_phone=user_phone,
+                user_message=msg,
+                media_url=media_url,
+                callback_url=callback_url,
+                metadata=metadata,
+                job_id=job_id,
+                message_id=message_id,
+                debug=debug
+            )
+        except ChatJobQueueFull as e:
+            logger.warning(f"⚠️ Job refusé pour session {session_id}: {e}")
+            if message_id:
+                await message_deduplicator.release(session_id, message_id)
+            raise HTTPException(status_code=503, detail="Service saturé, réessayez dans un instant")
+
+        logger.info(f"📥 Job {job['job_id']} accepté - Session: {session_id}")
+        return _job_accepted(job["job_id"], job["status"], session_id)
+
     try:
         logger.info(f"📨 Message reçu - Session: {session_id}, Type: {message_type}")
         logger.info(f"🔧 Config: Model={model}, Timeline={timeline}s, Temp={temperature}")
@@ -63,30 +183,36 @@ async def chat_endpoint(
         # - La création client et souscription
         # - L'initiation des paiements
         # - Tout le workflow de A à Z
+        turn_timeline = TurnTimeline()
         response = await aya_orchestrator.process_conversation(
             user_message=msg,
             session_id=session_id,
             user_phone=user_phone,
-            media_url=media_url
+            media_url=media_url,
+            timeline=turn_timeline
         )
 
         logger.info(f"✅ Réponse générée pour session {session_id}")
 
+        if message_id:
+            await message_deduplicator.complete(session_id, message_id, response, metadata)
+
         # Construire la réponse
+        if response == BUSY_REPLY:
+            metadata = {**metadata, "overloaded": True}
+        if debug:
+            metadata = {**metadata, "turn_timeline": turn_timeline.to_dict()}
+
         return InferenceResponse(
             reply=response,
             session_id=session_id,
-            metadata={
-                "model": model,
-                "temperature": temperature,
-                "timeline": timeline,
-                "system": "openai-agent-sdk",
-                "orchestrator": "aya"
-            }
+            metadata=metadata
         )
 
     except Exception as e:
         logger.error(f"❌ Erreur chat endpoint: {e}", exc_info=True)
+        if message_id:
+            await message_deduplicator.release(session_id, message_id)
         return InferenceResponse(
             reply="Désolée, j'ai rencontré une erreur. Pouvez-vous réessayer?",
             session_id=session_id,
@@ -94,6 +220,33 @@ async def chat_endpoint(
         )
 
 
+@router.get("/chat/jobs/{job_id}")
+async def get_chat_job(job_id: str):
+    """
+    Récupère le statut et la réponse d'un job de chat asynchrone
+
+    Args:
+        job_id: ID du job retourné par POST /api/chat
+
+    Returns:
+        Statut du job (queued, running, completed, failed) et réponse si terminé
+    """
+    job = await chat_job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job introuvable ou expiré")
+
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "session_id": job["session_id"],
+        "reply": job["reply"],
+        "metadata": job["metadata"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "completed_at": job["completed_at"]
+    }
+
+
 @router.get("/session/{session_id}")
 async def get_session_state(session_id: str):
     """
@@ -106,9 +259,9 @@ async def get_session_state(session_id: str):
         État de la session avec l'historique de conversation
     """
     try:
-        from app.services.redis_client import redis_service
+        from app.services.redis_client import session_store
 
-        state = await redis_service.get_conversation_state(session_id)
+        state = await session_store.get_conversation_state(session_id)
 
         if state is None:
             raise HTTPException(status_code=404, detail="Session non trouvée")
@@ -120,8 +273,15 @@ async def get_session_state(session_id: str):
             "product_type": state.product_type,
             "quotation_generated": state.quotation_result is not None,
             "payment_initiated": state.payment_initiated,
-            "message_count": len(state.message_history),
+            "message_count": state.message_count,
             "last_messages": state.message_history[-5:] if state.message_history else [],
+            "token_usage": {
+                **state.token_usage,
+                "cache_hit_ratio": cache_hit_ratio(
+                    state.token_usage.get("cached_input_tokens", 0),
+                    state.token_usage.get("input_tokens", 0)
+                )
+            },
             "system": "openai-agent-sdk"
         }
 
@@ -144,9 +304,9 @@ async def delete_session(session_id: str):
         Confirmation de suppression
     """
     try:
-        from app.services.redis_client import redis_service
+        from app.services.redis_client import session_store
 
-        success = await redis_service.delete_conversation_state(session_id)
+        success = await session_store.delete_conversation_state(session_id)
 
         if success:
             return {
@@ -162,3 +322,32 @@ async def delete_session(session_id: str):
     except Exception as e:
         logger.error(f"Erreur suppression session: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/stats/prompt-cache")
+async def get_prompt_cache_stats():
+    """
+    Statistiques de prompt caching par modèle (worker courant)
+
+    Returns:
+        Tokens d'entrée, tokens servis depuis le cache et taux de cache par modèle
+    """
+    return {
+        "models": prompt_cache_stats.snapshot(),
+        "system": "openai-agent-sdk"
+    }
+
+
+@router.get("/stats/turns")
+async def get_turn_stats():
+    """
+    Latences agrégées des tours de ce worker (secondes)
+
+    Returns:
+        Nombre, moyenne et p50/p95/p99 par étape, par outil et par modèle
+    """
+    return {
+        "stages": TURN_STAGE_SECONDS.summary(),
+        "tools": TOOL_SECONDS.summary(),
+        "llm_calls": LLM_CALL_SECONDS.summary()
+    }
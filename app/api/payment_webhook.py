@@ -7,6 +7,8 @@ from fastapi import APIRouter, Request, BackgroundTasks
 from typing import Dict, Any
 import logging
 
+from app.utils.tracing import set_attributes
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -85,6 +87,11 @@ async def payment_notification_callback(
             return {"status": "error", "message": "Missing transaction_reference"}
 
         logger.info(f"🔍 Transaction: {transaction_reference}, Status: {status}, Provider: {provider}")
+        set_attributes(**{
+            "aya.payment_reference": transaction_reference,
+            "aya.payment_status": status,
+            "aya.payment_provider": provider,
+        })
 
         # Traiter le callback en arrière-plan
         background_tasks.add_task(
@@ -157,13 +164,20 @@ async def _process_payment_callback(
         # Format: payment_confirmed:{transaction_reference} = {status}
         if db_status == "valide":
             from app.services.redis_client import redis_service
-            redis_service.client.set(
-                f"payment_confirmed:{transaction_reference}",
+            await redis_service.set_payment_confirmation(
+                transaction_reference,
                 status,
-                ex=3600  # Expire après 1 heure
+                ttl=3600  # Expire après 1 heure
             )
             logger.info(f"✅ Paiement confirmé stocké dans Redis: {transaction_reference}")
 
+        # Reporter le statut dans la session du client: écriture du seul champ
+        # payment_status, sans relire ni réécrire la session en cours d'utilisation
+        from app.services.redis_client import session_store
+        session_id = await session_store.get_payment_session(transaction_reference)
+        if session_id:
+            await session_store.update_conversation_state(session_id, {"payment_status": db_status})
+
         logger.info(f"Callback {provider} traité avec succès")
 
     except Exception as e:
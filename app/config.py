@@ -28,6 +28,13 @@ class Settings(BaseSettings):
     # Redis/Upstash
     REDIS_URL: str = os.getenv("REDIS_URL", "")
     REDIS_TOKEN: str = os.getenv("REDIS_TOKEN", "")
+    REDIS_MAX_CONNECTIONS: int = 50  # Taille du pool de connexions
+    REDIS_POOL_TIMEOUT: float = 5.0  # Attente max d'une connexion libre du pool (secondes)
+    REDIS_SOCKET_TIMEOUT: float = 2.0  # Timeout d'une commande (secondes)
+    REDIS_CONNECT_TIMEOUT: float = 2.0  # Timeout d'ouverture de connexion (secondes)
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # PING d'une connexion inactive avant réutilisation (secondes)
+    REDIS_MODE: str = "single"  # single | cluster (REDIS_URL = un nœud du cluster) | sharded
+    REDIS_SHARD_URLS: str = ""  # Nœuds indépendants du mode sharded, séparés par des virgules
 
     # Mobile Money
     EPAY_BASE_URL: str = "https://epay.nodes-hub.com"
@@ -37,6 +44,102 @@ class Settings(BaseSettings):
     DEFAULT_MODEL: str = "gpt-4o-mini"
     VISION_MODEL: str = "gemini-2.0-flash-exp"
     SESSION_TTL: int = 3600  # 1 hour in seconds
+    SESSION_HISTORY_WINDOW: int = 40  # Derniers messages relus et envoyés au modèle
+    SESSION_HISTORY_MAX: int = 200  # Messages conservés par session (liste Redis tronquée)
+    SESSION_CODEC: str = "msgpack"  # Encodage des valeurs de session: msgpack ou json
+    SESSION_COMPRESS_MIN_BYTES: int = 512  # Compression zlib au-delà de cette taille (0 = jamais)
+    SESSION_SAVE_RETRIES: int = 3  # Nouveaux essais d'écriture après modification concurrente des mêmes champs
+    SESSION_STORE: str = "redis"  # redis (repli embarqué si Redis tombe) ou memory (sessions dans le processus, sans Redis)
+    SESSION_MEMORY_MAX_SESSIONS: int = 10000  # Sessions gardées par le store embarqué (LRU)
+    SESSION_CACHE_ENABLED: bool = True  # Cache L1 des sessions par worker (invalidé par pub/sub)
+    SESSION_CACHE_SIZE: int = 2000  # Sessions gardées en mémoire par worker (LRU)
+    SESSION_CACHE_TTL: float = 60.0  # Durée max de service d'une entrée (secondes)
+    SESSION_CACHE_CHANNEL: str = "aya:session-invalidations"  # Canal pub/sub des invalidations
+    SESSION_ARCHIVE_ENABLED: bool = False  # Archivage des sessions peu avant leur expiration Redis
+    SESSION_ARCHIVE_SINK: str = "supabase"  # supabase (table SESSION_ARCHIVE_TABLE) ou ndjson (fichiers gzip locaux)
+    SESSION_ARCHIVE_TABLE: str = "session_archives"  # Table Supabase des archives (clé: session_id)
+    SESSION_ARCHIVE_DIR: str = "data/session_archives"  # Répertoire des fichiers NDJSON compressés
+    SESSION_ARCHIVE_LEAD: int = 300  # Archivage des sessions expirant dans moins de N secondes
+    SESSION_ARCHIVE_INTERVAL: float = 30.0  # Période de l'archiveur (secondes, < SESSION_ARCHIVE_LEAD)
+    SESSION_ARCHIVE_BATCH_SIZE: int = 100  # Sessions lues et écrites par lot
+
+    # Prompt caching (clé de routage du cache OpenAI = empreinte du préfixe statique)
+    PROMPT_CACHE_KEY_ENABLED: bool = True
+
+    # Exécution des outils: appels parallèles et plafonds par groupe d'outils
+    PARALLEL_TOOL_CALLS: bool = True
+    VISION_TOOL_CONCURRENCY: int = 4
+    QUOTATION_TOOL_CONCURRENCY: int = 8
+    DATABASE_TOOL_CONCURRENCY: int = 10
+    PAYMENT_TOOL_CONCURRENCY: int = 5
+    PDF_TOOL_CONCURRENCY: int = 2
+
+    # Préchargement du client et de sa souscription ouverte en début de tour
+    CLIENT_PREFETCH_ENABLED: bool = True
+
+    # Devis spéculatifs (lancés dès l'extraction carte grise / passeport)
+    SPECULATIVE_QUOTES_ENABLED: bool = True
+    SPECULATIVE_QUOTE_TTL: int = 900  # Conservation d'un devis précalculé en secondes
+
+    # Intent Router (réponses déterministes sans LLM)
+    INTENT_ROUTER_ENABLED: bool = True
+    INTENT_ROUTER_MIN_CONFIDENCE: float = 0.8
+
+    # Admission des tours /api/chat: limites glissantes (Redis) et plafond des runs d'agent par worker
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_WINDOW: int = 60  # Fenêtre glissante en secondes
+    RATE_LIMIT_PER_PHONE: int = 20  # Tours par numéro sur la fenêtre (0 = illimité)
+    RATE_LIMIT_PER_SESSION: int = 12  # Tours par session sur la fenêtre (0 = illimité)
+    AGENT_RUN_CONCURRENCY: int = 32  # Runner.run simultanés par worker (0 = illimité)
+    AGENT_RUN_QUEUE_SIZE: int = 64  # Tours en attente d'un créneau; au-delà, refus immédiat
+    AGENT_RUN_QUEUE_TIMEOUT: float = 10.0  # Attente max d'un créneau en secondes
+
+    # Jobs de chat asynchrones (202 Accepted + callback / polling)
+    CHAT_JOB_WORKERS: int = 4
+    CHAT_JOB_QUEUE_SIZE: int = 200
+    CHAT_JOB_TTL: int = 3600  # Conservation du résultat en secondes
+    CHAT_JOB_CALLBACK_TIMEOUT: float = 10.0
+    CHAT_JOB_CALLBACK_RETRIES: int = 3
+    CHAT_JOB_CALLBACK_ALLOWED_HOSTS: str = ""  # Hôtes de callback autorisés (virgules); vide = tout hôte public
+
+    # Déduplication des messages (champ message_id de /api/chat)
+    CHAT_DEDUPE_TTL: int = 86400  # Conservation de la réponse en secondes
+    CHAT_DEDUPE_LOCK_TTL: int = 300  # Réservation d'un message en cours de traitement
+    CHAT_DEDUPE_WAIT_TIMEOUT: float = 60.0  # Attente max d'un doublon sur le tour en cours
+
+    # Chronologie des tours (renvoyée dans metadata avec debug=true + X-Admin-Key sur /api/chat)
+    TURN_TIMELINE_DEBUG_ENABLED: bool = False
+
+    # Métriques Prometheus (GET /metrics) et mesure du retard de la boucle asyncio
+    METRICS_ENABLED: bool = True
+    EVENT_LOOP_LAG_INTERVAL: float = 0.5  # Période de mesure en secondes (0 = désactivée)
+
+    # Watchdog de la boucle asyncio (capture de pile des blocages, GET /api/admin/loop-blocking)
+    LOOP_WATCHDOG_ENABLED: bool = False
+    LOOP_WATCHDOG_THRESHOLD: float = 0.1  # Blocage minimal capturé en secondes
+    LOOP_WATCHDOG_MAX_SITES: int = 200
+
+    # Enregistreur de vol par session (étapes de l'agent dans Redis, TTL de la session)
+    FLIGHT_RECORDER_ENABLED: bool = True
+    FLIGHT_RECORDER_MAX_STEPS: int = 200  # Taille du tampon circulaire par session
+    FLIGHT_RECORDER_MAX_FIELD: int = 500  # Troncature des arguments / résultats (caractères)
+
+    # Traces OpenTelemetry (nécessite opentelemetry-sdk, + exporter OTLP HTTP si OTEL_EXPORTER=otlp)
+    OTEL_ENABLED: bool = False
+    OTEL_EXPORTER: str = "otlp"  # otlp (collecteur local) ou console (stdout)
+    OTEL_EXPORTER_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    OTEL_SERVICE_NAME: str = "aya-insurance-agent"
+
+    # Profileur échantillonné par requête (en-tête X-AYA-Profile ou ?profile=1)
+    PROFILER_ENABLED: bool = False  # Profils réservés à la clé d'administration (X-Admin-Key)
+    PROFILER_INTERVAL: float = 0.005  # Période d'échantillonnage en secondes
+    PROFILER_MAX_PER_MINUTE: int = 6
+    PROFILER_MAX_CONCURRENT: int = 1
+    PROFILER_TTL: int = 86400  # Conservation d'un profil en secondes
+    PROFILER_DIR: str = "/tmp/aya-profiles"  # Stockage si Redis indisponible
+
+    # Administration (en-tête X-Admin-Key des endpoints /api/admin)
+    ADMIN_API_KEY: str = os.getenv("ADMIN_API_KEY", "")
 
     # Webhooks
     BASE_WEBHOOK_URL: str = os.getenv("BASE_WEBHOOK_URL", "http://localhost:8000")
@@ -5,9 +5,13 @@ Point d'entrée principal de l'application
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from app.config import settings
-from app.api import chat, payment_webhook
+from app.api import chat, payment_webhook, admin
+from app.utils.instrumentation import MetricsMiddleware, loop_lag_monitor
+from app.utils.profiler import ProfilerMiddleware
+from app.utils.tracing import TracingMiddleware, init_tracing, shutdown_tracing
+from app.utils.metrics import metrics_registry
 import logging
 import os
 
@@ -37,9 +41,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Traces OpenTelemetry (span racine du chat et des webhooks de paiement)
+if settings.OTEL_ENABLED:
+    app.add_middleware(TracingMiddleware, paths=("/api/chat", "/api/payment/callback"))
+
+# Profilage à la demande (en-tête X-AYA-Profile) du chat et des webhooks de paiement
+if settings.PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware, paths=("/api/chat", "/api/payment/callback"))
+
+# Métriques des requêtes (nombre et durée par route)
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Inclure les routers
 app.include_router(chat.router, prefix="/api", tags=["Agent"])
 app.include_router(payment_webhook.router, prefix="/api/payment", tags=["Payment"])
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
 
 
 @app.get("/")
@@ -70,6 +87,17 @@ async def health_check():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métriques du worker au format texte Prometheus"""
+    if not settings.METRICS_ENABLED:
+        return PlainTextResponse("Métriques désactivées", status_code=404)
+    return PlainTextResponse(
+        metrics_registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.on_event("startup")
 async def startup_event():
     """Actions au démarrage de l'application"""
@@ -77,10 +105,49 @@ async def startup_event():
     logger.info(f"📊 Mode DEBUG: {settings.DEBUG}")
     logger.info(f"🔗 Base Webhook URL: {settings.BASE_WEBHOOK_URL}")
 
+    init_tracing()
+
+    from app.services.redis_client import redis_service
+    await redis_service.connect()
+    if redis_service.client is not None:
+        from app.services.session_cache import session_cache
+        session_cache.start(redis_service.pubsub_client)
+
+        from app.services.session_archiver import session_archiver
+        session_archiver.start()
+
+    from app.services.chat_jobs import chat_job_manager
+    await chat_job_manager.start()
+
+    if settings.METRICS_ENABLED:
+        loop_lag_monitor.start(settings.EVENT_LOOP_LAG_INTERVAL)
+
+    if settings.LOOP_WATCHDOG_ENABLED:
+        from app.utils.loop_watchdog import loop_watchdog
+        loop_watchdog.start(settings.LOOP_WATCHDOG_THRESHOLD, settings.LOOP_WATCHDOG_MAX_SITES)
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Actions à l'arrêt de l'application"""
+    from app.services.chat_jobs import chat_job_manager
+    await chat_job_manager.stop()
+    await loop_lag_monitor.stop()
+
+    from app.utils.loop_watchdog import loop_watchdog
+    await loop_watchdog.stop()
+
+    from app.services.session_archiver import session_archiver
+    await session_archiver.stop()
+
+    from app.services.session_cache import session_cache
+    await session_cache.stop()
+
+    from app.services.redis_client import redis_service
+    await redis_service.close()
+
+    shutdown_tracing()
+
     logger.info(f"🛑 {settings.APP_NAME} arrêté")
 
 
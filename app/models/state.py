@@ -1,11 +1,14 @@
 """
 Gestion de l'état de conversation et de souscription
 """
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+from pydantic_core import to_jsonable_python
 from typing import Optional, Dict, Any, Literal, List
 from datetime import datetime
 from uuid import UUID
 
+from app.utils.codec import SCHEMA_VERSION, codec
+
 
 # ============================================================================
 # MAPPING HELPERS - Conversion entre valeurs internes et valeurs DB
@@ -38,6 +41,18 @@ def db_to_product_type(db_value: str) -> str:
 # CONVERSATION STATE
 # ============================================================================
 
+# Champs non natifs JSON (texte une fois encodés), reconvertis au décodage rapide
+FIELD_PARSERS = {
+    "client_id": UUID,
+    "souscription_id": UUID,
+    "created_at": datetime.fromisoformat,
+    "updated_at": datetime.fromisoformat,
+}
+
+# Compteurs cumulés par plusieurs écrivains: rebasés par différence (cf. rebase_field)
+COUNTER_FIELDS = {"message_count", "token_usage"}
+
+
 class ConversationState(BaseModel):
     """
     État de la conversation stocké dans Redis
@@ -73,6 +88,7 @@ class ConversationState(BaseModel):
     payment_initiated: bool = False
     payment_reference: Optional[str] = None
     payment_provider: Optional[Literal["momo", "airtel"]] = None
+    payment_status: Optional[str] = None  # Statut DB reporté par le callback ePay
 
     # Code Promo
     code_promo: Optional[str] = None
@@ -84,7 +100,19 @@ class ConversationState(BaseModel):
     last_message: Optional[str] = None
 
     # Conversation history (for context)
+    # Stockée à part dans une liste Redis: seule la fenêtre récente est chargée
     message_history: List[Dict[str, str]] = Field(default_factory=list)
+    message_count: int = 0
+
+    # Messages de message_history déjà écrits dans Redis
+    _persisted_messages: int = PrivateAttr(default=0)
+    # Valeurs encodées des champs telles que lues dans Redis (écritures concurrentes)
+    _persisted_fields: Dict[str, bytes] = PrivateAttr(default_factory=dict)
+    # Prochaine écriture inconditionnelle (état inconnu du store, cf. detach)
+    _detached: bool = PrivateAttr(default=False)
+
+    # Token usage (llm_calls, input_tokens, cached_input_tokens, output_tokens)
+    token_usage: Dict[str, int] = Field(default_factory=dict)
 
     def add_message(self, role: str, content: str):
         """Ajoute un message à l'historique"""
@@ -93,9 +121,15 @@ class ConversationState(BaseModel):
             "content": content,
             "timestamp": datetime.utcnow().isoformat()
         })
+        self.message_count += 1
         self.last_message = content
         self.updated_at = datetime.utcnow()
 
+    def add_token_usage(self, usage: Dict[str, int]):
+        """Cumule l'usage de tokens d'un tour"""
+        for key, value in usage.items():
+            self.token_usage[key] = self.token_usage.get(key, 0) + value
+
     def update_step(self, new_step: str):
         """Met à jour l'étape courante"""
         self.current_step = new_step
@@ -119,6 +153,148 @@ class ConversationState(BaseModel):
         """Crée une instance depuis un dictionnaire Redis"""
         return cls(**data)
 
+    def to_redis_hash(self) -> Dict[str, bytes]:
+        """Champs scalaires pour le hash Redis de la session (sans l'historique), encodés par le codec"""
+        data = self.model_dump(mode='json', exclude={"message_history"})
+        return {key: codec.encode(value) for key, value in data.items()}
+
+    @classmethod
+    def from_redis_hash(cls, fields: Dict[Any, bytes], messages: List[bytes]) -> "ConversationState":
+        """
+        Crée une instance depuis le hash de la session et la fenêtre d'historique
+
+        Les valeurs écrites avec la version courante du schéma sont reprises
+        sans revalidation Pydantic; sinon (ancienne version, JSON sans
+        en-tête) l'état est validé normalement.
+
+        Args:
+            fields: Champs du hash (valeurs encodées par le codec)
+            messages: Messages récents de la liste Redis, du plus ancien au plus récent
+        """
+        data = {}
+        persisted = {}
+        trusted = True
+        for key, raw in fields.items():
+            key = key.decode() if isinstance(key, bytes) else key
+            value, version = codec.decode(raw)
+            data[key] = value
+            persisted[key] = raw
+            trusted = trusted and version == SCHEMA_VERSION
+
+        history = [codec.decode(message)[0] for message in messages]
+
+        if trusted:
+            known = cls.model_fields
+            values = {key: value for key, value in data.items() if key in known}
+            for key, parse in FIELD_PARSERS.items():
+                if isinstance(values.get(key), str):
+                    values[key] = parse(values[key])
+            state = cls.model_construct(**values, message_history=history)
+        else:
+            state = cls(**data, message_history=history)
+
+        state._persisted_messages = len(state.message_history)
+        state._persisted_fields = persisted
+        return state
+
+    @classmethod
+    def encode_fields(cls, updates: Dict[str, Any]) -> Dict[str, bytes]:
+        """Encode des champs isolés pour une écriture directe dans le hash (champs inconnus ignorés)"""
+        return {
+            key: codec.encode(to_jsonable_python(value))
+            for key, value in updates.items()
+            if key in cls.model_fields and key != "message_history"
+        }
+
+    def dirty_fields(self) -> Dict[str, bytes]:
+        """Champs modifiés depuis le chargement (valeurs encodées)"""
+        persisted = self._persisted_fields
+        return {key: value for key, value in self.to_redis_hash().items() if persisted.get(key) != value}
+
+    def persisted_hash(self) -> Dict[str, bytes]:
+        """Valeurs encodées du hash telles qu'en Redis après la dernière lecture ou écriture"""
+        return dict(self._persisted_fields)
+
+    def persisted_field(self, key: str) -> Optional[bytes]:
+        """Valeur encodée du champ telle que lue dans Redis (None si absent)"""
+        return self._persisted_fields.get(key)
+
+    def rebase_field(self, key: str, raw: Optional[bytes]) -> None:
+        """
+        Reprend un champ modifié entre-temps par un autre écrivain
+
+        Les compteurs (COUNTER_FIELDS) gardent les deux incréments: leur
+        valeur + (la nôtre - celle lue au chargement). Les autres
+        dictionnaires sont fusionnés clé par clé (nos clés modifiées
+        l'emportent sur les leurs); pour les autres champs, notre valeur
+        est conservée.
+
+        Args:
+            key: Nom du champ
+            raw: Valeur encodée actuellement dans Redis (None si absent)
+        """
+        ours = getattr(self, key)
+        theirs = codec.decode(raw)[0] if raw is not None else None
+        base = self._persisted_fields.get(key)
+        base = codec.decode(base)[0] if base is not None else None
+
+        if key in COUNTER_FIELDS and isinstance(ours, dict):
+            theirs, base = theirs or {}, base or {}
+            merged = dict(theirs)
+            for name, value in ours.items():
+                merged[name] = theirs.get(name, 0) + value - base.get(name, 0)
+            setattr(self, key, merged)
+        elif key in COUNTER_FIELDS:
+            setattr(self, key, (theirs or 0) + ours - (base or 0))
+        elif isinstance(ours, dict) and isinstance(theirs, dict):
+            base = base or {}
+            merged = dict(theirs)
+            for name in base.keys() - ours.keys():
+                merged.pop(name, None)
+            for name, value in ours.items():
+                if name not in base or base[name] != value:
+                    merged[name] = value
+            setattr(self, key, merged)
+
+        if raw is None:
+            self._persisted_fields.pop(key, None)
+        else:
+            self._persisted_fields[key] = raw
+
+    def detach(self, unsaved_messages: Optional[int] = None) -> None:
+        """
+        Oublie ce que le store contient: la prochaine écriture réécrit tous
+        les champs sans condition, avec les `unsaved_messages` derniers
+        messages de la fenêtre (tous par défaut)
+        """
+        self._persisted_fields = {}
+        self._detached = True
+        if unsaved_messages is None:
+            self._persisted_messages = 0
+        else:
+            self._persisted_messages = max(0, len(self.message_history) - unsaved_messages)
+
+    def is_detached(self) -> bool:
+        return self._detached
+
+    def checkpoint(self) -> tuple:
+        """Suivi d'écriture courant (à restaurer si une écriture échoue)"""
+        return dict(self._persisted_fields), self._persisted_messages, self._detached
+
+    def restore(self, checkpoint: tuple) -> None:
+        self._persisted_fields, self._persisted_messages, self._detached = checkpoint
+
+    def unsaved_messages(self) -> List[Dict[str, str]]:
+        """Messages ajoutés depuis le chargement (à ajouter à la liste Redis)"""
+        return self.message_history[self._persisted_messages:]
+
+    def mark_saved(self, fields: Optional[Dict[str, bytes]] = None) -> None:
+        """Enregistre ce qui vient d'être écrit (messages et champs encodés)"""
+        self._persisted_messages = len(self.message_history)
+        self._detached = False
+        if fields:
+            self._persisted_fields.update(fields)
+
 
 # ============================================================================
 # SOUSCRIPTION STATE (Contexte métier)
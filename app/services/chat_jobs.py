@@ -0,0 +1,371 @@
+"""
+Jobs de chat asynchrones
+
+Les passerelles WhatsApp et certains clients mobiles abandonnent la requête
+bien avant la fin d'un tour lent (vision + plusieurs outils), puis réessaient.
+En mode asynchrone, `/api/chat` accuse réception immédiatement (202 + job_id);
+le tour est exécuté par un pool de workers et la réponse est livrée au
+`callback_url` fourni, et/ou récupérable via `GET /api/chat/jobs/{job_id}`.
+"""
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+from urllib.parse import urlsplit, urlunsplit
+import asyncio
+import ipaddress
+import logging
+import socket
+import uuid
+
+import httpx
+
+from app.config import settings
+from app.utils.instrumentation import track_dependency
+from app.utils.tracing import current_context, span
+
+logger = logging.getLogger(__name__)
+
+
+class ChatJobQueueFull(Exception):
+    """La file des jobs est pleine"""
+
+
+class InvalidCallbackURL(ValueError):
+    """callback_url refusé (schéma, hôte interne ou hors liste autorisée)"""
+
+
+async def validate_callback_url(url: str) -> Optional[str]:
+    """
+    Vérifie qu'un callback_url peut être appelé par le serveur
+
+    Seuls http(s) sont acceptés. Si CHAT_JOB_CALLBACK_ALLOWED_HOSTS est
+    renseigné, l'hôte doit y figurer; sinon toutes ses adresses doivent être
+    publiques (pas de loopback, réseau privé, link-local ni métadonnées cloud).
+
+    Returns:
+        Adresse IP validée à laquelle se connecter (None pour un hôte autorisé)
+
+    Raises:
+        InvalidCallbackURL: URL refusée
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise InvalidCallbackURL("URL invalide")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise InvalidCallbackURL("Seules les URL http(s) sont acceptées")
+
+    host = parts.hostname.lower()
+    allowed = {h.strip().lower() for h in settings.CHAT_JOB_CALLBACK_ALLOWED_HOSTS.split(",") if h.strip()}
+    if allowed:
+        if host not in allowed:
+            raise InvalidCallbackURL(f"Hôte non autorisé: {host}")
+        return
+
+    try:
+        infos = await asyncio.to_thread(socket.getaddrinfo, host, port, proto=socket.IPPROTO_TCP)
+    except OSError:
+        raise InvalidCallbackURL(f"Hôte introuvable: {host}")
+    addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    if not addresses or not all(address.is_global for address in addresses):
+        raise InvalidCallbackURL(f"Adresse non publique: {host}")
+    return str(addresses[0])
+
+
+def pin_callback_url(url: str, address: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """
+    Requête vers l'adresse validée plutôt que vers le nom d'hôte
+
+    Une seconde résolution DNS au moment de l'envoi pourrait renvoyer une
+    adresse interne (DNS rebinding): la connexion se fait sur l'IP, l'hôte
+    d'origine est conservé dans l'en-tête Host et, en https, pour le SNI et
+    la vérification du certificat.
+
+    Returns:
+        (URL sur l'IP, en-têtes, extensions httpx)
+    """
+    parts = urlsplit(url)
+    ip = ipaddress.ip_address(address)
+    host = f"[{ip}]" if ip.version == 6 else str(ip)
+    userinfo, _, origin = parts.netloc.rpartition("@")
+    netloc = f"{host}:{parts.port}" if parts.port else host
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+
+    extensions = {"sni_hostname": parts.hostname} if parts.scheme == "https" else {}
+    return urlunsplit(parts._replace(netloc=netloc)), {"Host": origin}, extensions
+
+
+class ChatJobManager:
+    """
+    File de jobs de chat et pool de workers asyncio.
+
+    Les tours d'une même session sont sérialisés pour ne jamais faire tourner
+    deux runs concurrents sur le même ConversationState.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None):
+        self.workers = workers or settings.CHAT_JOB_WORKERS
+        self.queue_size = queue_size or settings.CHAT_JOB_QUEUE_SIZE
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+        self._session_pending: Dict[str, int] = {}
+        # Livraisons de callbacks en cours (les workers n'attendent pas le client)
+        self._deliveries: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        """Démarre les workers (appelé au démarrage de l'application)"""
+        if self._tasks:
+            return
+
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"chat-job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"🧵 Pool de jobs de chat démarré ({self.workers} workers)")
+
+    async def stop(self) -> None:
+        """Arrête les workers (les jobs en file et les callbacks en cours sont abandonnés)"""
+        tasks = self._tasks + list(self._deliveries)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._deliveries.clear()
+        logger.info("🧵 Pool de jobs de chat arrêté")
+
+    async def submit(
+        self,
+        session_id: str,
+        user_phone: str,
+        user_message: str,
+        media_url: Optional[str] = None,
+        callback_url: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        job_id: Optional[str] = None,
+        message_id: Optional[str] = None,
+        debug: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Met un tour de conversation en file.
+
+        Le job est enregistré dans Redis avant d'être mis en file: le polling
+        le trouve depuis n'importe quelle instance, même avant son exécution.
+
+        Args:
+            session_id: ID de session
+            user_phone: Numéro de téléphone
+            user_message: Message de l'utilisateur
+            media_url: URL du média
+            callback_url: URL à laquelle POSTer le résultat
+            metadata: Métadonnées à renvoyer avec la réponse
+            job_id: ID du job (généré si absent)
+            message_id: ID du message à marquer traité en fin de job
+            debug: Ajouter la chronologie du tour aux métadonnées du job
+
+        Returns:
+            Dict du job (job_id, status, ...)
+
+        Raises:
+            ChatJobQueueFull: si la file est pleine ou le pool non démarré
+        """
+        from app.services.redis_client import redis_service
+
+        if self._queue is None:
+            raise ChatJobQueueFull("Pool de jobs non démarré")
+        if self._queue.full():
+            raise ChatJobQueueFull(f"File pleine ({self.queue_size} jobs)")
+
+        job_id = job_id or uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "session_id": session_id,
+            "status": "queued",
+            "reply": None,
+            "error": None,
+            "metadata": metadata or {},
+            "callback_url": callback_url,
+            "message_id": message_id,
+            "debug": debug,
+            "created_at": datetime.utcnow().isoformat(),
+            "completed_at": None,
+        }
+        request = {
+            "session_id": session_id,
+            "user_phone": user_phone,
+            "user_message": user_message,
+            "media_url": media_url,
+        }
+
+        # Enregistré avant la mise en file: l'écriture "queued" ne peut pas
+        # passer après celle du worker ("running")
+        self._jobs[job_id] = job
+        await redis_service.save_chat_job(job_id, job)
+
+        try:
+            # Le contexte de trace de la requête HTTP est repris par le worker
+            self._queue.put_nowait((job, request, current_context()))
+        except asyncio.QueueFull:
+            # File remplie pendant l'écriture: le job refusé ne sera jamais exécuté
+            self._jobs.pop(job_id, None)
+            job.update(status="failed", error="File pleine", completed_at=datetime.utcnow().isoformat())
+            await redis_service.save_chat_job(job_id, job)
+            raise ChatJobQueueFull(f"File pleine ({self.queue_size} jobs)")
+
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Récupère un job (mémoire du worker local, sinon Redis)
+
+        Args:
+            job_id: ID du job
+
+        Returns:
+            Dict du job ou None si inconnu
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+
+        from app.services.redis_client import redis_service
+        return await redis_service.get_chat_job(job_id)
+
+    async def _worker(self, index: int) -> None:
+        """Boucle d'un worker: exécute les jobs de la file"""
+        while True:
+            job, request, trace_context = await self._queue.get()
+            try:
+                with span("chat.job", context=trace_context, **{
+                    "aya.job_id": job["job_id"],
+                    "aya.session_id": job["session_id"],
+                }):
+                    await self._run(job, request)
+            except Exception as e:
+                logger.error(f"❌ Worker {index} - job {job['job_id']}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Dict[str, Any], request: Dict[str, Any]) -> None:
+        """Exécute un tour de conversation puis livre le résultat"""
+        from app.agents.orchestrator import aya_orchestrator, BUSY_REPLY, ERROR_REPLY
+        from app.services.redis_client import redis_service
+        from app.services.message_dedupe import message_deduplicator
+        from app.agents.timeline import TurnTimeline
+
+        session_id = request["session_id"]
+        lock = self._session_locks.setdefault(session_id, asyncio.Lock())
+        self._session_pending[session_id] = self._session_pending.get(session_id, 0) + 1
+
+        try:
+            async with lock:
+                job["status"] = "running"
+                await redis_service.save_chat_job(job["job_id"], job)
+
+                try:
+                    timeline = TurnTimeline()
+                    job["reply"] = await aya_orchestrator.process_conversation(**request, timeline=timeline)
+
+                    # process_conversation ne lève pas: un tour en erreur ou refusé renvoie un message d'excuse
+                    if job["reply"] == BUSY_REPLY:
+                        job["status"], job["error"] = "failed", "Service saturé"
+                        job["metadata"] = {**job["metadata"], "overloaded": True}
+                    elif job["reply"] == ERROR_REPLY:
+                        job["status"], job["error"] = "failed", "Erreur lors du traitement du message"
+                    else:
+                        job["status"] = "completed"
+
+                    # Libère le message_id si le tour a échoué (la redélivrance pourra réessayer)
+                    if job["message_id"]:
+                        await message_deduplicator.complete(
+                            session_id, job["message_id"], job["reply"], job["metadata"], job_id=job["job_id"]
+                        )
+
+                    if job["debug"]:
+                        job["metadata"] = {**job["metadata"], "turn_timeline": timeline.to_dict()}
+                except Exception as e:
+                    logger.error(f"❌ Erreur job {job['job_id']}: {e}", exc_info=True)
+                    job["reply"] = "Désolée, j'ai rencontré une erreur. Pouvez-vous réessayer?"
+                    job["error"] = str(e)
+                    job["status"] = "failed"
+
+                    if job["message_id"]:
+                        await message_deduplicator.release(session_id, job["message_id"])
+
+                job["completed_at"] = datetime.utcnow().isoformat()
+        finally:
+            # Libérer le verrou de la session quand plus aucun job ne l'attend
+            self._session_pending[session_id] -= 1
+            if not self._session_pending[session_id]:
+                self._session_pending.pop(session_id, None)
+                self._session_locks.pop(session_id, None)
+
+        # Le résultat est persisté pour le polling (toutes instances), puis retiré de la mémoire;
+        # sans Redis, il reste servi localement jusqu'à CHAT_JOB_TTL
+        if await redis_service.save_chat_job(job["job_id"], job):
+            self._jobs.pop(job["job_id"], None)
+        else:
+            asyncio.get_running_loop().call_later(settings.CHAT_JOB_TTL, self._jobs.pop, job["job_id"], None)
+
+        logger.info(f"✅ Job {job['job_id']} terminé ({job['status']}) - Session: {session_id}")
+
+        if job["callback_url"]:
+            # Livraison en tâche de fond: un callback lent n'immobilise pas le worker
+            delivery = asyncio.create_task(self._deliver(job), name=f"chat-job-callback-{job['job_id']}")
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, job: Dict[str, Any]) -> bool:
+        """
+        POSTe le résultat d'un job au callback_url, avec retries
+
+        Args:
+            job: Job terminé
+
+        Returns:
+            True si le callback a répondu 2xx
+        """
+        payload = {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "reply": job["reply"],
+            "session_id": job["session_id"],
+            "metadata": {**job["metadata"], "error": job["error"]} if job["error"] else job["metadata"],
+        }
+
+        for attempt in range(1, settings.CHAT_JOB_CALLBACK_RETRIES + 1):
+            try:
+                # Revalidé à chaque envoi: la résolution a pu changer depuis la soumission
+                url, headers, extensions = job["callback_url"], {}, {}
+                address = await validate_callback_url(url)
+                if address:
+                    url, headers, extensions = pin_callback_url(url, address)
+
+                async with httpx.AsyncClient(timeout=settings.CHAT_JOB_CALLBACK_TIMEOUT) as client:
+                    with track_dependency("callback", "chat_job"):
+                        response = await client.post(url, json=payload, headers=headers, extensions=extensions)
+                        response.raise_for_status()
+                logger.info(f"📤 Callback livré pour job {job['job_id']}")
+                return True
+
+            except InvalidCallbackURL as e:
+                logger.error(f"❌ Callback job {job['job_id']} refusé à l'envoi: {e}")
+                return False
+
+            except Exception as e:
+                logger.warning(
+                    f"⚠️ Callback job {job['job_id']} échoué "
+                    f"(tentative {attempt}/{settings.CHAT_JOB_CALLBACK_RETRIES}): {e}"
+                )
+                if attempt < settings.CHAT_JOB_CALLBACK_RETRIES:
+                    await asyncio.sleep(2 ** (attempt - 1))
+
+        logger.error(f"❌ Callback non livré pour job {job['job_id']}, résultat disponible en polling")
+        return False
+
+
+# Instance globale
+chat_job_manager = ChatJobManager()
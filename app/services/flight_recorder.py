@@ -0,0 +1,146 @@
+"""
+Enregistreur de vol des sessions
+
+Conserve, par session, les étapes de l'agent (outils avec arguments, durée
+et résultat, appels LLM) dans un tampon circulaire Redis borné qui partage
+le TTL de la session. Les étapes d'un tour sont écrites en un seul appel
+pipeliné en fin de tour. Lecture: GET /api/admin/sessions/{id}/flight.
+"""
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import time
+import uuid
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _clip(value: Any) -> Optional[str]:
+    """Valeur compacte: texte tronqué à FLIGHT_RECORDER_MAX_FIELD caractères"""
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        try:
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        except Exception:
+            value = str(value)
+
+    limit = settings.FLIGHT_RECORDER_MAX_FIELD
+    return value if len(value) <= limit else f"{value[:limit]}…(+{len(value) - limit})"
+
+
+class FlightRecorder:
+    """Construction des étapes compactes et écriture par tour"""
+
+    def tool_step(
+        self,
+        tool: str,
+        arguments: Optional[str],
+        result: Any,
+        duration_ms: Optional[float],
+        outcome: str
+    ) -> Dict[str, Any]:
+        """Étape d'outil: nom, arguments, durée, résultat"""
+        return {
+            "ts": round(time.time(), 3),
+            "k": "tool",
+            "n": tool,
+            "a": _clip(arguments),
+            "ms": duration_ms,
+            "o": outcome,
+            "r": _clip(result),
+        }
+
+    def llm_step(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Étape LLM depuis un événement de la chronologie du tour"""
+        return {
+            "ts": round(time.time(), 3),
+            "k": "llm",
+            "m": event["model"],
+            "ms": event["duration_ms"],
+            "in": event["input_tokens"],
+            "cin": event["cached_input_tokens"],
+            "out": event["output_tokens"],
+        }
+
+    def turn_records(
+        self,
+        user_message: str,
+        reply: str,
+        route: str,
+        steps: List[Dict[str, Any]],
+        duration_ms: float
+    ) -> List[Dict[str, Any]]:
+        """
+        En-tête du tour suivi de ses étapes, prêts à être écrits
+
+        Args:
+            user_message: Message de l'utilisateur
+            reply: Réponse envoyée
+            route: agent, intent_router ou error
+            steps: Étapes collectées par les hooks du run
+            duration_ms: Durée totale du tour
+
+        Returns:
+            Enregistrements du tour (vide si l'enregistreur est désactivé)
+        """
+        if not settings.FLIGHT_RECORDER_ENABLED:
+            return []
+
+        turn_id = uuid.uuid4().hex[:8]
+        header = {
+            "ts": round(time.time(), 3),
+            "k": "turn",
+            "route": route,
+            "ms": duration_ms,
+            "in": _clip(user_message),
+            "out": _clip(reply),
+            "steps": len(steps),
+        }
+        return [{"turn": turn_id, **record} for record in (header, *steps)]
+
+    async def record_turn(
+        self,
+        session_id: str,
+        user_message: str,
+        reply: str,
+        route: str,
+        steps: List[Dict[str, Any]],
+        duration_ms: float
+    ) -> bool:
+        """
+        Écrit l'en-tête du tour et ses étapes dans le tampon de la session
+
+        Les tours sauvegardés passent plutôt turn_records() à
+        save_conversation_state (même aller-retour que l'état).
+
+        Returns:
+            True si écrit
+        """
+        records = self.turn_records(user_message, reply, route, steps, duration_ms)
+        if not records:
+            return False
+
+        from app.services.redis_client import redis_service
+        return await redis_service.append_flight_records(
+            session_id, records, settings.FLIGHT_RECORDER_MAX_STEPS
+        )
+
+    async def stream(self, session_id: str, chunk: int = 100):
+        """Étapes de la session, des plus anciennes aux plus récentes, par paquets"""
+        from app.services.redis_client import redis_service
+
+        start = 0
+        while True:
+            records = await redis_service.get_flight_records(session_id, start, start + chunk - 1)
+            for record in records:
+                yield record
+            if len(records) < chunk:
+                return
+            start += chunk
+
+
+# Instance globale
+flight_recorder = FlightRecorder()
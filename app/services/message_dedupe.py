@@ -0,0 +1,202 @@
+"""
+Déduplication des messages entrants
+
+Les passerelles (WhatsApp, etc.) redélivrent un message quand elles n'ont pas
+reçu d'accusé à temps. Avec un `message_id`, le premier appel réserve le message
+dans Redis et y stocke sa réponse; les redélivrances reçoivent cette réponse
+sans repasser par le LLM, ou attendent le tour encore en cours.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import time
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MessageDeduplicator:
+    """Réservation et mémorisation des réponses par (session_id, message_id)"""
+
+    POLL_INTERVAL = 0.25
+    MAX_POLL_INTERVAL = 1.0
+    LOCAL_MAX_RECORDS = 1000
+
+    def __init__(self):
+        # Tours en cours sur ce worker: les doublons locaux attendent le Future
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._inflight_records: Dict[str, Dict[str, Any]] = {}
+        # Réponses récentes de ce worker (repli si Redis est indisponible)
+        self._completed: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @staticmethod
+    def _key(session_id: str, message_id: str) -> str:
+        return f"{session_id}:{message_id}"
+
+    async def claim(
+        self,
+        session_id: str,
+        message_id: str,
+        job_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Réserve un message pour traitement
+
+        Args:
+            session_id: ID de la session
+            message_id: ID du message chez la passerelle
+            job_id: ID du job si le tour est traité en mode asynchrone
+
+        Returns:
+            None si le message est réservé par cet appel (à traiter),
+            sinon l'enregistrement existant (status "processing" ou "completed")
+        """
+        from app.services.redis_client import redis_service
+
+        key = self._key(session_id, message_id)
+        if key in self._inflight:
+            return self._inflight_records[key]
+
+        local = self._completed.get(key)
+        if local and local[0] > time.monotonic():
+            return local[1]
+
+        record = {
+            "status": "processing",
+            "job_id": job_id,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+
+        # Deux tentatives: la réservation concurrente peut expirer entre SET NX et GET
+        for _ in range(2):
+            claimed = await redis_service.claim_message(
+                session_id, message_id, record, settings.CHAT_DEDUPE_LOCK_TTL
+            )
+            if claimed is not False:
+                # Réservé (ou Redis indisponible: déduplication locale uniquement)
+                self._inflight[key] = asyncio.get_running_loop().create_future()
+                self._inflight_records[key] = record
+                return None
+
+            existing = await redis_service.get_message_record(session_id, message_id)
+            if existing:
+                logger.info(f"🔁 Message {message_id} déjà reçu ({existing.get('status')}) - Session: {session_id}")
+                return existing
+
+        return None
+
+    async def complete(
+        self,
+        session_id: str,
+        message_id: str,
+        reply: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        job_id: Optional[str] = None
+    ) -> None:
+        """
+        Mémorise la réponse d'un message traité et réveille les doublons en attente
+
+        Args:
+            session_id: ID de la session
+            message_id: ID du message
+            reply: Réponse de l'agent
+            metadata: Métadonnées de la réponse
+            job_id: ID du job en mode asynchrone
+        """
+        from app.agents.orchestrator import BUSY_REPLY, ERROR_REPLY
+        from app.services.redis_client import redis_service
+
+        # Un tour en échec ou refusé n'est pas mémorisé: la redélivrance doit pouvoir réessayer
+        if reply in (ERROR_REPLY, BUSY_REPLY):
+            await self.release(session_id, message_id)
+            return
+
+        record = {
+            "status": "completed",
+            "job_id": job_id,
+            "reply": reply,
+            "metadata": metadata or {},
+            "completed_at": datetime.utcnow().isoformat(),
+        }
+        await redis_service.save_message_record(session_id, message_id, record, settings.CHAT_DEDUPE_TTL)
+
+        key = self._key(session_id, message_id)
+        self._completed[key] = (time.monotonic() + settings.CHAT_DEDUPE_TTL, record)
+        self._completed.move_to_end(key)
+        while len(self._completed) > self.LOCAL_MAX_RECORDS:
+            self._completed.popitem(last=False)
+
+        self._resolve(session_id, message_id, record)
+
+    async def release(self, session_id: str, message_id: str) -> None:
+        """
+        Libère la réservation d'un message dont le traitement a échoué
+
+        Args:
+            session_id: ID de la session
+            message_id: ID du message
+        """
+        from app.services.redis_client import redis_service
+
+        await redis_service.delete_message_record(session_id, message_id)
+        self._resolve(session_id, message_id, None)
+
+    async def wait(
+        self,
+        session_id: str,
+        message_id: str,
+        timeout: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Attend la réponse d'un message en cours de traitement
+
+        Args:
+            session_id: ID de la session
+            message_id: ID du message
+            timeout: Attente maximale en secondes (défaut: settings.CHAT_DEDUPE_WAIT_TIMEOUT)
+
+        Returns:
+            Enregistrement "completed", ou None si échec / délai dépassé
+        """
+        from app.services.redis_client import redis_service
+
+        timeout = timeout or settings.CHAT_DEDUPE_WAIT_TIMEOUT
+        future = self._inflight.get(self._key(session_id, message_id))
+
+        # Tour en cours sur ce worker: attendre directement son résultat
+        if future is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        # Tour en cours sur une autre instance: interroger Redis
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interval = self.POLL_INTERVAL
+
+        while loop.time() < deadline:
+            await asyncio.sleep(interval)
+            record = await redis_service.get_message_record(session_id, message_id)
+            if not record:
+                return None
+            if record.get("status") == "completed":
+                return record
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+        return None
+
+    def _resolve(self, session_id: str, message_id: str, record: Optional[Dict[str, Any]]) -> None:
+        """Termine le Future local d'un message"""
+        key = self._key(session_id, message_id)
+        self._inflight_records.pop(key, None)
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(record)
+
+
+# Instance globale
+message_deduplicator = MessageDeduplicator()
@@ -2,9 +2,11 @@
 Service Mobile Money pour les paiements (MoMo et Airtel)
 API: https://epay.nodes-hub.com
 """
+import asyncio
 import httpx
 from app.config import settings
 from app.models.schemas import PaymentRequest, PaymentResponse
+from app.utils.instrumentation import track_dependency
 from typing import Optional, Dict, Any
 import logging
 
@@ -60,14 +62,15 @@ class MobileMoneyService:
 
             # Faire la requête
             async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/momo/collection/request-to-pay",
-                    headers=self.headers,
-                    data=data,  # form-urlencoded
-                    timeout=30.0
-                )
-
-                response.raise_for_status()
+                with track_dependency("epay", "momo_request_to_pay"):
+                    response = await client.post(
+                        f"{self.base_url}/momo/collection/request-to-pay",
+                        headers=self.headers,
+                        data=data,  # form-urlencoded
+                        timeout=30.0
+                    )
+
+                    response.raise_for_status()
                 result = response.json()
 
                 logger.info(f"Paiement MoMo initié: {reference}, Response: {result}")
@@ -133,14 +136,15 @@ class MobileMoneyService:
 
             # Faire la requête
             async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/airtel/collection/payment",
-                    headers=self.headers,
-                    data=data,  # form-urlencoded ou json selon l'API
-                    timeout=30.0
-                )
-
-                response.raise_for_status()
+                with track_dependency("epay", "airtel_payment"):
+                    response = await client.post(
+                        f"{self.base_url}/airtel/collection/payment",
+                        headers=self.headers,
+                        data=data,  # form-urlencoded ou json selon l'API
+                        timeout=30.0
+                    )
+
+                    response.raise_for_status()
                 result = response.json()
 
                 logger.info(f"Paiement Airtel initié: {reference}, Response: {result}")
@@ -295,7 +299,8 @@ class MobileMoneyService:
             filename = f"/tmp/proposition_delivery_{souscription_uuid}.pdf"
 
             try:
-                success = generate_product_receipt_pdf(
+                success = await asyncio.to_thread(
+                    generate_product_receipt_pdf,
                     output_filename=filename,
                     nom_complet=client_name,
                     telephone=client_phone,
@@ -505,7 +510,8 @@ Merci d'avoir choisi NSIA Assurances! 🙏"""
             filename = f"/tmp/proposition_agency_{souscription_uuid}.pdf"
 
             try:
-                success = generate_product_receipt_pdf(
+                success = await asyncio.to_thread(
+                    generate_product_receipt_pdf,
                     output_filename=filename,
                     nom_complet=client_name,
                     telephone=client_phone,
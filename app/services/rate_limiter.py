@@ -0,0 +1,71 @@
+"""
+Limites de débit des tours de chat
+
+Un numéro abusif, ou une passerelle cassée qui réessaie en boucle, peut
+occuper des runs d'agent et consommer des tokens. Chaque nouveau tour est
+compté dans deux fenêtres glissantes partagées entre workers (Redis): par
+numéro (RATE_LIMIT_PER_PHONE) et par session (RATE_LIMIT_PER_SESSION).
+Un tour refusé n'est pas compté; si Redis est indisponible, les tours passent.
+"""
+import logging
+import math
+import uuid
+
+from app.config import settings
+from app.utils.instrumentation import ADMISSION_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Limite glissante atteinte pour le numéro ou la session"""
+
+    def __init__(self, scope: str, retry_after: float):
+        self.scope = scope
+        self.retry_after = retry_after
+        super().__init__(f"limite par {scope} atteinte (réessai dans {retry_after:.1f}s)")
+
+    @property
+    def retry_after_header(self) -> str:
+        """Valeur de l'en-tête Retry-After (secondes entières)"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class ChatRateLimiter:
+    """Fenêtres glissantes par numéro et par session"""
+
+    async def check(self, user_phone: str, session_id: str) -> None:
+        """
+        Compte un nouveau tour
+
+        Raises:
+            RateLimitExceeded: Le numéro ou la session a atteint sa limite
+        """
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+
+        from app.services.redis_client import redis_service
+
+        window = settings.RATE_LIMIT_WINDOW
+        limits = []
+        if settings.RATE_LIMIT_PER_PHONE:
+            limits.append(("phone", "", settings.RATE_LIMIT_PER_PHONE))
+        if settings.RATE_LIMIT_PER_SESSION:
+            limits.append(("session", f"session:{session_id}", settings.RATE_LIMIT_PER_SESSION))
+        if not limits:
+            return
+
+        exceeded = await redis_service.hit_rate_limits(
+            user_phone,
+            [(scope, window, limit) for _, scope, limit in limits],
+            uuid.uuid4().hex
+        )
+        if exceeded is not None:
+            index, retry_after = exceeded
+            reason = limits[index][0]
+            ADMISSION_REJECTIONS.inc(reason=reason)
+            raise RateLimitExceeded(reason, retry_after)
+
+
+# Instance globale
+chat_rate_limiter = ChatRateLimiter()
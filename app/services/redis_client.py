@@ -1,121 +1,555 @@
 """
-Client Redis/Upstash pour la gestion de la mémoire de conversation
+Client Redis/Upstash (asyncio, pool de connexions) pour la gestion de la mémoire de conversation
 """
-from redis import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import NoScriptError
 from app.config import settings
 from app.models.state import ConversationState
-from typing import Optional
+from app.services.session_cache import session_cache
+from app.services.session_store import SessionStore, embedded_store
+from app.utils.codec import codec
+from app.utils.instrumentation import InstrumentedRedis
+from datetime import datetime
+from typing import Dict, Optional, Set
+from urllib.parse import urlparse
+import asyncio
+import hashlib
 import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 
-class RedisService:
+# Écriture conditionnelle des champs modifiés + ajout des nouveaux messages
+# KEYS: hash de la session, liste d'historique
+# ARGV: ttl, messages max, nombre n de champs,
+#       n triplets (champ, sha1 de la valeur lue, "" si absente ou "*" sans condition,
+#       nouvelle valeur),
+#       puis les nouveaux messages
+# Retourne les champs modifiés entre-temps par un autre écrivain (rien n'est écrit)
+SAVE_STATE_SCRIPT = """
+local n = tonumber(ARGV[3])
+local last = 3 + n * 3
+local conflicts = {}
+for i = 4, last, 3 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    local digest = current and redis.sha1hex(current) or ''
+    if ARGV[i + 1] ~= '*' and digest ~= ARGV[i + 1] then
+        conflicts[#conflicts + 1] = ARGV[i]
+    end
+end
+if #conflicts > 0 then
+    return conflicts
+end
+for i = 4, last, 3 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+end
+if #ARGV > last then
+    redis.call('RPUSH', KEYS[2], unpack(ARGV, last + 1))
+    redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return conflicts
+"""
+
+# Ajout d'un message hors sauvegarde complète, si la session existe
+# KEYS: hash de la session, liste d'historique
+# ARGV: ttl, messages max, message encodé, last_message encodé
+# message_count est incrémenté dans son propre encodage (en-tête du codec
+# + msgpack ou JSON, ou JSON sans en-tête pour une valeur héritée)
+APPEND_MESSAGE_SCRIPT = """
+local raw = redis.call('HGET', KEYS[1], 'message_count')
+if not raw then
+    return 0
+end
+local first = string.byte(raw, 1)
+local count
+if first < 32 and first ~= 9 and first ~= 10 and first ~= 13 then
+    local header, payload = string.sub(raw, 1, 2), string.sub(raw, 3)
+    if string.byte(raw, 2) % 16 == 2 then
+        count = header .. cmsgpack.pack(cmsgpack.unpack(payload) + 1)
+    else
+        count = header .. tostring(tonumber(payload) + 1)
+    end
+else
+    count = tostring(tonumber(raw) + 1)
+end
+redis.call('HSET', KEYS[1], 'message_count', count, 'last_message', ARGV[4])
+redis.call('RPUSH', KEYS[2], ARGV[3])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Écriture directe de champs, si la session existe
+# KEYS: hash de la session; ARGV: ttl (0 = inchangé), puis paires champ / valeur
+UPDATE_FIELDS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+if tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+
+# Réservation des sessions proches de l'expiration, pour l'archiveur
+# KEYS: index des échéances; ARGV: échéance max, nombre max, fin du bail
+# Les sessions réservées sont repoussées à la fin du bail: un autre worker
+# ne les reprend que si leur archivage n'a pas abouti
+CLAIM_EXPIRING_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, id in ipairs(ids) do
+    redis.call('ZADD', KEYS[1], ARGV[3], id)
+end
+return ids
+"""
+
+# Retrait de l'index des sessions archivées, sauf si un tour a repoussé leur échéance
+# KEYS: index des échéances; ARGV: fin du bail, puis IDs des sessions
+RELEASE_ARCHIVED_SCRIPT = """
+local removed = 0
+for i = 2, #ARGV do
+    if tonumber(redis.call('ZSCORE', KEYS[1], ARGV[i])) == tonumber(ARGV[1]) then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+# Limites glissantes (journal des tours dans un sorted set par compteur)
+# KEYS: compteurs (même hash tag); ARGV: maintenant (ms), ID du tour,
+#       puis fenêtre (ms) et limite de chaque compteur
+# Retourne {0, 0} si le tour est admis (compté partout), sinon
+# {indice du compteur dépassé, attente en ms avant qu'un tour en sorte}
+RATE_LIMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+for i = 1, #KEYS do
+    local window = tonumber(ARGV[1 + i * 2])
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now - window)
+    if redis.call('ZCARD', KEYS[i]) >= tonumber(ARGV[2 + i * 2]) then
+        local oldest = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+        return {i, tonumber(oldest[2]) + window - now}
+    end
+end
+for i = 1, #KEYS do
+    redis.call('ZADD', KEYS[i], now, ARGV[2])
+    redis.call('PEXPIRE', KEYS[i], ARGV[1 + i * 2])
+end
+return {0, 0}
+"""
+
+
+def _sha1(data) -> str:
+    return hashlib.sha1(data if isinstance(data, bytes) else data.encode()).hexdigest()
+
+
+SAVE_STATE_SHA = _sha1(SAVE_STATE_SCRIPT)
+
+
+class RedisService(SessionStore):
     """Service de gestion Redis pour la mémoire de conversation"""
 
     def __init__(self):
-        """Initialise le client Redis/Upstash"""
+        """Le client est créé au démarrage de l'application (connect)"""
+        self.client = None
+        # Repli si Redis est absent ou en panne: sessions gardées dans le worker
+        self.fallback = embedded_store
+        # Sessions écrites dans le store embarqué pendant une panne -> messages absents de Redis
+        self._degraded: Dict[str, int] = {}
+        self._redis = None
+        # Mode cluster: connexion dédiée au pub/sub
+        self._bus: Optional[Redis] = None
+        # Prolongations de TTL lancées sur un succès du cache L1 (sans attendre Redis)
+        self._touches: Set[asyncio.Task] = set()
+
+    async def connect(self) -> bool:
+        """
+        Crée le client Redis/Upstash asyncio et son pool de connexions
+
+        Le pool est borné (REDIS_MAX_CONNECTIONS): au-delà, une commande
+        attend une connexion libre jusqu'à REDIS_POOL_TIMEOUT au lieu d'ouvrir
+        une connexion de plus.
+
+        Selon REDIS_MODE, le client vise un seul nœud (single), un Redis
+        Cluster (cluster, REDIS_URL = un nœud du cluster) ou plusieurs nœuds
+        indépendants répartis par hachage cohérent (sharded, REDIS_SHARD_URLS).
+        Dans les deux derniers cas les clés d'une session partagent un hash
+        tag: elles restent sur le même nœud.
+
+        Returns:
+            True si le client est disponible
+        """
+        if self.client is not None:
+            return True
+
+        mode = settings.REDIS_MODE
+        urls = [url.strip() for url in settings.REDIS_SHARD_URLS.split(",") if url.strip()] \
+            if mode == "sharded" else [settings.REDIS_URL] if settings.REDIS_URL else []
+        if not urls:
+            logger.warning("REDIS_URL non configurée. Running without Redis cache.")
+            return False
+
         try:
-            redis_url = settings.REDIS_URL
-
-            # Convertir l'URL Upstash (https://) en format Redis standard (rediss://)
-            if redis_url and redis_url.startswith('https://'):
-                redis_url = redis_url.replace('https://', 'rediss://')
-                logger.info(f"Converted Upstash URL to Redis URL format")
-
-            # Pour Upstash Redis, on utilise from_url avec le token dans l'URL
-            # ou en utilisant les headers appropriés
-            if hasattr(settings, 'REDIS_TOKEN') and settings.REDIS_TOKEN:
-                # Upstash Redis avec token
-                self.client = Redis.from_url(
-                    redis_url,
-                    decode_responses=True,
-                    password=settings.REDIS_TOKEN
-                )
+            urls = [self._redis_url(url) for url in urls]
+            options = {
+                # Réponses en bytes: les valeurs de session sont binaires (app.utils.codec)
+                "decode_responses": False,
+                "max_connections": settings.REDIS_MAX_CONNECTIONS,
+                "socket_timeout": settings.REDIS_SOCKET_TIMEOUT,
+                "socket_connect_timeout": settings.REDIS_CONNECT_TIMEOUT,
+                "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+            }
+            # Upstash Redis avec token (sinon mot de passe éventuel dans l'URL)
+            if settings.REDIS_TOKEN:
+                options["password"] = settings.REDIS_TOKEN
+
+            if mode == "cluster":
+                from redis.asyncio.cluster import RedisCluster
+                self._redis = RedisCluster.from_url(urls[0], **options)
+                # Pas de pub/sub sur le client cluster: connexion directe au nœud d'amorçage
+                # (un PUBLISH est diffusé à tous les nœuds du cluster)
+                self._bus = Redis.from_url(urls[0], **{**options, "max_connections": 2})
+            elif mode == "sharded":
+                from app.services.redis_shards import ShardedRedis
+                nodes = [self._pooled_client(url, options) for url in urls]
+                self._redis = ShardedRedis(nodes, [self._node_name(url) for url in urls])
             else:
-                # Redis standard
-                self.client = Redis.from_url(
-                    redis_url,
-                    decode_responses=True
-                )
-            logger.info("Redis client initialisé")
+                self._redis = self._pooled_client(urls[0], options)
+            self.client = InstrumentedRedis(self._redis)
+
         except Exception as e:
             logger.warning(f"Redis initialization failed: {e}. Running without Redis cache.")
-            self.client = None
+            return False
+
+        try:
+            await self.client.ping()
+            logger.info(f"Redis client initialisé (mode {mode}, {len(urls)} URL, pool: {settings.REDIS_MAX_CONNECTIONS} connexions par nœud)")
+        except Exception as e:
+            # Le pool se reconnectera à la prochaine commande
+            logger.warning(f"Redis injoignable au démarrage: {e}")
+        return True
+
+    @staticmethod
+    def _redis_url(url: str) -> str:
+        # Convertir l'URL Upstash (https://) en format Redis standard (rediss://)
+        if url.startswith('https://'):
+            url = url.replace('https://', 'rediss://')
+            logger.info(f"Converted Upstash URL to Redis URL format")
+        return url
+
+    @staticmethod
+    def _pooled_client(url: str, options: dict) -> Redis:
+        """Client d'un nœud, avec pool bloquant"""
+        pool = BlockingConnectionPool.from_url(
+            url,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            retry_on_timeout=True,
+            **options
+        )
+        return Redis(connection_pool=pool)
+
+    @staticmethod
+    def _node_name(url: str) -> str:
+        """Identité d'un nœud sur l'anneau (sans les identifiants de l'URL)"""
+        parsed = urlparse(url)
+        return f"{parsed.hostname}:{parsed.port or 6379}{parsed.path}"
+
+    @property
+    def pubsub_client(self):
+        """Client portant le pub/sub (invalidations du cache de sessions)"""
+        return self._bus or self.client
+
+    async def close(self) -> None:
+        """Ferme les connexions du pool (à l'arrêt de l'application)"""
+        redis, self._redis, self.client = self._redis, None, None
+        bus, self._bus = self._bus, None
+        if redis is None:
+            return
+
+        try:
+            await redis.aclose()
+            if isinstance(redis, Redis):
+                await redis.connection_pool.disconnect()
+            if bus is not None:
+                await bus.aclose()
+            logger.info("Redis client fermé")
+        except Exception as e:
+            logger.error(f"Erreur fermeture Redis: {e}")
+
+    def _tag(self, session_id: str) -> str:
+        """
+        ID de session tel qu'il figure dans les clés
+
+        En cluster ou réparti, entre accolades (hash tag): toutes les clés
+        de la session sont sur le même nœud, condition des scripts Lua
+        à plusieurs clés.
+        """
+        return session_id if settings.REDIS_MODE == "single" else f"{{{session_id}}}"
 
     def _get_session_key(self, session_id: str) -> str:
-        """Génère la clé Redis pour une session"""
-        return f"session:{session_id}"
+        """Clé de l'ancien format (état + historique dans une seule valeur JSON)"""
+        return f"session:{self._tag(session_id)}"
+
+    def _get_state_key(self, session_id: str) -> str:
+        """Hash des champs scalaires de la session"""
+        return f"session:{self._tag(session_id)}:state"
+
+    def _get_history_key(self, session_id: str) -> str:
+        """Liste des messages de la session (ajout en fin, tronquée)"""
+        return f"session:{self._tag(session_id)}:history"
 
-    async def get_conversation_state(self, session_id: str) -> Optional[ConversationState]:
+    async def get_conversation_state(self, session_id: str, touch: bool = False) -> Optional[ConversationState]:
         """
-        Récupère l'état de conversation depuis Redis
+        Récupère l'état de conversation depuis Redis (un seul aller-retour)
+
+        Seule la fenêtre récente de l'historique (SESSION_HISTORY_WINDOW) est
+        relue: le volume lu ne grandit pas avec la conversation.
 
         Args:
             session_id: ID de la session
+            touch: Prolonger le TTL de la session dans le même aller-retour
 
         Returns:
             ConversationState ou None si pas trouvé
         """
-        if self.client is None:
-            logger.warning("Redis client not available. Returning None for conversation state.")
-            return None
+        if self._uses_fallback(session_id):
+            state = await self.fallback.get_conversation_state(session_id, touch)
+            if state is not None or self.client is None:
+                return state
+            # Session dégradée expirée du store embarqué
+            self._degraded.pop(session_id, None)
+
+        cached = session_cache.get(session_id)
+        if cached is not None:
+            fields, messages, _ = cached
+            if not fields:
+                return None
+            if touch:
+                # Le tour ne doit pas attendre: TTL prolongé en tâche de fond
+                task = asyncio.create_task(self.extend_session_ttl(session_id))
+                self._touches.add(task)
+                task.add_done_callback(self._touches.discard)
+            return ConversationState.from_redis_hash(fields, messages)
 
         try:
-            key = self._get_session_key(session_id)
-            data = self.client.get(key)
+            state_key = self._get_state_key(session_id)
+            history_key = self._get_history_key(session_id)
+
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hgetall(state_key)
+            pipe.lrange(history_key, -settings.SESSION_HISTORY_WINDOW, -1)
+            # Sessions écrites avant le stockage hash + liste (migrées à la lecture)
+            pipe.get(self._get_session_key(session_id))
+            if touch:
+                pipe.expire(state_key, settings.SESSION_TTL)
+                pipe.expire(history_key, settings.SESSION_TTL)
+                self._queue_expiry(pipe, session_id, settings.SESSION_TTL)
+            fields, messages, legacy = (await pipe.execute())[:3]
+
+            if fields:
+                session_cache.put(session_id, fields, messages)
+                return ConversationState.from_redis_hash(fields, messages)
 
-            if data:
-                state_dict = json.loads(data)
-                return ConversationState.from_redis_dict(state_dict)
+            if legacy:
+                state = ConversationState.from_redis_dict(json.loads(legacy))
+                state.message_count = state.message_count or len(state.message_history)
+                await self._write_state(session_id, state, settings.SESSION_TTL, drop_legacy=True)
+                state.message_history = state.message_history[-settings.SESSION_HISTORY_WINDOW:]
+                state.mark_saved()
+                return state
 
-            # Nouvelle session
+            # Nouvelle session (mémorisée comme absente jusqu'à sa première écriture)
+            session_cache.put(session_id, {}, [])
             logger.info(f"Nouvelle session: {session_id}")
             return None
 
         except Exception as e:
             logger.error(f"Erreur récupération state Redis: {e}")
-            return None
+            state = await self.fallback.get_conversation_state(session_id, touch)
+            if state is None:
+                # Dernière version vue par ce worker: mieux qu'un contexte perdu
+                known = session_cache.peek(session_id)
+                if known and known[0]:
+                    state = ConversationState.from_redis_hash(known[0], known[1])
+            return state
 
     async def save_conversation_state(
         self,
         session_id: str,
         state: ConversationState,
-        ttl: Optional[int] = None
+        ttl: Optional[int] = None,
+        flight_records: Optional[list] = None
     ) -> bool:
         """
-        Sauvegarde l'état de conversation dans Redis
+        Sauvegarde l'état de conversation dans Redis (un seul aller-retour)
+
+        Les champs scalaires sont réécrits dans le hash; seuls les messages
+        ajoutés depuis le chargement sont poussés dans la liste d'historique.
 
         Args:
             session_id: ID de la session
             state: État de conversation
             ttl: Time to live en secondes (défaut: settings.SESSION_TTL)
+            flight_records: Étapes du tour à ajouter à l'enregistreur de vol,
+                écrites dans la même transaction que l'état
+
+        Si Redis est absent ou en erreur, la session est gardée dans le store
+        embarqué du worker, puis recopiée dans Redis à la première écriture
+        qui réussit.
 
         Returns:
             True si succès
         """
         if self.client is None:
-            logger.warning("Redis client not available. Cannot save conversation state.")
-            return False
+            return await self.fallback.save_conversation_state(session_id, state, ttl)
 
+        ttl = ttl or settings.SESSION_TTL
+        pending = self._degraded.get(session_id)
+        checkpoint = state.checkpoint()
         try:
-            key = self._get_session_key(session_id)
-            data = json.dumps(state.to_redis_dict())
-
-            # Définir la valeur
-            self.client.set(key, data)
-
-            # Définir l'expiration
-            ttl = ttl or settings.SESSION_TTL
-            self.client.expire(key, ttl)
-
+            if pending is not None:
+                # Session tenue par le store embarqué: réécriture complète dans Redis
+                state.detach(pending + len(state.unsaved_messages()))
+            await self._write_state(session_id, state, ttl, flight_records)
             logger.info(f"State sauvegardé pour session {session_id}, TTL: {ttl}s")
+
+            if pending is not None:
+                self._degraded.pop(session_id, None)
+                await self.fallback.delete_conversation_state(session_id)
+                logger.info(f"♻️ Session {session_id} recopiée dans Redis ({pending} messages en attente)")
             return True
 
         except Exception as e:
             logger.error(f"Erreur sauvegarde state Redis: {e}")
-            return False
+            state.restore(checkpoint)
+            session_cache.invalidate(session_id)
+            return await self._save_degraded(session_id, state, ttl)
+
+    async def _save_degraded(self, session_id: str, state: ConversationState, ttl: int) -> bool:
+        """Écriture dans le store embarqué pendant une panne Redis"""
+        if session_id in self._degraded:
+            self._degraded[session_id] += len(state.unsaved_messages())
+        else:
+            # Première écriture dégradée: copie complète de la session
+            self._degraded[session_id] = len(state.unsaved_messages())
+            await self.fallback.delete_conversation_state(session_id)
+            state.detach()
+
+        logger.warning(f"⚠️ Session {session_id} gardée dans le store embarqué (Redis indisponible)")
+        return await self.fallback.save_conversation_state(session_id, state, ttl)
+
+    def _uses_fallback(self, session_id: str) -> bool:
+        """Session servie par le store embarqué (pas de Redis, ou écrite pendant une panne)"""
+        return self.client is None or session_id in self._degraded
+
+    async def _write_state(
+        self,
+        session_id: str,
+        state: ConversationState,
+        ttl: int,
+        flight_records: Optional[list] = None,
+        drop_legacy: bool = False
+    ) -> None:
+        """
+        Champs modifiés + nouveaux messages (+ étapes du tour) en un aller-retour
+
+        SAVE_STATE_SCRIPT n'écrit les champs que si Redis contient encore les
+        valeurs lues au chargement. Sinon un autre écrivain (callback de
+        paiement, tour concurrent) les a modifiés: ces champs sont relus,
+        fusionnés (rebase_field) et l'écriture est retentée, sans écraser
+        les champs que ce tour n'a pas touchés.
+        """
+        fields = state.dirty_fields()
+        messages = [codec.encode(message) for message in state.unsaved_messages()]
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.evalsha(*self._save_state_args(session_id, state, fields, messages, ttl))
+        if flight_records:
+            self._queue_flight_records(pipe, session_id, flight_records, settings.FLIGHT_RECORDER_MAX_STEPS, ttl)
+        if drop_legacy:
+            pipe.delete(self._get_session_key(session_id))
+        if state.payment_reference and "payment_reference" in fields:
+            # Le callback ePay ne connaît que la référence: lien vers la session
+            pipe.set(self._get_payment_session_key(state.payment_reference), session_id, ex=ttl)
+        self._queue_expiry(pipe, session_id, ttl)
+        self._queue_invalidation(pipe, session_id)
+        conflicts = (await pipe.execute(raise_on_error=False))[0]
+        # Écriture faite après l'invalidation du pipeline (script rechargé ou rebase)
+        retried = False
+
+        for attempt in range(settings.SESSION_SAVE_RETRIES + 1):
+            if isinstance(conflicts, NoScriptError):
+                conflicts = await self._run_script(SAVE_STATE_SCRIPT, *self._save_state_args(session_id, state, fields, messages, ttl)[1:])
+                retried = True
+            if isinstance(conflicts, Exception):
+                raise conflicts
+            if not conflicts:
+                break
+            if attempt == settings.SESSION_SAVE_RETRIES:
+                raise RuntimeError(f"Conflit d'écriture persistant sur {conflicts}")
+
+            names = [name.decode() if isinstance(name, bytes) else name for name in conflicts]
+            logger.warning(f"⚠️ Session {session_id} modifiée entre-temps ({', '.join(names)}): fusion et nouvel essai")
+            current = await self.client.hmget(self._get_state_key(session_id), names)
+            for name, raw in zip(names, current):
+                state.rebase_field(name, raw)
+
+            fields = state.dirty_fields()
+            conflicts = await self._run_script(SAVE_STATE_SCRIPT, *self._save_state_args(session_id, state, fields, messages, ttl)[1:])
+            retried = True
+
+        state.mark_saved(fields)
+
+        if retried:
+            # Les autres workers ont pu relire l'ancienne valeur entre-temps: republier
+            session_cache.invalidate(session_id)
+            await self._publish_invalidation(session_id)
+        else:
+            session_cache.update(session_id, state.persisted_hash(), messages)
+
+    def _save_state_args(
+        self,
+        session_id: str,
+        state: ConversationState,
+        fields: dict,
+        messages: list,
+        ttl: int
+    ) -> tuple:
+        """Arguments EVALSHA de SAVE_STATE_SCRIPT"""
+        args = [ttl, settings.SESSION_HISTORY_MAX, len(fields)]
+        for key, value in fields.items():
+            previous = state.persisted_field(key)
+            if state.is_detached():
+                expected = "*"
+            else:
+                expected = _sha1(previous) if previous is not None else ""
+            args += [key, expected, value]
+        args += messages
+        return (SAVE_STATE_SHA, 2, self._get_state_key(session_id), self._get_history_key(session_id), *args)
+
+    async def _run_script(self, script: str, numkeys: int, *keys_and_args):
+        """EVALSHA, avec chargement du script si Redis ne le connaît pas encore"""
+        sha = _sha1(script)
+        try:
+            return await self.client.evalsha(sha, numkeys, *keys_and_args)
+        except NoScriptError:
+            await self.client.script_load(script)
+            return await self.client.evalsha(sha, numkeys, *keys_and_args)
+
+    def _queue_invalidation(self, pipe, session_id: str) -> None:
+        """Ajoute au pipeline la publication de l'invalidation du cache L1 des autres workers"""
+        if settings.SESSION_CACHE_ENABLED:
+            pipe.publish(settings.SESSION_CACHE_CHANNEL, session_cache.invalidation_message(session_id))
+
+    async def _publish_invalidation(self, session_id: str) -> None:
+        if settings.SESSION_CACHE_ENABLED:
+            await self.client.publish(settings.SESSION_CACHE_CHANNEL, session_cache.invalidation_message(session_id))
 
     async def update_conversation_state(
         self,
@@ -124,35 +558,42 @@ class RedisService:
         ttl: Optional[int] = None
     ) -> bool:
         """
-        Met à jour partiellement l'état de conversation
+        Met à jour des champs de l'état de conversation, sans le relire
+
+        Les champs sont écrits atomiquement dans le hash de la session
+        (UPDATE_FIELDS_SCRIPT); les autres champs ne sont pas touchés.
 
         Args:
             session_id: ID de la session
             updates: Dictionnaire des champs à mettre à jour
-            ttl: Time to live en secondes
+            ttl: Time to live en secondes (défaut: TTL inchangé)
 
         Returns:
             True si succès
         """
+        if self._uses_fallback(session_id):
+            return await self.fallback.update_conversation_state(session_id, updates, ttl)
+
         try:
-            # Récupérer l'état actuel
-            state = await self.get_conversation_state(session_id)
+            fields = ConversationState.encode_fields(updates)
+            if not fields:
+                return False
 
-            if not state:
+            args = [ttl or 0]
+            for key, value in fields.items():
+                args += [key, value]
+
+            if not await self._run_script(UPDATE_FIELDS_SCRIPT, 1, self._get_state_key(session_id), *args):
                 logger.warning(f"Impossible de mettre à jour - session introuvable: {session_id}")
                 return False
 
-            # Appliquer les mises à jour
-            for key, value in updates.items():
-                if hasattr(state, key):
-                    setattr(state, key, value)
-
-            # Sauvegarder
-            return await self.save_conversation_state(session_id, state, ttl)
+            session_cache.invalidate(session_id)
+            await self._publish_invalidation(session_id)
+            return True
 
         except Exception as e:
             logger.error(f"Erreur mise à jour state Redis: {e}")
-            return False
+            return await self.fallback.update_conversation_state(session_id, updates, ttl)
 
     async def delete_conversation_state(self, session_id: str) -> bool:
         """
@@ -164,9 +605,23 @@ class RedisService:
         Returns:
             True si succès
         """
+        self._degraded.pop(session_id, None)
+        await self.fallback.delete_conversation_state(session_id)
+        if self.client is None:
+            return True
+
         try:
-            key = self._get_session_key(session_id)
-            self.client.delete(key)
+            session_cache.invalidate(session_id)
+            pipe = self.client.pipeline(transaction=False)
+            pipe.delete(
+                self._get_state_key(session_id),
+                self._get_history_key(session_id),
+                self._get_session_key(session_id)
+            )
+            if settings.SESSION_ARCHIVE_ENABLED:
+                pipe.zrem(self._get_expiry_index_key(), session_id)
+            self._queue_invalidation(pipe, session_id)
+            await pipe.execute()
             logger.info(f"Session supprimée: {session_id}")
             return True
 
@@ -185,15 +640,21 @@ class RedisService:
         Returns:
             True si succès
         """
+        if self._uses_fallback(session_id):
+            return await self.fallback.extend_session_ttl(session_id, ttl)
+
         try:
-            key = self._get_session_key(session_id)
             ttl = ttl or settings.SESSION_TTL
-            self.client.expire(key, ttl)
+            pipe = self.client.pipeline(transaction=False)
+            pipe.expire(self._get_state_key(session_id), ttl)
+            pipe.expire(self._get_history_key(session_id), ttl)
+            self._queue_expiry(pipe, session_id, ttl)
+            await pipe.execute()
             return True
 
         except Exception as e:
             logger.error(f"Erreur extension TTL: {e}")
-            return False
+            return await self.fallback.extend_session_ttl(session_id, ttl)
 
     async def session_exists(self, session_id: str) -> bool:
         """
@@ -205,14 +666,456 @@ class RedisService:
         Returns:
             True si existe
         """
+        if self._uses_fallback(session_id):
+            return await self.fallback.session_exists(session_id)
+
         try:
-            key = self._get_session_key(session_id)
-            return self.client.exists(key) > 0
+            return (await self.client.exists(
+                self._get_state_key(session_id),
+                self._get_session_key(session_id)
+            )) > 0
 
         except Exception as e:
             logger.error(f"Erreur vérification session: {e}")
+            return await self.fallback.session_exists(session_id)
+
+    def _get_payment_session_key(self, transaction_reference: str) -> str:
+        return f"payment_session:{transaction_reference}"
+
+    async def get_payment_session(self, transaction_reference: str) -> Optional[str]:
+        """
+        Session à l'origine d'un paiement
+
+        Args:
+            transaction_reference: Référence de la transaction
+
+        Returns:
+            ID de la session ou None
+        """
+        if self.client is None:
+            return await self.fallback.get_payment_session(transaction_reference)
+
+        try:
+            session_id = await self.client.get(self._get_payment_session_key(transaction_reference))
+            if session_id is None:
+                return await self.fallback.get_payment_session(transaction_reference)
+            return session_id.decode() if isinstance(session_id, bytes) else session_id
+
+        except Exception as e:
+            logger.error(f"Erreur récupération session du paiement: {e}")
+            return await self.fallback.get_payment_session(transaction_reference)
+
+    async def get_payment_confirmation(self, transaction_reference: str) -> Optional[str]:
+        """
+        Récupère le flag de confirmation posé par le callback de paiement
+
+        Args:
+            transaction_reference: Référence de la transaction
+
+        Returns:
+            Statut API du paiement confirmé, ou None si pas (encore) confirmé
+        """
+        if self.client is None:
+            return None
+
+        try:
+            status = await self.client.get(f"payment_confirmed:{transaction_reference}")
+            return status.decode() if isinstance(status, bytes) else status
+
+        except Exception as e:
+            logger.error(f"Erreur lecture confirmation paiement: {e}")
+            return None
+
+    async def set_payment_confirmation(self, transaction_reference: str, status: str, ttl: int = 3600) -> bool:
+        """
+        Pose le flag de confirmation d'un paiement validé
+
+        Args:
+            transaction_reference: Référence de la transaction
+            status: Statut API du paiement
+            ttl: Durée de conservation en secondes
+
+        Returns:
+            True si succès
+        """
+        if self.client is None:
+            return False
+
+        try:
+            await self.client.set(f"payment_confirmed:{transaction_reference}", status, ex=ttl)
+            return True
+
+        except Exception as e:
+            logger.error(f"Erreur enregistrement confirmation paiement: {e}")
+            return False
+
+    # ========================================================================
+    # ARCHIVAGE DES SESSIONS (index des échéances)
+    # ========================================================================
+
+    def _get_expiry_index_key(self) -> str:
+        """Sorted set des sessions par échéance (timestamp Unix), tenu si SESSION_ARCHIVE_ENABLED"""
+        return "sessions:expiring"
+
+    def _queue_expiry(self, pipe, session_id: str, ttl: int) -> None:
+        """Ajoute au pipeline l'échéance de la session dans l'index de l'archiveur"""
+        if settings.SESSION_ARCHIVE_ENABLED:
+            pipe.zadd(self._get_expiry_index_key(), {session_id: int(time.time()) + ttl})
+
+    async def claim_expiring_sessions(self, before: int, limit: int, lease_until: int) -> list:
+        """
+        Réserve les sessions dont l'échéance tombe avant `before`
+
+        Args:
+            before: Échéance max (timestamp Unix)
+            limit: Nombre max de sessions
+            lease_until: Fin de la réservation (timestamp Unix)
+
+        Returns:
+            IDs des sessions réservées
+        """
+        if self.client is None:
+            return []
+
+        try:
+            ids = await self._run_script(CLAIM_EXPIRING_SCRIPT, 1, self._get_expiry_index_key(), before, limit, lease_until)
+            return [session_id.decode() if isinstance(session_id, bytes) else session_id for session_id in ids]
+
+        except Exception as e:
+            logger.error(f"Erreur réservation des sessions à archiver: {e}")
+            return []
+
+    async def get_session_snapshots(self, session_ids: list) -> Dict[str, ConversationState]:
+        """
+        État complet (tous les messages conservés) des sessions, en un aller-retour
+
+        Les sessions déjà expirées sont absentes du résultat. Les erreurs
+        Redis sont propagées: l'archiveur retente au prochain passage.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.hgetall(self._get_state_key(session_id))
+            pipe.lrange(self._get_history_key(session_id), 0, -1)
+        results = await pipe.execute()
+
+        snapshots = {}
+        for index, session_id in enumerate(session_ids):
+            fields, messages = results[2 * index], results[2 * index + 1]
+            if fields:
+                snapshots[session_id] = ConversationState.from_redis_hash(fields, messages)
+        return snapshots
+
+    async def release_archived_sessions(self, session_ids: list, lease_until: int) -> int:
+        """Retire de l'index les sessions archivées (sauf échéance repoussée entre-temps)"""
+        if self.client is None or not session_ids:
+            return 0
+
+        try:
+            return await self._run_script(RELEASE_ARCHIVED_SCRIPT, 1, self._get_expiry_index_key(), lease_until, *session_ids)
+
+        except Exception as e:
+            logger.error(f"Erreur mise à jour de l'index d'archivage: {e}")
+            return 0
+
+    # ========================================================================
+    # LIMITES DE DÉBIT (fenêtres glissantes)
+    # ========================================================================
+
+    def _get_rate_limit_key(self, user_phone: str, scope: str) -> str:
+        """Compteur d'un numéro (scope vide) ou d'une de ses sessions; hash tag du numéro"""
+        return f"ratelimit:{{{user_phone}}}:{scope}" if scope else f"ratelimit:{{{user_phone}}}"
+
+    async def hit_rate_limits(self, user_phone: str, limits: list, turn_id: str) -> Optional[tuple]:
+        """
+        Compte un tour dans les fenêtres glissantes, s'il passe toutes les limites
+
+        Args:
+            user_phone: Numéro (les compteurs partagent son hash tag)
+            limits: (scope, fenêtre en secondes, limite) par compteur;
+                scope "" pour le numéro, sinon "session:<id>"
+            turn_id: ID unique du tour
+
+        Returns:
+            None si le tour est admis (ou Redis indisponible),
+            sinon (indice de la limite dépassée, attente en secondes)
+        """
+        if self.client is None or not limits:
+            return None
+
+        try:
+            keys = [self._get_rate_limit_key(user_phone, scope) for scope, _, _ in limits]
+            args = [int(time.time() * 1000), turn_id]
+            for _, window, limit in limits:
+                args += [int(window * 1000), limit]
+
+            index, retry_ms = await self._run_script(RATE_LIMIT_SCRIPT, len(keys), *keys, *args)
+            return (int(index) - 1, max(int(retry_ms), 0) / 1000) if int(index) else None
+
+        except Exception as e:
+            # Sans Redis, les tours passent (le plafond des runs par worker reste actif)
+            logger.error(f"Erreur limites de débit: {e}")
+            return None
+
+    # ========================================================================
+    # JOBS DE CHAT ASYNCHRONES
+    # ========================================================================
+
+    async def save_chat_job(self, job_id: str, job: dict, ttl: Optional[int] = None) -> bool:
+        """
+        Sauvegarde l'état d'un job de chat asynchrone
+
+        Args:
+            job_id: ID du job
+            job: Statut, réponse et métadonnées du job
+            ttl: Time to live en secondes (défaut: settings.CHAT_JOB_TTL)
+
+        Returns:
+            True si succès
+        """
+        if self.client is None:
+            return False
+
+        try:
+            await self.client.set(f"chat_job:{job_id}", json.dumps(job), ex=ttl or settings.CHAT_JOB_TTL)
+            return True
+
+        except Exception as e:
+            logger.error(f"Erreur sauvegarde job {job_id}: {e}")
+            return False
+
+    async def get_chat_job(self, job_id: str) -> Optional[dict]:
+        """
+        Récupère l'état d'un job de chat asynchrone
+
+        Args:
+            job_id: ID du job
+
+        Returns:
+            Dict du job ou None si introuvable
+        """
+        if self.client is None:
+            return None
+
+        try:
+            data = await self.client.get(f"chat_job:{job_id}")
+            return json.loads(data) if data else None
+
+        except Exception as e:
+            logger.error(f"Erreur lecture job {job_id}: {e}")
+            return None
+
+    # ========================================================================
+    # DÉDUPLICATION DES MESSAGES ENTRANTS
+    # ========================================================================
+
+    def _get_message_key(self, session_id: str, message_id: str) -> str:
+        """Génère la clé Redis d'un message entrant"""
+        return f"chat_message:{self._tag(session_id)}:{message_id}"
+
+    async def claim_message(self, session_id: str, message_id: str, record: dict, ttl: int) -> Optional[bool]:
+        """
+        Réserve un message entrant (SET NX): seul le premier appel le traite
+
+        Args:
+            session_id: ID de la session
+            message_id: ID du message chez la passerelle
+            record: Enregistrement "processing" à poser
+            ttl: Durée de la réservation en secondes
+
+        Returns:
+            True si réservé, False si déjà connu, None si Redis indisponible
+        """
+        if self.client is None:
+            return None
+
+        try:
+            key = self._get_message_key(session_id, message_id)
+            return bool(await self.client.set(key, json.dumps(record), nx=True, ex=ttl))
+
+        except Exception as e:
+            logger.error(f"Erreur réservation message {message_id}: {e}")
+            return None
+
+    async def get_message_record(self, session_id: str, message_id: str) -> Optional[dict]:
+        """
+        Récupère l'enregistrement de déduplication d'un message
+
+        Args:
+            session_id: ID de la session
+            message_id: ID du message
+
+        Returns:
+            Dict de l'enregistrement ou None
+        """
+        if self.client is None:
+            return None
+
+        try:
+            data = await self.client.get(self._get_message_key(session_id, message_id))
+            return json.loads(data) if data else None
+
+        except Exception as e:
+            logger.error(f"Erreur lecture message {message_id}: {e}")
+            return None
+
+    async def save_message_record(self, session_id: str, message_id: str, record: dict, ttl: int) -> bool:
+        """
+        Enregistre la réponse d'un message traité
+
+        Args:
+            session_id: ID de la session
+            message_id: ID du message
+            record: Enregistrement "completed" (réponse + métadonnées)
+            ttl: Durée de conservation en secondes
+
+        Returns:
+            True si succès
+        """
+        if self.client is None:
+            return False
+
+        try:
+            key = self._get_message_key(session_id, message_id)
+            await self.client.set(key, json.dumps(record), ex=ttl)
+            return True
+
+        except Exception as e:
+            logger.error(f"Erreur sauvegarde message {message_id}: {e}")
+            return False
+
+    async def delete_message_record(self, session_id: str, message_id: str) -> bool:
+        """
+        Supprime l'enregistrement d'un message (échec: la passerelle pourra réessayer)
+
+        Args:
+            session_id: ID de la session
+            message_id: ID du message
+
+        Returns:
+            True si succès
+        """
+        if self.client is None:
+            return False
+
+        try:
+            await self.client.delete(self._get_message_key(session_id, message_id))
+            return True
+
+        except Exception as e:
+            logger.error(f"Erreur suppression message {message_id}: {e}")
+            return False
+
+    # ========================================================================
+    # ENREGISTREUR DE VOL (étapes de l'agent par session)
+    # ========================================================================
+
+    def _get_flight_key(self, session_id: str) -> str:
+        return f"flight:{self._tag(session_id)}"
+
+    async def append_flight_records(self, session_id: str, records: list, max_len: int, ttl: Optional[int] = None) -> bool:
+        """
+        Ajoute les étapes d'un tour au tampon circulaire de la session (un seul aller-retour)
+
+        Args:
+            session_id: ID de la session
+            records: Étapes sérialisables du tour
+            max_len: Nombre maximal d'étapes conservées
+            ttl: Time to live en secondes (défaut: settings.SESSION_TTL)
+
+        Returns:
+            True si succès
+        """
+        if self.client is None or not records:
+            return False
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            self._queue_flight_records(pipe, session_id, records, max_len, ttl or settings.SESSION_TTL)
+            await pipe.execute()
+            return True
+
+        except Exception as e:
+            logger.error(f"Erreur enregistreur de vol {session_id}: {e}")
+            return False
+
+    def _queue_flight_records(self, pipe, session_id: str, records: list, max_len: int, ttl: int) -> None:
+        """Ajoute au pipeline l'écriture bornée des étapes d'un tour"""
+        key = self._get_flight_key(session_id)
+        pipe.rpush(key, *(json.dumps(record, separators=(",", ":")) for record in records))
+        pipe.ltrim(key, -max_len, -1)
+        pipe.expire(key, ttl)
+
+    async def get_flight_records(self, session_id: str, start: int = 0, end: int = -1) -> list:
+        """Étapes enregistrées d'une session (indices LRANGE, plus anciennes en premier)"""
+        if self.client is None:
+            return []
+
+        try:
+            return [json.loads(item) for item in await self.client.lrange(self._get_flight_key(session_id), start, end)]
+
+        except Exception as e:
+            logger.error(f"Erreur lecture enregistreur de vol {session_id}: {e}")
+            return []
+
+    # ========================================================================
+    # PROFILS DE REQUÊTES
+    # ========================================================================
+
+    async def save_profile(self, profile_id: str, profile: dict, ttl: int, keep: int = 50) -> bool:
+        """
+        Sauvegarde le profil d'une requête et l'ajoute à l'index des profils récents
+
+        Args:
+            profile_id: ID du profil
+            profile: Métadonnées et piles échantillonnées
+            ttl: Time to live en secondes
+            keep: Nombre d'IDs conservés dans l'index
+
+        Returns:
+            True si succès
+        """
+        if self.client is None:
+            return False
+
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(f"profile:{profile_id}", json.dumps(profile), ex=ttl)
+            pipe.lpush("profiles:recent", profile_id)
+            pipe.ltrim("profiles:recent", 0, keep - 1)
+            pipe.expire("profiles:recent", ttl)
+            await pipe.execute()
+            return True
+
+        except Exception as e:
+            logger.error(f"Erreur sauvegarde profil {profile_id}: {e}")
             return False
 
+    async def get_profile(self, profile_id: str) -> Optional[dict]:
+        """Récupère un profil de requête (None si absent ou expiré)"""
+        if self.client is None:
+            return None
+
+        try:
+            data = await self.client.get(f"profile:{profile_id}")
+            return json.loads(data) if data else None
+
+        except Exception as e:
+            logger.error(f"Erreur lecture profil {profile_id}: {e}")
+            return None
+
+    async def list_profile_ids(self) -> list:
+        """IDs des profils récents, du plus récent au plus ancien"""
+        if self.client is None:
+            return []
+
+        try:
+            ids = await self.client.lrange("profiles:recent", 0, -1)
+            return [profile_id.decode() if isinstance(profile_id, bytes) else profile_id for profile_id in ids]
+
+        except Exception as e:
+            logger.error(f"Erreur lecture index des profils: {e}")
+            return []
+
     # ========================================================================
     # MÉTHODES UTILITAIRES POUR MESSAGE HISTORY
     # ========================================================================
@@ -224,7 +1127,7 @@ class RedisService:
         content: str
     ) -> bool:
         """
-        Ajoute un message à l'historique de conversation
+        Ajoute un message à l'historique de conversation (sans relire l'état)
 
         Args:
             session_id: ID de la session
@@ -234,12 +1137,32 @@ class RedisService:
         Returns:
             True si succès
         """
+        if self._uses_fallback(session_id):
+            return await self.fallback.add_message_to_history(session_id, role, content)
+
         try:
-            state = await self.get_conversation_state(session_id)
-            if state:
-                state.add_message(role, content)
-                return await self.save_conversation_state(session_id, state)
-            return False
+            message = {"role": role, "content": content, "timestamp": datetime.utcnow().isoformat()}
+            args = (
+                2, self._get_state_key(session_id), self._get_history_key(session_id),
+                settings.SESSION_TTL, settings.SESSION_HISTORY_MAX,
+                codec.encode(message), ConversationState.encode_fields({"last_message": content})["last_message"]
+            )
+
+            # Un aller-retour: script (compteur, historique, TTL des deux clés) + invalidation
+            pipe = self.client.pipeline(transaction=False)
+            pipe.evalsha(_sha1(APPEND_MESSAGE_SCRIPT), *args)
+            self._queue_expiry(pipe, session_id, settings.SESSION_TTL)
+            self._queue_invalidation(pipe, session_id)
+            added = (await pipe.execute(raise_on_error=False))[0]
+            session_cache.invalidate(session_id)
+
+            if isinstance(added, NoScriptError):
+                # Invalidation publiée avant l'écriture: republier après
+                added = await self._run_script(APPEND_MESSAGE_SCRIPT, *args)
+                await self._publish_invalidation(session_id)
+            if isinstance(added, Exception):
+                raise added
+            return bool(added)
 
         except Exception as e:
             logger.error(f"Erreur ajout message: {e}")
@@ -256,11 +1179,12 @@ class RedisService:
         Returns:
             Liste des messages
         """
+        if self._uses_fallback(session_id):
+            return await self.fallback.get_message_history(session_id, limit)
+
         try:
-            state = await self.get_conversation_state(session_id)
-            if state and state.message_history:
-                return state.message_history[-limit:]
-            return []
+            messages = await self.client.lrange(self._get_history_key(session_id), -limit, -1)
+            return [codec.decode(message)[0] for message in messages]
 
         except Exception as e:
             logger.error(f"Erreur récupération historique: {e}")
@@ -269,3 +1193,6 @@ class RedisService:
 
 # Instance globale
 redis_service = RedisService()
+
+# Store de sessions de l'application: Redis (avec repli embarqué) ou embarqué seul
+session_store: SessionStore = embedded_store if settings.SESSION_STORE == "memory" else redis_service
@@ -0,0 +1,156 @@
+"""
+Répartition des clés Redis sur plusieurs nœuds indépendants (REDIS_MODE=sharded)
+
+Chaque clé est placée sur un anneau de hachage cohérent selon son hash tag,
+comme dans Redis Cluster: `session:{abc}:state` et `session:{abc}:history`
+sont placées d'après `abc`, donc sur le même nœud — les scripts Lua et les
+pipelines d'une session restent sur un seul nœud. Une clé sans hash tag est
+placée d'après la clé entière.
+
+Ajouter un nœud ne déplace qu'environ 1/N des clés (les sessions déplacées
+repartent de zéro, bornées par SESSION_TTL).
+"""
+from typing import Any, Dict, List, Tuple
+import asyncio
+import bisect
+import hashlib
+
+# Points par nœud sur l'anneau: répartition homogène à quelques % près
+VIRTUAL_NODES = 160
+
+
+def hash_tag(key: Any) -> bytes:
+    """Partie de la clé qui détermine son nœud (contenu du premier {...} non vide)"""
+    if isinstance(key, str):
+        key = key.encode()
+    start = key.find(b"{")
+    if start != -1:
+        end = key.find(b"}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def _point(data: bytes) -> int:
+    # Pas de hash() Python: il change d'un processus à l'autre
+    return int.from_bytes(hashlib.md5(data).digest()[:8], "big")
+
+
+class HashRing:
+    """Anneau de hachage cohérent (nœuds virtuels)"""
+
+    def __init__(self, names: List[str], replicas: int = VIRTUAL_NODES):
+        points = sorted(
+            (_point(f"{name}#{replica}".encode()), index)
+            for index, name in enumerate(names)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._indexes = [index for _, index in points]
+
+    def node_for(self, key: Any) -> int:
+        """Index du nœud de la clé"""
+        position = bisect.bisect(self._points, _point(hash_tag(key))) % len(self._points)
+        return self._indexes[position]
+
+
+class ShardedRedis:
+    """
+    Client Redis réparti: chaque commande est envoyée au nœud de sa clé
+
+    Même interface que le client asyncio pour les commandes utilisées par
+    RedisService. Les clés d'une même commande doivent partager leur hash
+    tag. Le premier nœud porte le pub/sub (invalidations du cache L1).
+    """
+
+    def __init__(self, nodes: List[Any], names: List[str]):
+        self.nodes = nodes
+        self.ring = HashRing(names)
+
+    def node(self, key: Any) -> Any:
+        return self.nodes[self.ring.node_for(key)]
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        # Commandes à clé: la clé est le premier argument
+        def command(key, *args, **kwargs):
+            return getattr(self.node(key), name)(key, *args, **kwargs)
+        return command
+
+    def evalsha(self, sha: str, numkeys: int, *keys_and_args):
+        node = self.node(keys_and_args[0]) if int(numkeys) else self.nodes[0]
+        return node.evalsha(sha, numkeys, *keys_and_args)
+
+    async def script_load(self, script: str):
+        return (await asyncio.gather(*(node.script_load(script) for node in self.nodes)))[0]
+
+    async def ping(self) -> bool:
+        return all(await asyncio.gather(*(node.ping() for node in self.nodes)))
+
+    def publish(self, channel, message):
+        return self.nodes[0].publish(channel, message)
+
+    def pubsub(self):
+        return self.nodes[0].pubsub()
+
+    def pipeline(self, transaction: bool = True) -> "ShardedPipeline":
+        return ShardedPipeline(self, transaction)
+
+    async def aclose(self) -> None:
+        for node in self.nodes:
+            await node.aclose()
+            pool = getattr(node, "connection_pool", None)
+            if pool is not None:
+                await pool.disconnect()
+
+
+class ShardedPipeline:
+    """
+    Pipeline réparti: un pipeline par nœud touché, exécutés en parallèle
+
+    La latence reste celle d'un aller-retour; les résultats sont rendus
+    dans l'ordre des commandes. Une transaction n'est atomique que sur
+    chaque nœud.
+    """
+
+    def __init__(self, client: ShardedRedis, transaction: bool = True):
+        self._client = client
+        self._transaction = transaction
+        self._pipelines: Dict[int, Any] = {}
+        # (nœud, position dans son pipeline) de chaque commande
+        self._order: List[Tuple[int, int]] = []
+        self._sizes: Dict[int, int] = {}
+
+    def _queue(self, index: int, name: str, args: tuple, kwargs: dict) -> "ShardedPipeline":
+        pipe = self._pipelines.get(index)
+        if pipe is None:
+            pipe = self._pipelines[index] = self._client.nodes[index].pipeline(transaction=self._transaction)
+        getattr(pipe, name)(*args, **kwargs)
+        self._order.append((index, self._sizes.get(index, 0)))
+        self._sizes[index] = self._sizes.get(index, 0) + 1
+        return self
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def command(key, *args, **kwargs):
+            return self._queue(self._client.ring.node_for(key), name, (key, *args), kwargs)
+        return command
+
+    def evalsha(self, sha: str, numkeys: int, *keys_and_args) -> "ShardedPipeline":
+        index = self._client.ring.node_for(keys_and_args[0]) if int(numkeys) else 0
+        return self._queue(index, "evalsha", (sha, numkeys, *keys_and_args), {})
+
+    def publish(self, channel, message) -> "ShardedPipeline":
+        return self._queue(0, "publish", (channel, message), {})
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        indexes = list(self._pipelines)
+        results = await asyncio.gather(*(
+            self._pipelines[index].execute(raise_on_error=raise_on_error) for index in indexes
+        ))
+        by_node = dict(zip(indexes, results))
+        return [by_node[index][position] for index, position in self._order]
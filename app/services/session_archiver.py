@@ -0,0 +1,160 @@
+"""
+Archivage des sessions avant leur expiration Redis
+
+Redis ne garde une session que SESSION_TTL secondes après son dernier tour.
+Quand SESSION_ARCHIVE_ENABLED est actif, chaque écriture de session tient à
+jour son échéance dans un index (sorted set); l'archiveur réserve par lots
+les sessions qui expirent dans moins de SESSION_ARCHIVE_LEAD secondes,
+relit leur état et tout leur historique en un aller-retour, puis les écrit:
+- supabase: upsert dans SESSION_ARCHIVE_TABLE (une ligne par session)
+- ndjson: une ligne JSON par session, fichiers gzip par jour dans
+  SESSION_ARCHIVE_DIR
+
+Une session reprise après son archivage est réarchivée à sa nouvelle
+échéance (l'archive la plus récente remplace la précédente). Plusieurs
+workers peuvent tourner: une session réservée n'est reprise par un autre
+worker que si son archivage n'a pas abouti avant la fin du bail.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+
+from app.config import settings
+from app.models.state import ConversationState
+from app.utils.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+
+SESSIONS_ARCHIVED = metrics_registry.counter(
+    "aya_sessions_archived_total",
+    "Sessions traitées par l'archiveur (archived, expired: expirée avant archivage, failed)",
+    ["result"]
+)
+
+
+def archive_row(state: ConversationState) -> Dict[str, Any]:
+    """Ligne d'archive d'une session: colonnes de recherche + état et transcript complets"""
+    data = state.to_redis_dict()
+    messages = data.pop("message_history")
+    completed = state.current_step == "completed" or state.payment_status == "valide"
+    return {
+        "session_id": state.session_id,
+        "user_phone": state.user_phone,
+        "outcome": "completed" if completed else "idle",
+        "current_step": state.current_step,
+        "product_type": state.product_type,
+        "payment_reference": state.payment_reference,
+        "message_count": state.message_count,
+        "created_at": data["created_at"],
+        "updated_at": data["updated_at"],
+        "archived_at": datetime.utcnow().isoformat(),
+        "state": data,
+        "messages": messages,
+    }
+
+
+class SessionArchiver:
+    """Tâche de fond: archivage par lots des sessions proches de l'expiration"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Démarre l'archiveur (appelé au démarrage de l'application)"""
+        if not settings.SESSION_ARCHIVE_ENABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="session-archiver")
+        logger.info(
+            f"🗄️ Archiveur de sessions démarré ({settings.SESSION_ARCHIVE_SINK}, "
+            f"{settings.SESSION_ARCHIVE_LEAD}s avant expiration)"
+        )
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # Lots successifs tant que l'index en contient d'échus
+                while await self.archive_batch() == settings.SESSION_ARCHIVE_BATCH_SIZE:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur archiveur de sessions: {e}")
+            await asyncio.sleep(settings.SESSION_ARCHIVE_INTERVAL)
+
+    async def archive_batch(self) -> int:
+        """
+        Archive un lot de sessions échues
+
+        Returns:
+            Nombre de sessions réservées (0 si rien à archiver)
+        """
+        from app.services.redis_client import redis_service
+
+        now = int(time.time())
+        # Bail: l'archivage doit aboutir avant que d'autres workers ne reprennent le lot
+        lease_until = now + max(int(settings.SESSION_ARCHIVE_INTERVAL), 1)
+        session_ids = await redis_service.claim_expiring_sessions(
+            now + settings.SESSION_ARCHIVE_LEAD,
+            settings.SESSION_ARCHIVE_BATCH_SIZE,
+            lease_until
+        )
+        if not session_ids:
+            return 0
+
+        snapshots = await redis_service.get_session_snapshots(session_ids)
+        rows = [archive_row(state) for state in snapshots.values()]
+        expired = len(session_ids) - len(rows)
+
+        if rows and not await self._write(rows):
+            # Laissées dans l'index: reprises à la fin du bail
+            SESSIONS_ARCHIVED.inc(len(rows), result="failed")
+            return len(session_ids)
+
+        await redis_service.release_archived_sessions(session_ids, lease_until)
+        if rows:
+            SESSIONS_ARCHIVED.inc(len(rows), result="archived")
+        if expired:
+            SESSIONS_ARCHIVED.inc(expired, result="expired")
+        logger.info(f"🗄️ {len(rows)} sessions archivées ({expired} déjà expirées)")
+        return len(session_ids)
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> bool:
+        if settings.SESSION_ARCHIVE_SINK == "ndjson":
+            try:
+                await asyncio.to_thread(self._append_ndjson, rows)
+                return True
+            except Exception as e:
+                logger.error(f"Erreur écriture archive NDJSON: {e}")
+                return False
+
+        from app.services.supabase_client import supabase_service
+        return await supabase_service.archive_sessions(rows)
+
+    @staticmethod
+    def _append_ndjson(rows: List[Dict[str, Any]]) -> None:
+        """Ajoute le lot au fichier du jour (un membre gzip par lot, lisible par zcat)"""
+        os.makedirs(settings.SESSION_ARCHIVE_DIR, exist_ok=True)
+        path = os.path.join(
+            settings.SESSION_ARCHIVE_DIR,
+            f"sessions-{datetime.utcnow():%Y%m%d}-{os.getpid()}.ndjson.gz"
+        )
+        payload = "".join(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows)
+        with gzip.open(path, "ab") as archive:
+            archive.write(payload.encode("utf-8"))
+
+
+# Instance globale
+session_archiver = SessionArchiver()
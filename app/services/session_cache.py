@@ -0,0 +1,197 @@
+"""
+Cache L1 des sessions (par worker)
+
+Garde en mémoire, pour les sessions actives, les valeurs encodées du hash
+et la fenêtre d'historique telles qu'elles sont dans Redis: un tour qui suit
+de près le précédent relit sa session sans aller-retour réseau.
+
+Cohérence entre workers: chaque écriture de session publie l'ID de la
+session sur SESSION_CACHE_CHANNEL; les autres workers l'évincent à
+réception. Le cache n'est servi que lorsque l'abonnement est actif, et
+chaque entrée expire après SESSION_CACHE_TTL (borne de l'obsolescence si
+une invalidation se perd). Une entrée n'est jamais créée par une écriture,
+seulement mise à jour: une invalidation reçue entre la lecture et
+l'écriture d'un tour n'est donc pas écrasée.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import time
+import uuid
+
+from app.config import settings
+from app.utils.instrumentation import record_cache_lookup
+from app.utils.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+
+SESSION_CACHE_INVALIDATIONS = metrics_registry.counter(
+    "aya_session_cache_invalidations_total",
+    "Entrées du cache de sessions évincées (local, remote: autre worker, reset: réabonnement)",
+    ["source"]
+)
+SESSION_CACHE_ENTRY_AGE = metrics_registry.histogram(
+    "aya_session_cache_entry_age_seconds",
+    "Âge des entrées servies par le cache de sessions",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+SESSION_CACHE_INVALIDATION_LAG = metrics_registry.histogram(
+    "aya_session_cache_invalidation_lag_seconds",
+    "Délai entre l'écriture d'une session et la réception de son invalidation",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+
+# Entrée: (champs du hash encodés, fenêtre d'historique encodée, instant de mise en cache)
+Entry = Tuple[Dict[str, bytes], List[bytes], float]
+
+
+class SessionCache:
+    """Cache LRU + TTL des sessions, invalidé par pub/sub Redis"""
+
+    RECONNECT_DELAY = 1.0
+    MAX_RECONNECT_DELAY = 30.0
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries or settings.SESSION_CACHE_SIZE
+        self.ttl = ttl or settings.SESSION_CACHE_TTL
+        # Identifie les messages publiés par ce worker (déjà appliqués localement)
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._listening = False
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def active(self) -> bool:
+        return settings.SESSION_CACHE_ENABLED and self._listening
+
+    def get(self, session_id: str) -> Optional[Entry]:
+        """Entrée de la session si elle est fraîche (None sinon)"""
+        if not self.active:
+            return None
+
+        entry = self._entries.get(session_id)
+        age = time.monotonic() - entry[2] if entry else 0.0
+        if entry and age > self.ttl:
+            del self._entries[session_id]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            record_cache_lookup("session", False)
+            return None
+
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        record_cache_lookup("session", True)
+        SESSION_CACHE_ENTRY_AGE.observe(age)
+        return entry
+
+    def peek(self, session_id: str) -> Optional[Entry]:
+        """Dernière version connue de la session, même non garantie à jour (repli si Redis tombe)"""
+        return self._entries.get(session_id)
+
+    def put(self, session_id: str, fields: Dict[str, bytes], messages: List[bytes]) -> None:
+        """Mémorise la session telle que lue dans Redis"""
+        if not self.active:
+            return
+
+        self._entries[session_id] = (dict(fields), list(messages[-settings.SESSION_HISTORY_WINDOW:]), time.monotonic())
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def update(self, session_id: str, fields: Dict[str, bytes], new_messages: List[bytes]) -> None:
+        """Reporte une écriture de ce worker sur l'entrée existante (sans la créer)"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+
+        messages = (entry[1] + list(new_messages))[-settings.SESSION_HISTORY_WINDOW:]
+        self._entries[session_id] = (dict(fields), messages, time.monotonic())
+        self._entries.move_to_end(session_id)
+
+    def invalidate(self, session_id: str, source: str = "local") -> None:
+        if self._entries.pop(session_id, None) is not None:
+            SESSION_CACHE_INVALIDATIONS.inc(source=source)
+
+    def clear(self, source: str = "reset") -> None:
+        if self._entries:
+            SESSION_CACHE_INVALIDATIONS.inc(len(self._entries), source=source)
+        self._entries.clear()
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    # ------------------------------------------------------------------------
+    # Invalidation entre workers
+    # ------------------------------------------------------------------------
+
+    def invalidation_message(self, session_id: str) -> str:
+        """Message publié après une écriture: worker, instant, session"""
+        return f"{self.worker_id}|{time.time():.6f}|{session_id}"
+
+    def start(self, redis) -> None:
+        """Démarre l'écoute du canal d'invalidation (appelé à la connexion Redis)"""
+        if not settings.SESSION_CACHE_ENABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._listen(redis), name="session-cache-invalidation")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._listening = False
+        self.clear()
+
+    async def _listen(self, redis) -> None:
+        delay = self.RECONNECT_DELAY
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(settings.SESSION_CACHE_CHANNEL)
+                # Des écritures ont pu être manquées pendant la coupure
+                self.clear()
+                self._listening = True
+                delay = self.RECONNECT_DELAY
+                logger.info(f"🗂️ Cache de sessions actif (canal {settings.SESSION_CACHE_CHANNEL})")
+
+                while True:
+                    # Attente bornée: une lecture bloquante dépasserait REDIS_SOCKET_TIMEOUT
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message.get("type") == "message":
+                        self._on_message(message["data"])
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Entrées gardées (non servies) pour le repli de RedisService; vidées au réabonnement
+                self._listening = False
+                logger.warning(f"⚠️ Canal d'invalidation du cache de sessions interrompu: {e} (nouvel essai dans {delay:.0f}s)")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def _on_message(self, data) -> None:
+        if isinstance(data, bytes):
+            data = data.decode()
+        worker_id, published_at, session_id = data.split("|", 2)
+        if worker_id == self.worker_id:
+            return
+
+        SESSION_CACHE_INVALIDATION_LAG.observe(max(0.0, time.time() - float(published_at)))
+        self.invalidate(session_id, source="remote")
+
+
+# Instance globale
+session_cache = SessionCache()
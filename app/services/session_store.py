@@ -0,0 +1,184 @@
+"""
+Stores de sessions de conversation
+
+`SessionStore` est l'interface utilisée par l'orchestrateur et l'API pour lire
+et écrire les ConversationState. Deux implémentations:
+- RedisService (app.services.redis_client): sessions partagées entre workers,
+  avec repli sur le store embarqué si Redis est absent ou en panne
+- MemorySessionStore: sessions en mémoire du processus (TTL + LRU), sans
+  aucun aller-retour réseau; pour un déploiement mono-nœud ou les bancs
+  de mesure (SESSION_STORE=memory)
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+import logging
+import time
+
+from app.config import settings
+from app.models.state import ConversationState
+from app.utils.codec import codec
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Interface d'un store de sessions"""
+
+    async def get_conversation_state(self, session_id: str, touch: bool = False) -> Optional[ConversationState]:
+        raise NotImplementedError
+
+    async def save_conversation_state(
+        self,
+        session_id: str,
+        state: ConversationState,
+        ttl: Optional[int] = None,
+        flight_records: Optional[list] = None
+    ) -> bool:
+        raise NotImplementedError
+
+    async def update_conversation_state(self, session_id: str, updates: dict, ttl: Optional[int] = None) -> bool:
+        raise NotImplementedError
+
+    async def delete_conversation_state(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    async def extend_session_ttl(self, session_id: str, ttl: Optional[int] = None) -> bool:
+        raise NotImplementedError
+
+    async def session_exists(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    async def add_message_to_history(self, session_id: str, role: str, content: str) -> bool:
+        raise NotImplementedError
+
+    async def get_message_history(self, session_id: str, limit: int = 10) -> list:
+        raise NotImplementedError
+
+    async def get_payment_session(self, transaction_reference: str) -> Optional[str]:
+        """Session à l'origine d'un paiement (pour le callback ePay)"""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Store embarqué: sessions en mémoire du processus, avec TTL et LRU
+
+    Les valeurs sont gardées encodées par le codec des sessions, comme dans
+    Redis: chaque lecture retourne un état indépendant. Chaque worker a ses
+    propres sessions; les étapes de l'enregistreur de vol ne sont pas gardées.
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None):
+        self.max_sessions = max_sessions or settings.SESSION_MEMORY_MAX_SESSIONS
+        # session_id -> [champs encodés, messages encodés, expiration (monotonic)]
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+        # référence de paiement -> session
+        self._payment_sessions: "OrderedDict[str, str]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _entry(self, session_id: str) -> Optional[list]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if entry[2] <= time.monotonic():
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def _evict(self) -> None:
+        """Sessions expirées en tête de LRU, puis les moins récentes au-delà de max_sessions"""
+        now = time.monotonic()
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if entry[2] > now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    async def get_conversation_state(self, session_id: str, touch: bool = False) -> Optional[ConversationState]:
+        entry = self._entry(session_id)
+        if entry is None:
+            return None
+        if touch:
+            entry[2] = time.monotonic() + settings.SESSION_TTL
+        return ConversationState.from_redis_hash(entry[0], entry[1][-settings.SESSION_HISTORY_WINDOW:])
+
+    async def save_conversation_state(
+        self,
+        session_id: str,
+        state: ConversationState,
+        ttl: Optional[int] = None,
+        flight_records: Optional[list] = None
+    ) -> bool:
+        fields = state.dirty_fields()
+        messages = [codec.encode(message) for message in state.unsaved_messages()]
+
+        entry = self._entry(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = [{}, [], 0.0]
+        entry[0].update(fields)
+        entry[1].extend(messages)
+        del entry[1][:-settings.SESSION_HISTORY_MAX]
+        entry[2] = time.monotonic() + (ttl or settings.SESSION_TTL)
+        self._evict()
+
+        if state.payment_reference and "payment_reference" in fields:
+            self._payment_sessions[state.payment_reference] = session_id
+            while len(self._payment_sessions) > self.max_sessions:
+                self._payment_sessions.popitem(last=False)
+
+        state.mark_saved(fields)
+        return True
+
+    async def update_conversation_state(self, session_id: str, updates: dict, ttl: Optional[int] = None) -> bool:
+        entry = self._entry(session_id)
+        fields = ConversationState.encode_fields(updates)
+        if entry is None or not fields:
+            return False
+
+        entry[0].update(fields)
+        if ttl:
+            entry[2] = time.monotonic() + ttl
+        return True
+
+    async def delete_conversation_state(self, session_id: str) -> bool:
+        self._sessions.pop(session_id, None)
+        return True
+
+    async def extend_session_ttl(self, session_id: str, ttl: Optional[int] = None) -> bool:
+        entry = self._entry(session_id)
+        if entry is None:
+            return False
+        entry[2] = time.monotonic() + (ttl or settings.SESSION_TTL)
+        return True
+
+    async def session_exists(self, session_id: str) -> bool:
+        return self._entry(session_id) is not None
+
+    async def add_message_to_history(self, session_id: str, role: str, content: str) -> bool:
+        entry = self._entry(session_id)
+        if entry is None:
+            return False
+
+        message = {"role": role, "content": content, "timestamp": datetime.utcnow().isoformat()}
+        entry[1].append(codec.encode(message))
+        del entry[1][:-settings.SESSION_HISTORY_MAX]
+        count = codec.decode(entry[0]["message_count"])[0] if "message_count" in entry[0] else 0
+        entry[0].update(ConversationState.encode_fields({"message_count": count + 1, "last_message": content}))
+        return True
+
+    async def get_message_history(self, session_id: str, limit: int = 10) -> list:
+        entry = self._entry(session_id)
+        if entry is None:
+            return []
+        return [codec.decode(message)[0] for message in entry[1][-limit:]]
+
+    async def get_payment_session(self, transaction_reference: str) -> Optional[str]:
+        return self._payment_sessions.get(transaction_reference)
+
+
+# Instance globale (store de SESSION_STORE=memory, et repli de RedisService)
+embedded_store = MemorySessionStore()
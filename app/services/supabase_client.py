@@ -9,8 +9,10 @@ from app.models.schemas import (
     DocumentUpload,
     AutoData, VoyageData, IACData, MRHData
 )
+from app.utils.instrumentation import track_dependency
 from typing import Optional, Dict, Any, List
 from uuid import UUID
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,6 +33,17 @@ class SupabaseService:
         )
         logger.info("Supabase client initialisé")
 
+    async def _execute(self, query):
+        """
+        Exécute une requête PostgREST dans un thread.
+
+        Le client supabase-py est synchrone: l'appeler directement bloquerait
+        la boucle asyncio et sérialiserait les outils lancés en parallèle.
+        """
+        operation = f"{getattr(query, 'http_method', 'QUERY')} {getattr(query, 'path', '')}".strip()
+        with track_dependency("supabase", operation):
+            return await asyncio.to_thread(query.execute)
+
     # ========================================================================
     # CLIENTS
     # ========================================================================
@@ -38,7 +51,9 @@ class SupabaseService:
     async def get_client_by_phone(self, phone: str) -> Optional[ClientInDB]:
         """Récupère un client par numéro WhatsApp"""
         try:
-            response = self.client.table("clients").select("*").eq("whatsappnumber", phone).execute()
+            response = await self._execute(
+                self.client.table("clients").select("*").eq("whatsappnumber", phone)
+            )
             if response.data and len(response.data) > 0:
                 return ClientInDB(**response.data[0])
             return None
@@ -49,7 +64,7 @@ class SupabaseService:
     async def get_client_by_id(self, client_id: UUID) -> Optional[ClientInDB]:
         """Récupère un client par son ID"""
         try:
-            response = self.client.table("clients").select("*").eq("id", str(client_id)).execute()
+            response = await self._execute(self.client.table("clients").select("*").eq("id", str(client_id)))
             if response.data and len(response.data) > 0:
                 return ClientInDB(**response.data[0])
             return None
@@ -61,7 +76,7 @@ class SupabaseService:
         """Crée un nouveau client"""
         try:
             data = client_data.model_dump(exclude_none=True)
-            response = self.client.table("clients").insert(data).execute()
+            response = await self._execute(self.client.table("clients").insert(data))
             if response.data and len(response.data) > 0:
                 logger.info(f"Client créé: {response.data[0]['id']}")
                 return ClientInDB(**response.data[0])
@@ -73,7 +88,7 @@ class SupabaseService:
     async def update_client(self, client_id: UUID, updates: Dict[str, Any]) -> Optional[ClientInDB]:
         """Met à jour un client"""
         try:
-            response = self.client.table("clients").update(updates).eq("id", str(client_id)).execute()
+            response = await self._execute(self.client.table("clients").update(updates).eq("id", str(client_id)))
             if response.data and len(response.data) > 0:
                 return ClientInDB(**response.data[0])
             return None
@@ -91,7 +106,7 @@ class SupabaseService:
             data = souscription_data.model_dump(exclude_none=True)
             data["client_id"] = str(data["client_id"])
 
-            response = self.client.table("souscriptions").insert(data).execute()
+            response = await self._execute(self.client.table("souscriptions").insert(data))
             if response.data and len(response.data) > 0:
                 logger.info(f"Souscription créée: {response.data[0]['id']}")
                 return SouscriptionInDB(**response.data[0])
@@ -103,7 +118,7 @@ class SupabaseService:
     async def update_souscription(self, souscription_id: UUID, updates: Dict[str, Any]) -> Optional[SouscriptionInDB]:
         """Met à jour une souscription"""
         try:
-            response = self.client.table("souscriptions").update(updates).eq("id", str(souscription_id)).execute()
+            response = await self._execute(self.client.table("souscriptions").update(updates).eq("id", str(souscription_id)))
             if response.data and len(response.data) > 0:
                 return SouscriptionInDB(**response.data[0])
             return None
@@ -114,7 +129,7 @@ class SupabaseService:
     async def get_souscription(self, souscription_id: UUID) -> Optional[SouscriptionInDB]:
         """Récupère une souscription"""
         try:
-            response = self.client.table("souscriptions").select("*").eq("id", str(souscription_id)).execute()
+            response = await self._execute(self.client.table("souscriptions").select("*").eq("id", str(souscription_id)))
             if response.data and len(response.data) > 0:
                 return SouscriptionInDB(**response.data[0])
             return None
@@ -122,6 +137,25 @@ class SupabaseService:
             logger.error(f"Erreur récupération souscription: {e}")
             return None
 
+    async def get_open_souscription(self, client_id: UUID) -> Optional[SouscriptionInDB]:
+        """Récupère la dernière souscription non finalisée d'un client (en_cours / en_attente)"""
+        try:
+            query = (
+                self.client.table("souscriptions")
+                .select("*")
+                .eq("client_id", str(client_id))
+                .in_("status", ["en_cours", "en_attente"])
+                .order("created_at", desc=True)
+                .limit(1)
+            )
+            response = await self._execute(query)
+            if response.data and len(response.data) > 0:
+                return SouscriptionInDB(**response.data[0])
+            return None
+        except Exception as e:
+            logger.error(f"Erreur récupération souscription ouverte: {e}")
+            return None
+
     # ========================================================================
     # SOUSCRIPTIONS PRODUITS SPÉCIFIQUES
     # ========================================================================
@@ -133,7 +167,7 @@ class SupabaseService:
             payload["souscription_id"] = str(souscription_id)
             # Note: status est dans la table souscriptions, pas ici
 
-            response = self.client.table("souscription_auto").insert(payload).execute()
+            response = await self._execute(self.client.table("souscription_auto").insert(payload))
             return response.data is not None and len(response.data) > 0
         except Exception as e:
             logger.error(f"Erreur création souscription_auto: {e}")
@@ -146,7 +180,7 @@ class SupabaseService:
             payload["souscription_id"] = str(souscription_id)
             # Note: status est dans la table souscriptions, pas ici
 
-            response = self.client.table("souscription_voyage").insert(payload).execute()
+            response = await self._execute(self.client.table("souscription_voyage").insert(payload))
             return response.data is not None and len(response.data) > 0
         except Exception as e:
             logger.error(f"Erreur création souscription_voyage: {e}")
@@ -159,7 +193,7 @@ class SupabaseService:
             payload["souscription_id"] = str(souscription_id)
             # Note: status est dans la table souscriptions, pas ici
 
-            response = self.client.table("souscription_iac").insert(payload).execute()
+            response = await self._execute(self.client.table("souscription_iac").insert(payload))
             return response.data is not None and len(response.data) > 0
         except Exception as e:
             logger.error(f"Erreur création souscription_iac: {e}")
@@ -172,7 +206,7 @@ class SupabaseService:
             payload["souscription_id"] = str(souscription_id)
             # Note: status est dans la table souscriptions, pas ici
 
-            response = self.client.table("souscription_mrh").insert(payload).execute()
+            response = await self._execute(self.client.table("souscription_mrh").insert(payload))
             return response.data is not None and len(response.data) > 0
         except Exception as e:
             logger.error(f"Erreur création souscription_mrh: {e}")
@@ -195,7 +229,7 @@ class SupabaseService:
                 "type": doc_data.type,
                 "nom": doc_data.nom
             }
-            response = self.client.table("documents").insert(payload).execute()
+            response = await self._execute(self.client.table("documents").insert(payload))
             if response.data and len(response.data) > 0:
                 return response.data[0]
             return None
@@ -206,9 +240,9 @@ class SupabaseService:
     async def update_document_pdf(self, souscription_id: UUID, pdf_url: str) -> bool:
         """Met à jour l'URL du PDF généré"""
         try:
-            response = self.client.table("documents").update({
+            response = await self._execute(self.client.table("documents").update({
                 "pdf_url": pdf_url
-            }).eq("souscription_id", str(souscription_id)).execute()
+            }).eq("souscription_id", str(souscription_id)))
             return response.data is not None
         except Exception as e:
             logger.error(f"Erreur mise à jour document PDF: {e}")
@@ -221,7 +255,7 @@ class SupabaseService:
     async def validate_code_promo(self, code: str) -> Optional[Dict[str, Any]]:
         """Valide un code promo"""
         try:
-            response = self.client.table("code_promo").select("*").eq("code", code).execute()
+            response = await self._execute(self.client.table("code_promo").select("*").eq("code", code))
             if response.data and len(response.data) > 0:
                 promo = response.data[0]
                 # Vérifier expiration si nécessaire
@@ -260,7 +294,7 @@ class SupabaseService:
                 "payment_method": payment_method,
                 "status": status
             }
-            response = self.client.table("transactions").insert(payload).execute()
+            response = await self._execute(self.client.table("transactions").insert(payload))
             if response.data and len(response.data) > 0:
                 return response.data[0]
             return None
@@ -271,9 +305,9 @@ class SupabaseService:
     async def update_transaction_status(self, reference: str, status: str) -> bool:
         """Met à jour le statut d'une transaction"""
         try:
-            response = self.client.table("transactions").update({
+            response = await self._execute(self.client.table("transactions").update({
                 "status": status
-            }).eq("reference", reference).execute()
+            }).eq("reference", reference))
             return response.data is not None
         except Exception as e:
             logger.error(f"Erreur mise à jour transaction: {e}")
@@ -282,7 +316,7 @@ class SupabaseService:
     async def get_transaction_by_reference(self, reference: str) -> Optional[Dict[str, Any]]:
         """Récupère une transaction par sa référence"""
         try:
-            response = self.client.table("transactions").select("*").eq("reference", reference).execute()
+            response = await self._execute(self.client.table("transactions").select("*").eq("reference", reference))
             if response.data and len(response.data) > 0:
                 return response.data[0]
             return None
@@ -293,15 +327,30 @@ class SupabaseService:
     async def update_souscription_status(self, souscription_id: str, status: str) -> bool:
         """Met à jour le statut d'une souscription"""
         try:
-            response = self.client.table("souscriptions").update({
+            response = await self._execute(self.client.table("souscriptions").update({
                 "status": status
-            }).eq("id", souscription_id).execute()
+            }).eq("id", souscription_id))
             logger.info(f"Souscription {souscription_id} mise à jour: status={status}")
             return response.data is not None
         except Exception as e:
             logger.error(f"Erreur mise à jour souscription: {e}")
             return False
 
+    # ========================================================================
+    # ARCHIVES DE SESSIONS
+    # ========================================================================
+
+    async def archive_sessions(self, rows: List[Dict[str, Any]]) -> bool:
+        """Écrit un lot d'archives de sessions (remplace l'archive précédente d'une même session)"""
+        try:
+            await self._execute(
+                self.client.table(settings.SESSION_ARCHIVE_TABLE).upsert(rows, on_conflict="session_id")
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Erreur archivage de {len(rows)} sessions: {e}")
+            return False
+
     # ========================================================================
     # STORAGE (pour upload fichiers)
     # ========================================================================
@@ -309,10 +358,12 @@ class SupabaseService:
     async def upload_file(self, bucket: str, file_path: str, file_data: bytes) -> Optional[str]:
         """Upload un fichier vers Supabase Storage"""
         try:
-            response = self.client.storage.from_(bucket).upload(file_path, file_data)
+            storage = self.client.storage.from_(bucket)
+            with track_dependency("supabase", f"storage_upload {bucket}"):
+                response = await asyncio.to_thread(storage.upload, file_path, file_data)
             if response:
                 # Générer l'URL publique
-                public_url = self.client.storage.from_(bucket).get_public_url(file_path)
+                public_url = storage.get_public_url(file_path)
                 return public_url
             return None
         except Exception as e:
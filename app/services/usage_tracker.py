@@ -0,0 +1,89 @@
+"""
+Suivi de la consommation de tokens et du prompt caching
+
+Agrège, pour chaque réponse du LLM, les tokens d'entrée, les tokens d'entrée
+servis depuis le cache du provider et les tokens de sortie. Les agrégats par
+modèle sont tenus en mémoire (par worker); les totaux par session sont stockés
+dans ConversationState.token_usage.
+"""
+from collections import defaultdict
+from typing import Any, Dict, Iterable
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def cache_hit_ratio(cached_tokens: int, input_tokens: int) -> float:
+    """Part des tokens d'entrée servis depuis le cache (0 si aucun token)"""
+    if not input_tokens:
+        return 0.0
+    return round(cached_tokens / input_tokens, 4)
+
+
+def extract_usage(raw_responses: Iterable[Any]) -> Dict[str, int]:
+    """
+    Somme l'usage des réponses brutes d'un run (RunResult.raw_responses).
+
+    Args:
+        raw_responses: Réponses du modèle
+
+    Returns:
+        Dict avec llm_calls, input_tokens, cached_input_tokens, output_tokens
+    """
+    totals = {"llm_calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0}
+
+    for response in raw_responses or []:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            continue
+
+        details = getattr(usage, "input_tokens_details", None)
+        totals["llm_calls"] += 1
+        totals["input_tokens"] += usage.input_tokens or 0
+        totals["cached_input_tokens"] += (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        totals["output_tokens"] += usage.output_tokens or 0
+
+    return totals
+
+
+class PromptCacheStats:
+    """Agrégats de tokens et de cache par modèle"""
+
+    def __init__(self):
+        self._models: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"llm_calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0}
+        )
+
+    def record(self, model: str, usage: Dict[str, int]) -> None:
+        """
+        Ajoute l'usage d'un run aux agrégats du modèle
+
+        Args:
+            model: Nom du modèle
+            usage: Usage retourné par extract_usage
+        """
+        totals = self._models[model]
+        for key in totals:
+            totals[key] += usage.get(key, 0)
+
+        logger.info(
+            f"🧮 Tokens {model}: input {usage.get('input_tokens', 0)} "
+            f"(cache {usage.get('cached_input_tokens', 0)}, "
+            f"{cache_hit_ratio(usage.get('cached_input_tokens', 0), usage.get('input_tokens', 0)):.0%}), "
+            f"output {usage.get('output_tokens', 0)}"
+        )
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Agrégats par modèle avec le taux de cache"""
+        return {
+            model: {
+                **totals,
+                "uncached_input_tokens": totals["input_tokens"] - totals["cached_input_tokens"],
+                "cache_hit_ratio": cache_hit_ratio(totals["cached_input_tokens"], totals["input_tokens"]),
+            }
+            for model, totals in self._models.items()
+        }
+
+
+# Instance globale
+prompt_cache_stats = PromptCacheStats()
@@ -2,19 +2,21 @@
 Outils pour le système agentique AYA basé sur OpenAI Agent SDK
 Transforme les fonctionnalités existantes en function_tools
 """
+import asyncio
 import logging
-from typing import Dict, Any, Optional, Literal
-from agents import function_tool
+from typing import Dict, Any, Optional, Literal, List, Iterable
+from agents import function_tool, RunContextWrapper
 from app.tools.quotation import (
     image_processor,
     Grey_card, PassportInfo, CNIInfo, NIUInfo,
-    VISION_INSTRUCTION,
-    ttcAuto_all, ttc_auto_cat4, voyage_api
+    VISION_INSTRUCTION
 )
+from app.tools.speculation import quote_speculator
 from app.services.supabase_client import supabase_service
 from app.services.mobile_money import mobile_money_service
 from app.models.schemas import ClientCreate, SouscriptionCreate, PaymentRequest
 from app.config import settings
+from app.utils.concurrency import tool_concurrency
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +26,7 @@ logger = logging.getLogger(__name__)
 # ============================================================================
 
 @function_tool
+@tool_concurrency.limit("vision")
 async def analyze_carte_grise(image_url: str) -> Dict[str, Any]:
     """
     Analyse une carte grise et extrait toutes les informations nécessaires.
@@ -39,7 +42,8 @@ async def analyze_carte_grise(image_url: str) -> Dict[str, Any]:
         logger.info(f"🔧 [OUTIL APPELÉ] analyze_carte_grise")
         logger.info(f"🔍 Analyse carte grise: {image_url}")
 
-        result = image_processor(
+        result = await asyncio.to_thread(
+            image_processor,
             image_path=image_url,
             vision_model=settings.VISION_MODEL,
             vision_instruction=VISION_INSTRUCTION,
@@ -58,6 +62,7 @@ async def analyze_carte_grise(image_url: str) -> Dict[str, Any]:
 
 
 @function_tool
+@tool_concurrency.limit("vision")
 async def analyze_passport(image_url: str) -> Dict[str, Any]:
     """
     Analyse un passeport et extrait les informations d'identité.
@@ -72,7 +77,8 @@ async def analyze_passport(image_url: str) -> Dict[str, Any]:
         logger.info(f"🔧 [OUTIL APPELÉ] analyze_passport")
         logger.info(f"🔍 Analyse passeport: {image_url}")
 
-        result = image_processor(
+        result = await asyncio.to_thread(
+            image_processor,
             image_path=image_url,
             vision_model=settings.VISION_MODEL,
             vision_instruction="Extrait les informations du passeport",
@@ -91,6 +97,7 @@ async def analyze_passport(image_url: str) -> Dict[str, Any]:
 
 
 @function_tool
+@tool_concurrency.limit("vision")
 async def analyze_cni(image_url: str) -> Dict[str, Any]:
     """
     Analyse une Carte Nationale d'Identité (CNI).
@@ -104,7 +111,8 @@ async def analyze_cni(image_url: str) -> Dict[str, Any]:
     try:
         logger.info(f"🔍 Analyse CNI: {image_url}")
 
-        result = image_processor(
+        result = await asyncio.to_thread(
+            image_processor,
             image_path=image_url,
             vision_model=settings.VISION_MODEL,
             vision_instruction="Extrait les informations de la CNI",
@@ -123,6 +131,7 @@ async def analyze_cni(image_url: str) -> Dict[str, Any]:
 
 
 @function_tool
+@tool_concurrency.limit("vision")
 async def analyze_niu(image_url: str) -> Dict[str, Any]:
     """
     Analyse un Numéro d'Identification Unique (NIU).
@@ -136,7 +145,8 @@ async def analyze_niu(image_url: str) -> Dict[str, Any]:
     try:
         logger.info(f"🔍 Analyse NIU: {image_url}")
 
-        result = image_processor(
+        result = await asyncio.to_thread(
+            image_processor,
             image_path=image_url,
             vision_model=settings.VISION_MODEL,
             vision_instruction="Extrait les informations du NIU",
@@ -159,6 +169,7 @@ async def analyze_niu(image_url: str) -> Dict[str, Any]:
 # ============================================================================
 
 @function_tool
+@tool_concurrency.limit("quotation")
 async def calculate_auto_quotation(
     power: int,
     seat_number: int,
@@ -183,24 +194,14 @@ async def calculate_auto_quotation(
         logger.info(f"🔧 [OUTIL APPELÉ] calculate_auto_quotation")
         logger.info(f"💰 Calcul quotation AUTO: {power}CV, {seat_number} places, {fuel_type}")
 
-        # Déterminer la catégorie
-        if modele in ["TAXI", "PICNIC", "MINI-BUS", "COASTER"]:
-            # CAT 4 - Transport public
-            pricing = ttc_auto_cat4(
-                power=power,
-                energy=fuel_type.upper(),
-                modele=modele,
-                place=seat_number
-            )
-        else:
-            # CAT 1-3 - Véhicules particuliers
-            pricing = ttcAuto_all(
-                power=power,
-                energy=fuel_type.upper(),
-                place=seat_number,
-                modele=modele,
-                usage=usage
-            )
+        # Résultat déjà calculé si la carte grise a déclenché un devis spéculatif
+        pricing = await quote_speculator.auto_quotation(
+            power=power,
+            seat_number=seat_number,
+            fuel_type=fuel_type,
+            modele=modele,
+            usage=usage
+        )
 
         logger.info(f"✅ Quotation AUTO calculée: {pricing.get('OFFRE_12_MOIS', {}).get('PRIME_TOTALE', 0)} FCFA (12M)")
         return pricing
@@ -214,6 +215,7 @@ async def calculate_auto_quotation(
 
 
 @function_tool
+@tool_concurrency.limit("quotation")
 async def calculate_voyage_quotation(
     client_type: str,
     zone: str,
@@ -236,11 +238,11 @@ async def calculate_voyage_quotation(
         logger.info(f"🔧 [OUTIL APPELÉ] calculate_voyage_quotation")
         logger.info(f"💰 Calcul quotation VOYAGE: {zone}, {duration_days} jours")
 
-        tarif_ttc = voyage_api(
-            client=client_type,
+        tarif_ttc = await quote_speculator.voyage_quotation(
+            client_type=client_type,
             zone=zone,
             product=product,
-            duration=duration_days
+            duration_days=duration_days
         )
 
         if tarif_ttc == 0:
@@ -266,6 +268,7 @@ async def calculate_voyage_quotation(
 
 
 @function_tool
+@tool_concurrency.limit("quotation")
 async def calculate_iac_quotation(statut: Optional[str] = None) -> Dict[str, Any]:
     """
     Calcule le tarif d'assurance Individuelle Accident (IAC).
@@ -296,6 +299,7 @@ async def calculate_iac_quotation(statut: Optional[str] = None) -> Dict[str, Any
 
 
 @function_tool
+@tool_concurrency.limit("quotation")
 async def calculate_mrh_quotation(forfait: Optional[str] = None) -> Dict[str, Any]:
     """
     Calcule le tarif d'assurance Multirisque Habitation (MRH).
@@ -330,7 +334,12 @@ async def calculate_mrh_quotation(forfait: Optional[str] = None) -> Dict[str, An
 # ============================================================================
 
 @function_tool
-async def get_or_create_client(phone_number: str, fullname: Optional[str] = None) -> Dict[str, Any]:
+@tool_concurrency.limit("database")
+async def get_or_create_client(
+    ctx: RunContextWrapper[Any],
+    phone_number: str,
+    fullname: Optional[str] = None
+) -> Dict[str, Any]:
     """
     Récupère un client existant ou en crée un nouveau dans la base de données.
 
@@ -344,17 +353,33 @@ async def get_or_create_client(phone_number: str, fullname: Optional[str] = None
     try:
         logger.info(f"👤 Recherche/création client: {phone_number}")
 
-        # Chercher client existant
-        client = await supabase_service.get_client_by_phone(phone_number)
+        # Client préchargé en début de tour (même numéro), sinon recherche en base.
+        # Un préchargement sans client vaut réponse "inconnu en base".
+        prefetched = None
+        turn = getattr(ctx, "context", None)
+        if hasattr(turn, "prefetched_client"):
+            prefetched = await turn.prefetched_client(phone_number)
+        if prefetched is not None:
+            client, open_souscription = prefetched
+        else:
+            client, open_souscription = await supabase_service.get_client_by_phone(phone_number), None
 
         if client:
             logger.info(f"✅ Client existant trouvé: {client.id}")
-            return {
+            result = {
                 "client_id": str(client.id),
                 "fullname": client.fullname,
                 "existing": True,
                 "message": f"Bienvenue {client.fullname or 'cher client'}!"
             }
+            if open_souscription:
+                result["open_souscription"] = {
+                    "souscription_id": str(open_souscription.id),
+                    "product_type": open_souscription.producttype,
+                    "prime_ttc": open_souscription.prime_ttc,
+                    "status": open_souscription.status
+                }
+            return result
 
         # Créer nouveau client
         client_data = ClientCreate(
@@ -388,6 +413,7 @@ async def get_or_create_client(phone_number: str, fullname: Optional[str] = None
 
 
 @function_tool
+@tool_concurrency.limit("database")
 async def create_souscription(
     client_id: str,
     product_type: Literal["NSIA AUTO", "NSIA VOYAGE", "NSIA INDIVIDUEL ACCIDENTS", "NSIA MULTIRISQUE HABITATION"],
@@ -471,6 +497,7 @@ async def create_souscription(
 # ============================================================================
 
 @function_tool
+@tool_concurrency.limit("database")
 async def save_auto_details(
     souscription_id: str,
     fullname: str,
@@ -569,6 +596,7 @@ async def save_auto_details(
 
 
 @function_tool
+@tool_concurrency.limit("database")
 async def save_voyage_details(
     souscription_id: str,
     full_name: str,
@@ -651,6 +679,7 @@ async def save_voyage_details(
 
 
 @function_tool
+@tool_concurrency.limit("database")
 async def save_iac_details(
     souscription_id: str,
     fullname: str,
@@ -731,6 +760,7 @@ async def save_iac_details(
 
 
 @function_tool
+@tool_concurrency.limit("database")
 async def save_mrh_details(
     souscription_id: str,
     fullname: str,
@@ -805,6 +835,7 @@ async def save_mrh_details(
 
 
 @function_tool
+@tool_concurrency.limit("payment")
 async def initiate_momo_payment(
     amount: float,
     phone_number: str,
@@ -883,6 +914,7 @@ Composez votre code PIN pour valider le paiement."""
 
 
 @function_tool
+@tool_concurrency.limit("payment")
 async def initiate_airtel_payment(
     amount: float,
     phone_number: str,
@@ -987,7 +1019,8 @@ async def _generate_proposal_internal(
         filename = f"/tmp/proposition_{souscription_id}.pdf"
 
         # Générer la proposition
-        success = generate_product_receipt_pdf(
+        success = await asyncio.to_thread(
+            generate_product_receipt_pdf,
             output_filename=filename,
             nom_complet=client_name,
             telephone=phone,
@@ -1045,6 +1078,7 @@ async def _generate_proposal_internal(
 
 
 @function_tool
+@tool_concurrency.limit("pdf")
 async def generate_insurance_proposal(
     souscription_id: str,
     client_name: str,
@@ -1081,6 +1115,7 @@ async def generate_insurance_proposal(
 
 
 @function_tool
+@tool_concurrency.limit("pdf")
 async def initiate_pay_on_delivery(
     amount: float,
     souscription_id: str,
@@ -1133,6 +1168,7 @@ async def initiate_pay_on_delivery(
 
 
 @function_tool
+@tool_concurrency.limit("pdf")
 async def initiate_pay_on_agency(
     amount: float,
     souscription_id: str,
@@ -1217,3 +1253,73 @@ ALL_AGENT_TOOLS = [
     initiate_pay_on_delivery,
     initiate_pay_on_agency,
 ]
+
+
+# ============================================================================
+# Groupes d'outils par section du workflow (cf. app/agents/prompts.py)
+# ============================================================================
+
+VISION_TOOLS = [
+    analyze_carte_grise,
+    analyze_passport,
+    analyze_cni,
+    analyze_niu,
+]
+
+QUOTATION_TOOLS = {
+    "auto": calculate_auto_quotation,
+    "voyage": calculate_voyage_quotation,
+    "iac": calculate_iac_quotation,
+    "mrh": calculate_mrh_quotation,
+}
+
+DATABASE_TOOLS = [
+    get_or_create_client,
+    create_souscription,
+]
+
+DETAILS_TOOLS = {
+    "auto": save_auto_details,
+    "voyage": save_voyage_details,
+    "iac": save_iac_details,
+    "mrh": save_mrh_details,
+}
+
+PAYMENT_TOOLS = [
+    initiate_momo_payment,
+    initiate_airtel_payment,
+    initiate_pay_on_delivery,
+    initiate_pay_on_agency,
+]
+
+
+def select_tools(sections: Iterable[str], products: Iterable[str]) -> List:
+    """
+    Sélectionne les outils utiles pour les sections et produits donnés.
+
+    Args:
+        sections: Sections du workflow (discovery, collection, quotation, subscription, payment)
+        products: Produits concernés; vide = tous les produits
+
+    Returns:
+        Liste d'outils, toujours dans l'ordre de ALL_AGENT_TOOLS
+    """
+    sections = set(sections)
+    products = set(products) or set(QUOTATION_TOOLS)
+    selected = []
+
+    if "collection" in sections:
+        selected.extend(VISION_TOOLS)
+
+    if "quotation" in sections:
+        selected.extend(QUOTATION_TOOLS[p] for p in products)
+
+    if "subscription" in sections:
+        selected.extend(DATABASE_TOOLS)
+        selected.extend(DETAILS_TOOLS[p] for p in products)
+
+    if "payment" in sections:
+        selected.extend(PAYMENT_TOOLS)
+
+    names = {tool.name for tool in selected}
+    return [tool for tool in ALL_AGENT_TOOLS if tool.name in names]
@@ -9,6 +9,9 @@ import google.generativeai as genai
 from google.generativeai import types
 import requests
 import json 
+import hashlib
+from app.utils.instrumentation import track_dependency
+from app.utils.tracing import span
 
 
 load_dotenv()
@@ -30,6 +33,20 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 
 db = pd.read_excel(os.path.join(DATA_DIR, "tarification_nsia_auto.xlsx"), sheet_name=None)
 
+
+def _tariff_version() -> str:
+    """Empreinte des grilles tarifaires de data/ (change à chaque mise à jour des fichiers)"""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(DATA_DIR)):
+        digest.update(name.encode())
+        with open(os.path.join(DATA_DIR, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+# Version des tarifs (attribut des traces), surchargeable par la variable TARIFF_VERSION
+TARIFF_VERSION = os.getenv("TARIFF_VERSION") or _tariff_version()
+
 # ============================================================================
 # Modèles VISON
 # ============================================================================
@@ -117,46 +134,50 @@ def image_processor(image_path: str,
     Analyse une image pour extraire les informations de la carte grise.
     """
     
-    try:
-
-        if vision_model.startswith("gpt") :
-
-        # --- Traitement avec OpenAI (gpt-4o ou gpt-4o-mini) --- 
-            client = OpenAI()
-            response = client.beta.chat.completions.parse(
-                model="gpt-4o",
-                messages=[
-                    {"role": "developer", "content": vision_instruction},
-                    {"role": "user", "content": [{"type": "image_url", "image_url": {"url": image_path}}]}
-                    ],
-                    response_format=response_schema
-                    )
-            return json.loads(response.choices[0].message.content)
+    with span("image_processor", **{"vision.model": vision_model, "vision.schema": getattr(response_schema, "__name__", None)}):
+        try:
+
+            if vision_model.startswith("gpt") :
+
+            # --- Traitement avec OpenAI (gpt-4o ou gpt-4o-mini) --- 
+                client = OpenAI()
+                with track_dependency("openai", "vision"):
+                    response = client.beta.chat.completions.parse(
+                        model="gpt-4o",
+                        messages=[
+                            {"role": "developer", "content": vision_instruction},
+                            {"role": "user", "content": [{"type": "image_url", "image_url": {"url": image_path}}]}
+                            ],
+                            response_format=response_schema
+                            )
+                return json.loads(response.choices[0].message.content)
             
-        elif vision_model.startswith("gem"):
-
-            # --- Traitement avec Gemini ---
-
-            client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-            image_bytes = requests.get(image_path).content
-            image = types.Part.from_bytes(
-                data=image_bytes, mime_type="image/jpeg"
-                )                
-            response = client.models.generate_content(
-                model=vision_model,
-                contents=[vision_instruction, image],
-                config={
-                    'response_mime_type': 'application/json',
-                    'response_schema': response_schema
-                    }
-                    )
-            return json.loads(response.text)
+            elif vision_model.startswith("gem"):
+
+                # --- Traitement avec Gemini ---
+
+                client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+                with track_dependency("media", "download"):
+                    image_bytes = requests.get(image_path).content
+                image = types.Part.from_bytes(
+                    data=image_bytes, mime_type="image/jpeg"
+                    )                
+                with track_dependency("gemini", "vision"):
+                    response = client.models.generate_content(
+                        model=vision_model,
+                        contents=[vision_instruction, image],
+                        config={
+                            'response_mime_type': 'application/json',
+                            'response_schema': response_schema
+                            }
+                            )
+                return json.loads(response.text)
             
-        else : 
-            raise ValueError(f"Modèle non reconnu pour l'analyse d'image : {vision_model}")
+            else : 
+                raise ValueError(f"Modèle non reconnu pour l'analyse d'image : {vision_model}")
                        
-    except Exception as e:
-        raise RuntimeError(f"Erreur lors de l'analyse de l'image : {str(e)}")
+        except Exception as e:
+            raise RuntimeError(f"Erreur lors de l'analyse de l'image : {str(e)}")
 
 
 # ============================================================================
@@ -224,6 +245,30 @@ def voyage_api(client: str, zone : str, product: str, duration : int) -> int:
     except Exception as e:
         return 0
 
+def voyage_grid(client: str, duration: int) -> dict:
+    """
+    Returns every VOYAGE tariff for a client type and a trip duration.
+
+    Args:
+        client (str): Client type (PARTICULIER, ETUDIANT, PELERIN).
+        duration (int): Trip duration in days.
+
+    Returns:
+        dict: {zone: {product: tarif_ttc}} for all matching rows.
+    """
+    df = pd.read_csv(os.path.join(DATA_DIR, "voyage.csv"))
+    t_df = transform_2(df)
+
+    condition = (
+        (t_df["Client"] == client) &
+        (t_df["Duree"].apply(lambda x: duration in x))
+    )
+
+    grid = {}
+    for _, row in t_df.loc[condition].iterrows():
+        grid.setdefault(row["Zone"], {})[row["Product"]] = int(row["Tarif_TTC"])
+    return grid
+
 def ttcAuto_all(power: int, 
              energy: str,
              place: int,
@@ -7,6 +7,8 @@ import io
 import base64
 import uuid
 
+from app.utils.tracing import span
+
 
 # Configuration du logger
 logging.basicConfig(
@@ -250,7 +252,8 @@ def generate_auto_receipt_pdf(
         )
         
         # Génération du PDF
-        HTML(string=html_content).write_pdf(target=output_filename)
+        with span("pdf.render", **{"aya.product_type": "auto"}):
+            HTML(string=html_content).write_pdf(target=output_filename)
         logging.info(f"Reçu NSIA AUTO généré avec succès: {output_filename}")
         return True
         
@@ -474,7 +477,8 @@ def generate_product_receipt_pdf(
         )
 
         # Génération du PDF
-        HTML(string=html_content).write_pdf(target=output_filename)
+        with span("pdf.render", **{"aya.product_type": product_type}):
+            HTML(string=html_content).write_pdf(target=output_filename)
         logging.info(f"Reçu {product_name} généré avec succès: {output_filename}")
         return True
 
@@ -0,0 +1,367 @@
+"""
+Devis spéculatifs
+
+Dès que la vision a extrait la puissance, le nombre de places et le carburant
+d'une carte grise (ou dès qu'on connaît le passeport et la durée du voyage),
+le devis est lancé en arrière-plan pendant que le LLM poursuit le dialogue.
+L'appel `calculate_*_quotation` qui suit récupère le résultat déjà calculé, et
+le devis est reporté dans l'état de session pour être injecté au tour suivant.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+
+from app.config import settings
+from app.models.state import ConversationState
+from app.tools.quotation import ttcAuto_all, ttc_auto_cat4, voyage_api, voyage_grid
+from app.utils.instrumentation import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+
+AUTO_DEFAULT_MODELE = "VOITURE"
+AUTO_DEFAULT_USAGE = "PROMENADE/AFFAIRES"
+AUTO_CAT4_MODELES = ["TAXI", "PICNIC", "MINI-BUS", "COASTER"]
+
+DURATION_PATTERN = re.compile(r"(\d+)\s*(jours?|j\b|semaines?|sem\b|mois)")
+
+
+# ============================================================================
+# EXTRACTION DES PARAMÈTRES
+# ============================================================================
+
+def _normalize(value: Any) -> str:
+    """Minuscules sans accents"""
+    text = unicodedata.normalize("NFKD", str(value or "").lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def parse_int(value: Any) -> Optional[int]:
+    """Premier entier d'une valeur extraite par la vision ("7 CV" → 7, "N/A" → None)"""
+    if isinstance(value, int):
+        return value
+    match = re.search(r"\d+", str(value or ""))
+    return int(match.group()) if match else None
+
+
+def normalize_fuel(value: Any) -> Optional[str]:
+    """Carburant de la carte grise au format des grilles (ESSENCE / DIESEL)"""
+    text = _normalize(value)
+    words = set(re.findall(r"[a-z]+", text))
+    if any(word in text for word in ("diesel", "gasoil", "gazole")) or "go" in words:
+        return "DIESEL"
+    if any(word in text for word in ("essence", "super")) or "es" in words:
+        return "ESSENCE"
+    return None
+
+
+def auto_quote_params(carte_grise: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Paramètres de calculate_auto_quotation déductibles d'une carte grise
+
+    Args:
+        carte_grise: Sortie de analyze_carte_grise
+
+    Returns:
+        Paramètres (usage par défaut: PROMENADE/AFFAIRES) ou None si incomplets
+    """
+    power = parse_int(carte_grise.get("power"))
+    seat_number = parse_int(carte_grise.get("seat_number"))
+    fuel_type = normalize_fuel(carte_grise.get("fuel_type"))
+
+    if not power or not seat_number or not fuel_type:
+        return None
+
+    return {
+        "power": power,
+        "seat_number": seat_number,
+        "fuel_type": fuel_type,
+        "modele": AUTO_DEFAULT_MODELE,
+        "usage": AUTO_DEFAULT_USAGE,
+    }
+
+
+def parse_trip_duration(message: str) -> Optional[int]:
+    """Durée de voyage en jours mentionnée dans un message ("15 jours", "2 semaines", "1 mois")"""
+    match = DURATION_PATTERN.search(_normalize(message))
+    if not match:
+        return None
+
+    value, unit = int(match.group(1)), match.group(2)
+    if unit.startswith("sem"):
+        return value * 7
+    if unit == "mois":
+        return value * 30
+    return value
+
+
+def parse_voyage_client_type(message: str) -> Optional[str]:
+    """Type de client voyage mentionné dans un message"""
+    text = _normalize(message)
+    if "etudiant" in text:
+        return "ETUDIANT"
+    if "pelerin" in text or "lieux saints" in text:
+        return "PELERIN"
+    return None
+
+
+# ============================================================================
+# CALCULS
+# ============================================================================
+
+def compute_auto_quotation(
+    power: int,
+    seat_number: int,
+    fuel_type: str = "ESSENCE",
+    modele: str = AUTO_DEFAULT_MODELE,
+    usage: str = AUTO_DEFAULT_USAGE
+) -> Dict[str, Any]:
+    """Tarifs AUTO 3/6/12 mois selon la catégorie du véhicule"""
+    if modele in AUTO_CAT4_MODELES:
+        # CAT 4 - Transport public
+        return ttc_auto_cat4(
+            power=power,
+            energy=fuel_type.upper(),
+            modele=modele,
+            place=seat_number
+        )
+
+    # CAT 1-3 - Véhicules particuliers
+    return ttcAuto_all(
+        power=power,
+        energy=fuel_type.upper(),
+        place=seat_number,
+        modele=modele,
+        usage=usage
+    )
+
+
+class QuoteSpeculator:
+    """
+    Devis calculés en arrière-plan, partagés avec les outils de quotation.
+
+    Chaque devis est une tâche asyncio (calcul pandas dans un thread) indexée
+    par ses paramètres; un outil appelé avec les mêmes paramètres attend la
+    tâche existante au lieu de recalculer.
+    """
+
+    MAX_ENTRIES = 256
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = ttl or settings.SPECULATIVE_QUOTE_TTL
+        self._tasks: "OrderedDict[Tuple, Tuple[float, asyncio.Task]]" = OrderedDict()
+
+    # ------------------------------------------------------------------------
+    # Cache des tâches
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def auto_key(power: int, seat_number: int, fuel_type: str, modele: str, usage: str) -> Tuple:
+        return ("auto", int(power), int(seat_number), fuel_type.upper(), modele.upper(), usage.upper())
+
+    @staticmethod
+    def voyage_key(client_type: str, duration: int) -> Tuple:
+        return ("voyage", client_type.upper(), int(duration))
+
+    def _get(self, key: Tuple) -> Optional[asyncio.Task]:
+        entry = self._tasks.get(key)
+        if entry is None:
+            return None
+
+        expires_at, task = entry
+        failed = task.done() and (task.cancelled() or task.exception() is not None)
+        if expires_at < time.monotonic() or failed:
+            self._tasks.pop(key, None)
+            return None
+        return task
+
+    def _start(self, key: Tuple, func, *args) -> asyncio.Task:
+        task = self._get(key)
+        if task is not None:
+            return task
+
+        task = asyncio.create_task(asyncio.to_thread(func, *args))
+        # Une spéculation en échec ne doit pas polluer les logs asyncio
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        self._tasks[key] = (time.monotonic() + self.ttl, task)
+        while len(self._tasks) > self.MAX_ENTRIES:
+            self._tasks.popitem(last=False)
+        return task
+
+    def peek(self, key: Tuple) -> Optional[Any]:
+        """Résultat d'une tâche terminée avec succès, sinon None"""
+        task = self._get(key)
+        if task is None or not task.done():
+            return None
+        return task.result()
+
+    # ------------------------------------------------------------------------
+    # Utilisé par les outils de quotation
+    # ------------------------------------------------------------------------
+
+    async def auto_quotation(
+        self,
+        power: int,
+        seat_number: int,
+        fuel_type: str = "ESSENCE",
+        modele: str = AUTO_DEFAULT_MODELE,
+        usage: str = AUTO_DEFAULT_USAGE
+    ) -> Dict[str, Any]:
+        """Devis AUTO: résultat spéculatif s'il existe, sinon calcul immédiat"""
+        key = self.auto_key(power, seat_number, fuel_type, modele, usage)
+        cached = self._get(key) is not None
+        record_cache_lookup("speculative_quote", cached)
+        if cached:
+            logger.info(f"⚡ Devis AUTO précalculé utilisé: {power}CV, {seat_number} places, {fuel_type}")
+        task = self._start(key, compute_auto_quotation, power, seat_number, fuel_type, modele, usage)
+        return await asyncio.shield(task)
+
+    async def voyage_quotation(self, client_type: str, zone: str, product: str, duration_days: int) -> int:
+        """Tarif VOYAGE: lu dans la grille spéculative si elle couvre la demande"""
+        task = self._get(self.voyage_key(client_type, duration_days))
+        if task is not None:
+            try:
+                grid = await asyncio.shield(task)
+                tarif = grid.get(zone, {}).get(product)
+                if tarif:
+                    logger.info(f"⚡ Tarif VOYAGE précalculé utilisé: {zone}, {product}, {duration_days} jours")
+                    record_cache_lookup("speculative_quote", True)
+                    return tarif
+            except Exception as e:
+                logger.warning(f"⚠️ Grille VOYAGE spéculative indisponible: {e}")
+
+        record_cache_lookup("speculative_quote", False)
+
+        return await asyncio.to_thread(voyage_api, client_type, zone, product, duration_days)
+
+    # ------------------------------------------------------------------------
+    # Utilisé par l'orchestrateur et les hooks du run
+    # ------------------------------------------------------------------------
+
+    def speculate_for_state(self, state: ConversationState) -> None:
+        """
+        Lance les devis déductibles des données collectées de la session
+
+        Args:
+            state: État de conversation (collected_data)
+        """
+        if not settings.SPECULATIVE_QUOTES_ENABLED:
+            return
+
+        data = state.collected_data
+
+        carte_grise = data.get("carte_grise")
+        if carte_grise and state.product_type in (None, "auto"):
+            params = auto_quote_params(carte_grise)
+            if params:
+                key = self.auto_key(**params)
+                if self._get(key) is None:
+                    logger.info(f"🔮 Devis AUTO spéculatif lancé: {params}")
+                self._start(key, compute_auto_quotation, *params.values())
+
+        if data.get("passport") and data.get("trip_duration") and state.product_type in (None, "voyage"):
+            client_type = data.get("voyage_client_type") or "PARTICULIER"
+            key = self.voyage_key(client_type, data["trip_duration"])
+            if self._get(key) is None:
+                logger.info(f"🔮 Grille VOYAGE spéculative lancée: {client_type}, {data['trip_duration']} jours")
+            self._start(key, voyage_grid, client_type, data["trip_duration"])
+
+    @staticmethod
+    def current_params(state: ConversationState, product: str) -> Optional[Dict[str, Any]]:
+        """Paramètres de devis déduits de l'état courant pour un produit (None s'ils manquent)"""
+        data = state.collected_data
+        if state.product_type not in (None, product):
+            return None
+
+        if product == "auto":
+            return auto_quote_params(data["carte_grise"]) if data.get("carte_grise") else None
+
+        if data.get("passport") and data.get("trip_duration"):
+            return {
+                "client_type": data.get("voyage_client_type") or "PARTICULIER",
+                "duration_days": data["trip_duration"]
+            }
+        return None
+
+    def record(self, state: ConversationState) -> None:
+        """
+        Reporte dans l'état les devis spéculatifs terminés
+
+        Un devis déjà reporté dont les paramètres ne correspondent plus à l'état
+        (nouvelle carte grise, durée de voyage modifiée...) est retiré.
+
+        Args:
+            state: État de conversation (collected_data["devis_precalcule"])
+        """
+        data = state.collected_data
+
+        precomputed = data.get("devis_precalcule")
+        if precomputed and precomputed["params"] != self.current_params(state, precomputed["product"]):
+            logger.info(f"🧹 Devis {precomputed['product'].upper()} précalculé obsolète retiré")
+            data.pop("devis_precalcule")
+
+        params = self.current_params(state, "auto")
+        if params:
+            pricing = self.peek(self.auto_key(**params))
+            if pricing:
+                data["devis_precalcule"] = {"product": "auto", "params": params, "result": pricing}
+
+        params = self.current_params(state, "voyage")
+        if params:
+            grid = self.peek(self.voyage_key(params["client_type"], params["duration_days"]))
+            if grid:
+                data["devis_precalcule"] = {"product": "voyage", "params": params, "result": grid}
+
+    def precomputed_fact(self, state: ConversationState) -> Optional[str]:
+        """
+        Devis précalculé à injecter dans le message du tour
+
+        Args:
+            state: État de conversation
+
+        Returns:
+            Texte du fait à injecter, ou None
+        """
+        precomputed = state.collected_data.get("devis_precalcule")
+        if not precomputed or state.current_step not in ("info_collection", "quotation"):
+            return None
+        if state.product_type and precomputed["product"] != state.product_type:
+            return None
+
+        params, result = precomputed["params"], precomputed["result"]
+
+        # Devis calculé pour d'autres données que celles de l'état
+        if params != self.current_params(state, precomputed["product"]):
+            return None
+
+        if precomputed["product"] == "auto":
+            offers = ", ".join(
+                f"{months} mois: {result[f'OFFRE_{months}_MOIS']['PRIME_TOTALE']:,} FCFA"
+                for months in (3, 6, 12)
+                if f"OFFRE_{months}_MOIS" in result
+            )
+            return (
+                f"[DEVIS AUTO PRÉCALCULÉ par calculate_auto_quotation({params['power']} CV, "
+                f"{params['seat_number']} places, {params['fuel_type']}, modele={params['modele']}, "
+                f"usage={params['usage']}): {offers}. Si le véhicule et l'usage confirmés correspondent, "
+                f"présente ces montants sans rappeler l'outil.]"
+            )
+
+        tarifs = "; ".join(
+            f"{zone} / {product}: {tarif:,} FCFA"
+            for zone, products in result.items()
+            for product, tarif in products.items()
+        )
+        return (
+            f"[TARIFS VOYAGE PRÉCALCULÉS par calculate_voyage_quotation (client {params['client_type']}, "
+            f"{params['duration_days']} jours): {tarifs}. Utilise-les pour la zone et le produit choisis.]"
+        )
+
+
+# Instance globale
+quote_speculator = QuoteSpeculator()
@@ -0,0 +1,96 @@
+"""
+Codec des valeurs de session stockées dans Redis
+
+Chaque valeur est précédée d'un en-tête de 2 octets:
+- octet 0: version du schéma de ConversationState (SCHEMA_VERSION)
+- octet 1: encodage (msgpack ou JSON) + drapeau de compression zlib
+
+Les valeurs au-delà de SESSION_COMPRESS_MIN_BYTES sont compressées.
+Une valeur sans en-tête (JSON texte écrit avant le codec) reste lisible.
+"""
+from typing import Any, Optional, Tuple
+import json
+import logging
+import zlib
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# À incrémenter quand un champ de ConversationState change de nom ou de type:
+# les valeurs d'une version antérieure repassent alors par la validation complète
+SCHEMA_VERSION = 1
+
+ENCODING_JSON = 0x01
+ENCODING_MSGPACK = 0x02
+FLAG_ZLIB = 0x10
+
+# Niveau zlib: compromis CPU / taille adapté à de petites valeurs chaudes
+ZLIB_LEVEL = 3
+
+
+class Codec:
+    """Encodage binaire compact (msgpack, sinon JSON compact)"""
+
+    def __init__(self, name: str = "msgpack", compress_min_bytes: int = 512):
+        self.compress_min_bytes = compress_min_bytes
+        self._msgpack = None
+
+        if name == "msgpack":
+            try:
+                import msgpack
+                self._msgpack = msgpack
+            except ImportError:
+                logger.warning("⚠️ SESSION_CODEC=msgpack mais msgpack non installé: encodage JSON")
+
+        self.encoding = ENCODING_MSGPACK if self._msgpack else ENCODING_JSON
+
+    def encode(self, value: Any) -> bytes:
+        """Valeur -> en-tête + charge utile (compressée au-delà du seuil)"""
+        if self._msgpack:
+            payload = self._msgpack.packb(value, use_bin_type=True)
+        else:
+            payload = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        flags = self.encoding
+        if self.compress_min_bytes and len(payload) >= self.compress_min_bytes:
+            compressed = zlib.compress(payload, ZLIB_LEVEL)
+            if len(compressed) < len(payload):
+                payload, flags = compressed, flags | FLAG_ZLIB
+
+        return bytes((SCHEMA_VERSION, flags)) + payload
+
+    def decode(self, data: Any) -> Tuple[Any, Optional[int]]:
+        """
+        Décode une valeur Redis
+
+        Returns:
+            (valeur, version du schéma) — version None pour une valeur
+            sans en-tête (JSON texte)
+        """
+        if isinstance(data, str):
+            return json.loads(data), None
+
+        # JSON texte: commence par un caractère imprimable ou un blanc
+        if not data or data[0] >= 0x20 or data[0] in (0x09, 0x0A, 0x0D):
+            return json.loads(data), None
+
+        version, flags = data[0], data[1]
+        payload = data[2:]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+
+        encoding = flags & 0x0F
+        if encoding == ENCODING_MSGPACK:
+            if self._msgpack is None:
+                import msgpack
+                self._msgpack = msgpack
+            return self._msgpack.unpackb(payload, raw=False), version
+        if encoding == ENCODING_JSON:
+            return json.loads(payload), version
+
+        raise ValueError(f"Encodage de session inconnu: {encoding:#x}")
+
+
+# Instance globale
+codec = Codec(settings.SESSION_CODEC, settings.SESSION_COMPRESS_MIN_BYTES)
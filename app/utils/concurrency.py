@@ -0,0 +1,126 @@
+"""
+Limites de concurrence des runs et des outils de l'agent
+
+Avec les appels d'outils parallèles, un même tour (ou plusieurs sessions)
+peut lancer simultanément plusieurs analyses d'image, générations PDF ou
+requêtes Supabase. Chaque outil appartient à un groupe plafonné par un
+sémaphore, pour protéger les API externes et le pool de threads.
+
+Les runs d'agent eux-mêmes sont plafonnés par worker (AgentRunAdmission),
+avec une file d'attente bornée.
+"""
+from functools import wraps
+from typing import Dict, Optional
+import asyncio
+import logging
+
+from app.config import settings
+from app.utils.instrumentation import ADMISSION_REJECTIONS, AGENT_RUNS_WAITING
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def _group_limits() -> Dict[str, int]:
+    """Nombre maximal d'exécutions simultanées par groupe d'outils"""
+    return {
+        "vision": settings.VISION_TOOL_CONCURRENCY,
+        "quotation": settings.QUOTATION_TOOL_CONCURRENCY,
+        "database": settings.DATABASE_TOOL_CONCURRENCY,
+        "payment": settings.PAYMENT_TOOL_CONCURRENCY,
+        "pdf": settings.PDF_TOOL_CONCURRENCY,
+    }
+
+
+class ToolConcurrency:
+    """Registre des sémaphores par groupe d'outils (créés à la première utilisation)"""
+
+    def __init__(self):
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def semaphore(self, group: str) -> asyncio.Semaphore:
+        if group not in self._semaphores:
+            limit = _group_limits().get(group)
+            if not limit:
+                raise ValueError(f"Groupe d'outils inconnu: {group}")
+            self._semaphores[group] = asyncio.Semaphore(limit)
+        return self._semaphores[group]
+
+    def limit(self, group: str):
+        """
+        Décorateur: plafonne les exécutions simultanées d'un outil async.
+
+        À placer sous @function_tool (la signature et la docstring sont
+        conservées pour le schéma de l'outil).
+        """
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                semaphore = self.semaphore(group)
+                with span(f"tool {func.__name__}", **{"aya.tool": func.__name__, "aya.tool_group": group}):
+                    if semaphore.locked():
+                        logger.info(f"⏳ Outil {func.__name__} en attente (limite '{group}' atteinte)")
+                    async with semaphore:
+                        return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+class AgentRunRejected(Exception):
+    """Pas de créneau de run d'agent: file d'attente pleine ou attente trop longue"""
+
+
+class AgentRunAdmission:
+    """
+    Plafond des runs d'agent simultanés sur ce worker, avec file d'attente bornée
+
+    Au-delà de AGENT_RUN_CONCURRENCY runs, un tour attend un créneau au plus
+    AGENT_RUN_QUEUE_TIMEOUT secondes, et seulement si moins de
+    AGENT_RUN_QUEUE_SIZE tours attendent déjà; sinon il est refusé tout de
+    suite. Pendant un pic, les tours admis gardent leur latence au lieu
+    que tous ralentissent ensemble jusqu'aux timeouts des passerelles.
+    """
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+
+    async def acquire(self) -> None:
+        """
+        Prend un créneau (à rendre par release)
+
+        Raises:
+            AgentRunRejected: File pleine ou aucun créneau libéré à temps
+        """
+        if not settings.AGENT_RUN_CONCURRENCY:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.AGENT_RUN_CONCURRENCY)
+
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+
+        if self.waiting >= settings.AGENT_RUN_QUEUE_SIZE:
+            ADMISSION_REJECTIONS.inc(reason="queue_full")
+            raise AgentRunRejected(f"{self.waiting} tours déjà en attente")
+
+        self.waiting += 1
+        AGENT_RUNS_WAITING.inc()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), settings.AGENT_RUN_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            ADMISSION_REJECTIONS.inc(reason="queue_timeout")
+            raise AgentRunRejected(f"aucun créneau libéré en {settings.AGENT_RUN_QUEUE_TIMEOUT:g}s")
+        finally:
+            self.waiting -= 1
+            AGENT_RUNS_WAITING.dec()
+
+    def release(self) -> None:
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+
+# Instances globales
+tool_concurrency = ToolConcurrency()
+agent_run_admission = AgentRunAdmission()
@@ -0,0 +1,245 @@
+"""
+Instrumentation du service (exposée par GET /metrics)
+
+Métriques transverses: requêtes HTTP par route, temps d'aller-retour et
+erreurs des dépendances (Redis, Supabase, ePay, fournisseurs de vision),
+caches, runs d'agent en cours et latence de la boucle asyncio. Les métriques
+propres aux tours (étapes, appels LLM, outils) sont déclarées dans
+app/agents/timeline.py.
+"""
+from contextlib import contextmanager
+from typing import Any, Optional
+import asyncio
+import inspect
+import logging
+import time
+
+from app.utils.metrics import metrics_registry
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+HTTP_REQUESTS = metrics_registry.counter(
+    "aya_http_requests_total",
+    "Requêtes HTTP traitées",
+    ["method", "route", "status"]
+)
+HTTP_REQUEST_SECONDS = metrics_registry.histogram(
+    "aya_http_request_seconds",
+    "Durée des requêtes HTTP",
+    ["method", "route"]
+)
+HTTP_IN_FLIGHT = metrics_registry.gauge(
+    "aya_http_requests_in_flight",
+    "Requêtes HTTP en cours"
+)
+DEPENDENCY_SECONDS = metrics_registry.histogram(
+    "aya_dependency_seconds",
+    "Temps d'aller-retour des appels aux dépendances externes",
+    ["dependency", "operation"]
+)
+DEPENDENCY_ERRORS = metrics_registry.counter(
+    "aya_dependency_errors_total",
+    "Appels aux dépendances externes en erreur",
+    ["dependency", "operation"]
+)
+CACHE_LOOKUPS = metrics_registry.counter(
+    "aya_cache_lookups_total",
+    "Consultations de cache (hit / miss)",
+    ["cache", "result"]
+)
+CACHE_HIT_RATIO = metrics_registry.gauge(
+    "aya_cache_hit_ratio",
+    "Taux de hit par cache (prompt cache OpenAI: tokens d'entrée servis depuis le cache)",
+    ["cache", "model"]
+)
+AGENT_RUNS_IN_FLIGHT = metrics_registry.gauge(
+    "aya_agent_runs_in_flight",
+    "Runs d'agent en cours"
+)
+AGENT_RUNS_WAITING = metrics_registry.gauge(
+    "aya_agent_runs_waiting",
+    "Tours en attente d'un créneau de run d'agent (AGENT_RUN_CONCURRENCY atteint)"
+)
+ADMISSION_REJECTIONS = metrics_registry.counter(
+    "aya_admission_rejections_total",
+    "Tours refusés à l'admission (phone, session: limite glissante; queue_full, queue_timeout: plafond des runs)",
+    ["reason"]
+)
+CHAT_JOBS_QUEUED = metrics_registry.gauge(
+    "aya_chat_jobs_queued",
+    "Jobs de chat asynchrones en attente"
+)
+EVENT_LOOP_LAG = metrics_registry.gauge(
+    "aya_event_loop_lag_seconds",
+    "Dernier retard mesuré de la boucle asyncio"
+)
+EVENT_LOOP_LAG_SECONDS = metrics_registry.histogram(
+    "aya_event_loop_lag_observations_seconds",
+    "Distribution du retard de la boucle asyncio",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+
+@contextmanager
+def track_dependency(dependency: str, operation: str):
+    """
+    Mesure un appel à une dépendance externe (durée + erreur si exception)
+    et l'enregistre comme span client de la trace courante
+
+    Utilisable autour d'un await comme dans un thread (asyncio.to_thread).
+
+    Args:
+        dependency: redis, supabase, epay, gemini, openai, callback, ...
+        operation: Commande ou endpoint appelé
+    """
+    started = time.perf_counter()
+    try:
+        with span(f"{dependency} {operation}", kind="client", **{"peer.service": dependency}):
+            yield
+    except BaseException:
+        DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - started, dependency=dependency, operation=operation)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class InstrumentedRedis:
+    """
+    Client Redis asyncio mesuré: chaque commande alimente aya_dependency_seconds
+
+    Enveloppe le client existant; les attributs non appelables et les
+    méthodes synchrones sont renvoyés tels quels.
+    """
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        if name == "pipeline":
+            # Un pipeline = un aller-retour, mesuré à l'execute()
+            return lambda *args, **kwargs: _InstrumentedPipeline(attribute(*args, **kwargs))
+
+        def command(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if inspect.isawaitable(result):
+                return _tracked("redis", name, result)
+            return result
+        return command
+
+
+async def _tracked(dependency: str, operation: str, awaitable):
+    with track_dependency(dependency, operation):
+        return await awaitable
+
+
+class _InstrumentedPipeline:
+    """Pipeline Redis dont l'execute() alimente aya_dependency_seconds"""
+
+    def __init__(self, pipeline: Any):
+        self._pipeline = pipeline
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pipeline, name)
+
+    async def execute(self, *args, **kwargs):
+        with track_dependency("redis", "pipeline"):
+            return await self._pipeline.execute(*args, **kwargs)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: nombre et durée des requêtes par route
+
+    Le label route est le chemin déclaré (/api/session/{session_id}) et non
+    l'URL, pour garder un nombre de séries borné.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method=method, route=route, status=str(status["code"]))
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, route=route)
+
+
+class LoopLagMonitor:
+    """
+    Mesure le retard de la boucle asyncio
+
+    Une tâche dort `interval` secondes; l'écart entre le réveil prévu et le
+    réveil réel est le temps pendant lequel la boucle était bloquée.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, interval: float) -> None:
+        if self._task is None and interval > 0:
+            self._task = asyncio.create_task(self._run(interval))
+            logger.info(f"⏱️ Mesure du retard de la boucle asyncio (toutes les {interval}s)")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG.set(lag)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+
+
+def _collect_service_gauges() -> None:
+    """Jauges calculées au moment du scrape"""
+    from app.services.usage_tracker import prompt_cache_stats
+    from app.services.chat_jobs import chat_job_manager
+    from app.services.session_cache import session_cache
+
+    for model, totals in prompt_cache_stats.snapshot().items():
+        CACHE_HIT_RATIO.set(totals["cache_hit_ratio"], cache="prompt", model=model)
+    CACHE_HIT_RATIO.set(session_cache.hit_ratio(), cache="session", model="")
+
+    queue = getattr(chat_job_manager, "_queue", None)
+    CHAT_JOBS_QUEUED.set(queue.qsize() if queue is not None else 0)
+
+
+metrics_registry.add_collector(_collect_service_gauges)
+
+
+# Instance globale
+loop_lag_monitor = LoopLagMonitor()
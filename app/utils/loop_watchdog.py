@@ -0,0 +1,226 @@
+"""
+Détecteur de blocages de la boucle asyncio
+
+Un battement de cœur tourne dans la boucle; un thread de surveillance
+vérifie qu'il avance. Quand la boucle ne l'a pas fait avancer depuis plus
+que le seuil, le thread capture la pile du thread de la boucle
+(sys._current_frames): c'est le code synchrone en train de bloquer.
+
+Les rapports sont agrégés par site d'appel (dernière frame du code de
+l'application + frame la plus profonde) pour montrer les points chauds sous
+trafic réel. Consultables via GET /api/admin/loop-blocking.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from app.utils.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+
+LOOP_BLOCKS = metrics_registry.counter(
+    "aya_event_loop_blocks_total",
+    "Blocages de la boucle asyncio détectés par le watchdog"
+)
+LOOP_BLOCK_SECONDS = metrics_registry.histogram(
+    "aya_event_loop_block_seconds",
+    "Durée des blocages de la boucle asyncio détectés par le watchdog",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+# Racine du package: les frames sous ce dossier sont "le code de l'application"
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Enveloppes de mesure/limitation: le site retenu est l'appelant, pas l'enveloppe
+WRAPPER_FILES = {
+    os.path.join(APP_ROOT, "utils", "instrumentation.py"),
+    os.path.join(APP_ROOT, "utils", "concurrency.py"),
+}
+
+# Nombre de frames conservées dans l'exemple de pile d'un site
+STACK_DEPTH = 20
+
+
+def _site(frame: traceback.FrameSummary) -> str:
+    filename = frame.filename
+    if filename.startswith(APP_ROOT):
+        filename = os.path.relpath(filename, os.path.dirname(APP_ROOT))
+    elif "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    return f"{filename}:{frame.lineno} {frame.name}"
+
+
+def call_site(stack: List[traceback.FrameSummary]) -> Tuple[str, str]:
+    """
+    Site d'appel d'une pile capturée
+
+    Args:
+        stack: Pile de la plus externe à la plus profonde
+
+    Returns:
+        (dernière frame du code de l'application, frame la plus profonde)
+    """
+    leaf = _site(stack[-1]) if stack else "inconnu"
+    for frame in reversed(stack):
+        if frame.filename.startswith(APP_ROOT) and frame.filename not in WRAPPER_FILES:
+            return _site(frame), leaf
+    return "hors application", leaf
+
+
+class LoopWatchdog:
+    """Surveillance de la boucle asyncio et agrégation des blocages par site"""
+
+    def __init__(self):
+        self.threshold = 0.1
+        self.max_sites = 200
+        self._heartbeat = 0.0
+        self._interval = 0.05
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._sites: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._started_at: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, threshold: float, max_sites: int = 200) -> None:
+        """
+        Démarre la surveillance (à appeler depuis la boucle à surveiller)
+
+        Args:
+            threshold: Durée de blocage (secondes) à partir de laquelle la pile est capturée
+            max_sites: Nombre maximal de sites conservés
+        """
+        if self.running:
+            return
+
+        self.threshold = threshold
+        self.max_sites = max_sites
+        self._interval = threshold / 2
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._started_at = datetime.utcnow().isoformat()
+
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"🐕 Watchdog de la boucle asyncio démarré (seuil {threshold * 1000:.0f} ms)")
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+
+        self._stop.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.to_thread(self._thread.join, 1.0)
+        self._task = None
+        self._thread = None
+
+    async def _beat(self) -> None:
+        """Battement de cœur: n'avance que si la boucle exécute ses callbacks"""
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self._interval)
+
+    def _watch(self) -> None:
+        """Thread de surveillance: capture la pile de la boucle pendant un blocage"""
+        stalled_beat, stalled_site = None, None
+
+        while not self._stop.wait(self._interval / 2):
+            beat = self._heartbeat
+            late = time.monotonic() - beat - self._interval
+
+            if stalled_beat is not None and beat != stalled_beat:
+                # La boucle a repris: durée du blocage = retard du battement suivant
+                self._finish(stalled_site, max(0.0, beat - stalled_beat - self._interval))
+                stalled_beat, stalled_site = None, None
+
+            if stalled_beat is None and late > self.threshold:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                stack = traceback.extract_stack(frame)
+                stalled_beat, stalled_site = beat, self._capture(stack)
+
+    def _capture(self, stack: List[traceback.FrameSummary]) -> Tuple[str, str]:
+        key = call_site(stack)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = {
+                    "app_site": key[0],
+                    "leaf": key[1],
+                    "count": 0,
+                    "total_blocked_s": 0.0,
+                    "max_blocked_s": 0.0,
+                    "last_seen": None,
+                    "stack": [],
+                }
+                while len(self._sites) > self.max_sites:
+                    self._sites.popitem(last=False)
+            else:
+                self._sites.move_to_end(key)
+
+            site["count"] += 1
+            site["last_seen"] = datetime.utcnow().isoformat()
+            site["stack"] = [_site(frame) for frame in stack[-STACK_DEPTH:]]
+
+        logger.warning(f"🐢 Boucle asyncio bloquée > {self.threshold * 1000:.0f} ms dans {key[0]} ({key[1]})")
+        return key
+
+    def _finish(self, key: Tuple[str, str], blocked: float) -> None:
+        LOOP_BLOCKS.inc()
+        LOOP_BLOCK_SECONDS.observe(blocked)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is not None:
+                site["total_blocked_s"] += blocked
+                site["max_blocked_s"] = max(site["max_blocked_s"], blocked)
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        """
+        Sites de blocage classés par temps bloqué cumulé
+
+        Args:
+            limit: Nombre de sites retournés
+
+        Returns:
+            Configuration du watchdog et sites (nombre, temps cumulé, max, pile)
+        """
+        with self._lock:
+            sites = [dict(site) for site in self._sites.values()]
+
+        sites.sort(key=lambda site: (site["total_blocked_s"], site["count"]), reverse=True)
+        for site in sites:
+            site["total_blocked_s"] = round(site["total_blocked_s"], 4)
+            site["max_blocked_s"] = round(site["max_blocked_s"], 4)
+
+        return {
+            "enabled": self.running,
+            "threshold_ms": round(self.threshold * 1000),
+            "since": self._started_at,
+            "sites": sites[:limit],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._sites.clear()
+        self._started_at = datetime.utcnow().isoformat()
+
+
+# Instance globale
+loop_watchdog = LoopWatchdog()
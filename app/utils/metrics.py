@@ -0,0 +1,248 @@
+"""
+Métriques en mémoire (compteurs, jauges, histogrammes)
+
+Registre minimal, sans dépendance: chaque worker agrège ses propres valeurs.
+Les observations sont protégées par un verrou car certaines proviennent des
+threads (outils exécutés via asyncio.to_thread). `render()` produit le format
+texte Prometheus servi par GET /metrics.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Bornes (secondes) adaptées aux latences d'un tour: de la milliseconde à la minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Metric:
+    """Base commune: nom, aide, labels"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        """Labels au format Prometheus: {a="x",b="y"}"""
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{self._labels(key)} {_format(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Compteur monotone"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return list(self._values.items())
+
+
+class Gauge(_Metric):
+    """Valeur instantanée"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Une jauge sans label est exposée dès sa création (0 plutôt qu'absente)
+        self._values: Dict[Tuple[str, ...], float] = {} if self.labelnames else {(): 0.0}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return list(self._values.items())
+
+
+class Histogram(_Metric):
+    """Histogramme à bornes fixes (comptes par bucket, somme, nombre)"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Par série: [comptes par bucket (+Inf en dernier), somme, nombre]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], List[int], float, int]]:
+        """Séries: (labels, comptes cumulés par bucket, somme, nombre)"""
+        result = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative, running = [], 0
+                for value in counts:
+                    running += value
+                    cumulative.append(running)
+                result.append((key, cumulative, total, count))
+        return result
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Estimation d'un quantile par interpolation linéaire dans les buckets"""
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if not series or not series[2]:
+                return None
+            counts, _, count = series[0][:], series[1], series[2]
+
+        rank = q * count
+        running, lower = 0, 0.0
+        for index, value in enumerate(counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if running + value >= rank and value:
+                return lower + (upper - lower) * (rank - running) / value
+            running += value
+            lower = upper
+        return self.buckets[-1]
+
+    def summary(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Résumé lisible par série: nombre, moyenne, p50, p95, p99"""
+        result = {}
+        for key, _, total, count in self.samples():
+            labels = dict(zip(self.labelnames, key))
+            name = ",".join(f"{k}={v}" for k, v in labels.items()) or "all"
+            result[name] = {
+                "count": count,
+                "avg": round(total / count, 4) if count else None,
+                "p50": self._round(self.quantile(0.5, **labels)),
+                "p95": self._round(self.quantile(0.95, **labels)),
+                "p99": self._round(self.quantile(0.99, **labels)),
+            }
+        return result
+
+    @staticmethod
+    def _round(value: Optional[float]) -> Optional[float]:
+        return round(value, 4) if value is not None else None
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bounds = [_format(bound) for bound in self.buckets] + ["+Inf"]
+        for key, cumulative, total, count in self.samples():
+            for bound, value in zip(bounds, cumulative):
+                le = 'le="' + bound + '"'
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {value}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registre des métriques du worker (get-or-create par nom)"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Métrique {name} déjà déclarée comme {metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def metrics(self) -> List[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """Fonction appelée avant chaque rendu (jauges calculées à la demande)"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Toutes les métriques au format texte Prometheus (version 0.0.4)"""
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Erreur collecteur de métriques {collector.__name__}: {e}")
+
+        lines: List[str] = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    """Nombre au format Prometheus (entiers sans décimale)"""
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+# Instance globale
+metrics_registry = MetricsRegistry()
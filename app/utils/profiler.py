@@ -0,0 +1,268 @@
+"""
+Profileur échantillonné par requête
+
+Déclenché par l'en-tête X-AYA-Profile (ou ?profile=1) sur /api/chat et le
+webhook de paiement, accompagné d'une clé d'administration valide
+(en-tête X-Admin-Key). Un thread échantillonne la requête toutes les quelques
+millisecondes:
+- si la tâche de la requête s'exécute, la pile du thread de la boucle;
+- sinon, la chaîne d'await de sa coroutine (temps passé à attendre Redis,
+  le LLM, un outil...).
+
+Le profil (piles agrégées au format "folded", lisible par speedscope ou
+flamegraph.pl) est stocké dans Redis, ou dans un fichier à défaut, et
+téléchargeable via GET /api/admin/profiles/{profile_id}.
+
+Les requêtes non profilées ne paient qu'une lecture d'en-tête; un plafond
+par minute et un nombre maximal de profils simultanés bornent le coût.
+"""
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+PROFILE_HEADER = b"x-aya-profile"
+ADMIN_KEY_HEADER = b"x-admin-key"
+
+# Racine du projet: chemins affichés relativement à celle-ci
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(PROJECT_ROOT):
+        filename = os.path.relpath(filename, PROJECT_ROOT)
+    elif "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _await_chain(task: asyncio.Task) -> List[str]:
+    """Chaîne d'await d'une tâche suspendue, de la coroutine racine à la plus profonde"""
+    labels = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        labels.append(_frame_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    labels.append("[await]")
+    return labels
+
+
+def _running_stack(frame, root_code) -> List[str]:
+    """Pile du thread de la boucle, tronquée au-dessus de la coroutine de la requête"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        if frame.f_code is root_code:
+            break
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class _Sampler:
+    """Échantillonnage d'une tâche asyncio depuis un thread dédié"""
+
+    def __init__(self, task: asyncio.Task, loop: asyncio.AbstractEventLoop, interval: float):
+        self.task = task
+        self.loop = loop
+        self.interval = interval
+        self.loop_thread_id = threading.get_ident()
+        self.root_code = task.get_coro().cr_code
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(1.0)
+
+    def _run(self) -> None:
+        current_tasks = asyncio.tasks._current_tasks
+        while not self._stop.wait(self.interval):
+            try:
+                if current_tasks.get(self.loop) is self.task:
+                    frame = sys._current_frames().get(self.loop_thread_id)
+                    stack = _running_stack(frame, self.root_code)
+                else:
+                    stack = _await_chain(self.task)
+            except Exception:
+                # Pile modifiée pendant la lecture: échantillon ignoré
+                continue
+            self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+
+class RequestProfiler:
+    """Déclenchement, limitation et stockage des profils de requêtes"""
+
+    def __init__(self):
+        self._recent: deque = deque()
+        self._active = 0
+
+    def wants(self, scope) -> bool:
+        """La requête demande-t-elle un profil (en-tête ou ?profile=1) avec la clé d'administration"""
+        from app.api.admin import is_admin_key
+
+        requested, admin_key = None, None
+        for name, value in scope.get("headers", ()):
+            if name == PROFILE_HEADER:
+                requested = value.lower() in (b"1", b"true", b"yes")
+            elif name == ADMIN_KEY_HEADER:
+                admin_key = value.decode("latin-1")
+        if requested is None:
+            query = scope.get("query_string", b"")
+            requested = b"profile=" in query and parse_qs(query.decode()).get("profile", [""])[0] in ("1", "true")
+        if requested and not is_admin_key(admin_key):
+            logger.warning(f"⚠️ Profil refusé pour {scope.get('path')} (clé d'administration absente ou invalide)")
+            return False
+        return requested
+
+    def acquire(self) -> bool:
+        """Réserve un créneau de profilage (plafond par minute et simultané)"""
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 60:
+            self._recent.popleft()
+
+        if self._active >= settings.PROFILER_MAX_CONCURRENT or len(self._recent) >= settings.PROFILER_MAX_PER_MINUTE:
+            return False
+
+        self._recent.append(now)
+        self._active += 1
+        return True
+
+    def release(self) -> None:
+        self._active -= 1
+
+    def start(self) -> _Sampler:
+        sampler = _Sampler(asyncio.current_task(), asyncio.get_running_loop(), settings.PROFILER_INTERVAL)
+        sampler.start()
+        return sampler
+
+    async def save(self, profile_id: str, sampler: _Sampler, path: str, started: float, status: int) -> None:
+        """Arrête l'échantillonnage et stocke le profil (Redis, sinon fichier)"""
+        await asyncio.to_thread(sampler.stop)
+
+        profile = {
+            "profile_id": profile_id,
+            "path": path,
+            "status": status,
+            "created_at": datetime.utcnow().isoformat(),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "interval_ms": round(sampler.interval * 1000, 1),
+            "samples": sampler.samples,
+            "folded": "\n".join(f"{stack} {count}" for stack, count in sampler.stacks.most_common()),
+        }
+
+        from app.services.redis_client import redis_service
+        if await redis_service.save_profile(profile_id, profile, settings.PROFILER_TTL):
+            logger.info(f"🔬 Profil {profile_id} enregistré ({path}, {profile['samples']} échantillons)")
+            return
+
+        try:
+            await asyncio.to_thread(self._write_file, profile_id, profile)
+            logger.info(f"🔬 Profil {profile_id} enregistré dans {settings.PROFILER_DIR}")
+        except Exception as e:
+            logger.error(f"Erreur sauvegarde profil {profile_id}: {e}")
+
+    @staticmethod
+    def _write_file(profile_id: str, profile: Dict[str, Any]) -> None:
+        os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+        with open(os.path.join(settings.PROFILER_DIR, f"{profile_id}.json"), "w") as f:
+            json.dump(profile, f)
+
+    async def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        """Profil stocké (Redis, sinon fichier)"""
+        from app.services.redis_client import redis_service
+        profile = await redis_service.get_profile(profile_id)
+        if profile is not None:
+            return profile
+
+        path = os.path.join(settings.PROFILER_DIR, f"{os.path.basename(profile_id)}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    async def list_ids(self) -> List[str]:
+        """IDs des profils disponibles, du plus récent au plus ancien"""
+        from app.services.redis_client import redis_service
+        ids = await redis_service.list_profile_ids()
+        if ids or not os.path.isdir(settings.PROFILER_DIR):
+            return ids
+
+        files = sorted(
+            (entry for entry in os.scandir(settings.PROFILER_DIR) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True
+        )
+        return [entry.name[:-5] for entry in files]
+
+
+class ProfilerMiddleware:
+    """
+    Middleware ASGI: profile les requêtes marquées sur les routes configurées
+
+    Sans marqueur, la requête est transmise telle quelle.
+    """
+
+    def __init__(self, app, paths: tuple = ()):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not scope["path"].startswith(self.paths)
+            or not request_profiler.wants(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        if not request_profiler.acquire():
+            logger.warning(f"⚠️ Profil refusé pour {scope['path']} (limite atteinte)")
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-aya-profile-id", profile_id.encode())]}
+            await send(message)
+
+        started = time.perf_counter()
+        sampler = request_profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            try:
+                await request_profiler.save(profile_id, sampler, scope["path"], started, status["code"])
+            finally:
+                request_profiler.release()
+
+
+# Instance globale
+request_profiler = RequestProfiler()
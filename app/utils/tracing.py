@@ -0,0 +1,165 @@
+"""
+Traces distribuées OpenTelemetry (optionnelles)
+
+Activées par OTEL_ENABLED si les paquets opentelemetry-sdk (et
+opentelemetry-exporter-otlp-proto-http pour l'export OTLP) sont installés.
+Sinon `span()` ne fait rien et ne coûte qu'un test.
+
+Une trace démarre sur /api/chat ou le webhook de paiement (en reprenant un
+en-tête traceparent entrant) et couvre le run de l'agent, chaque outil,
+l'analyse d'image, Supabase, Redis, ePay et le rendu PDF.
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+import logging
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Tracer OpenTelemetry une fois configuré (None = traces désactivées)
+_tracer = None
+
+
+def init_tracing() -> bool:
+    """
+    Configure le fournisseur de traces et l'exporteur
+
+    Returns:
+        True si les traces sont actives
+    """
+    global _tracer
+
+    if not settings.OTEL_ENABLED or _tracer is not None:
+        return _tracer is not None
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+        if settings.OTEL_EXPORTER == "console":
+            exporter = ConsoleSpanExporter()
+        else:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter(endpoint=settings.OTEL_EXPORTER_OTLP_ENDPOINT)
+
+        provider = TracerProvider(resource=Resource.create({
+            "service.name": settings.OTEL_SERVICE_NAME,
+            "service.version": settings.APP_VERSION,
+        }))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _tracer = trace.get_tracer("aya")
+
+        logger.info(f"🛰️ Traces OpenTelemetry actives (export: {settings.OTEL_EXPORTER})")
+        return True
+
+    except ImportError as e:
+        logger.warning(f"⚠️ OTEL_ENABLED mais OpenTelemetry non installé ({e}): traces désactivées")
+        return False
+    except Exception as e:
+        logger.error(f"❌ Erreur initialisation OpenTelemetry: {e}")
+        return False
+
+
+def shutdown_tracing() -> None:
+    """Vide les spans en attente avant l'arrêt"""
+    if _tracer is None:
+        return
+
+    from opentelemetry import trace
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
+
+
+def _attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    """Attributs acceptés par OpenTelemetry (None retirés, autres types en texte)"""
+    return {
+        key: value if isinstance(value, (str, bool, int, float)) else str(value)
+        for key, value in attributes.items()
+        if value is not None
+    }
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", context: Any = None, **attributes):
+    """
+    Span autour d'un bloc (sync, async ou dans un thread via asyncio.to_thread)
+
+    Args:
+        name: Nom du span
+        kind: internal, server ou client
+        context: Contexte parent explicite (sinon le span courant)
+        **attributes: Attributs du span (aya.session_id, aya.product_type, ...)
+    """
+    if _tracer is None:
+        yield None
+        return
+
+    from opentelemetry.trace import SpanKind
+
+    with _tracer.start_as_current_span(
+        name,
+        context=context,
+        kind=getattr(SpanKind, kind.upper()),
+        attributes=_attributes(attributes)
+    ) as current:
+        yield current
+
+
+def set_attributes(**attributes) -> None:
+    """Ajoute des attributs au span courant"""
+    if _tracer is None:
+        return
+
+    from opentelemetry import trace
+    trace.get_current_span().set_attributes(_attributes(attributes))
+
+
+def current_context() -> Optional[Any]:
+    """Contexte de trace courant, à transmettre à une tâche exécutée plus tard"""
+    if _tracer is None:
+        return None
+
+    from opentelemetry import context
+    return context.get_current()
+
+
+class TracingMiddleware:
+    """
+    Middleware ASGI: span serveur racine des requêtes sur les routes configurées
+
+    L'en-tête W3C traceparent entrant est repris comme parent.
+    """
+
+    def __init__(self, app, paths: tuple = ()):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if _tracer is None or scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        from opentelemetry import propagate
+
+        carrier = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope.get("headers", ())}
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        with span(
+            f"{scope.get('method', '')} {scope['path']}",
+            kind="server",
+            context=propagate.extract(carrier),
+            **{"http.method": scope.get("method"), "http.target": scope["path"]}
+        ) as server_span:
+            await self.app(scope, receive, send_wrapper)
+            server_span.set_attribute("http.status_code", status["code"])
@@ -0,0 +1,11 @@
+"""
+Banc de charge hors ligne d'AYA
+
+Démarre l'application FastAPI réelle en remplaçant chaque dépendance externe
+par un double local (LLM scripté, vision, Supabase/PostgREST, Redis, ePay)
+dont la latence est réglable, puis rejoue des milliers de conversations de
+souscription simultanées.
+
+Usage:
+    python -m loadtest --conversations 1000 --concurrency 200 --llm-latency 0.8
+"""
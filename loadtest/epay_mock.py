@@ -0,0 +1,51 @@
+"""
+Serveur ePay simulé (MTN MoMo et Airtel Money)
+
+Reproduit les deux endpoints de collecte appelés par MobileMoneyService,
+avec une latence et un taux d'erreur réglables.
+"""
+from typing import Optional
+import random
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from loadtest.stubs import Latency
+
+
+def create_epay_app(latency: Optional[Latency] = None, error_rate: float = 0.0) -> FastAPI:
+    """
+    Application ePay simulée
+
+    Args:
+        latency: Latence de chaque requête
+        error_rate: Part des requêtes en erreur 503 (0 à 1)
+    """
+    latency = latency or Latency()
+    app = FastAPI(title="ePay (simulé)")
+    app.state.requests = 0
+
+    async def collect(request: Request, provider: str):
+        app.state.requests += 1
+        await request.form()
+        await latency.asleep()
+
+        if error_rate and random.random() < error_rate:
+            return JSONResponse({"status": "error", "message": "Service indisponible"}, status_code=503)
+
+        return {
+            "status": "pending",
+            "transaction_reference": f"EPAY-{provider.upper()}-{uuid.uuid4().hex[:12]}",
+            "message": "Demande de paiement envoyée",
+        }
+
+    @app.post("/momo/collection/request-to-pay")
+    async def momo_request_to_pay(request: Request):
+        return await collect(request, "momo")
+
+    @app.post("/airtel/collection/payment")
+    async def airtel_payment(request: Request):
+        return await collect(request, "airtel")
+
+    return app
@@ -0,0 +1,483 @@
+"""
+Banc de charge de bout en bout, hors ligne
+
+Démarre l'application AYA (uvicorn, dans un thread) avec:
+- un LLM scripté qui émet de vrais appels d'outils (loadtest/scripted_llm.py);
+- un fournisseur de vision simulé;
+- un double en mémoire de Supabase/PostgREST;
+- Redis en mémoire, ou un Redis local via --redis-url;
+- un serveur ePay simulé (uvicorn, autre thread).
+
+Puis rejoue des conversations de souscription AUTO et VOYAGE complètes
+(document -> devis -> souscription -> paiement MoMo) sur POST /api/chat et
+rapporte le débit, la latence par tour et par étape (timeline du tour) et
+les taux d'erreur.
+
+Exemple:
+    python -m loadtest --conversations 2000 --concurrency 500 \\
+        --llm-latency 0.8 --vision-latency 2 --db-latency 0.03 --epay-latency 0.5
+"""
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+
+# Clé d'administration de l'application démarrée par le test de charge
+LOADTEST_ADMIN_KEY = "loadtest-admin"
+
+# Étapes de la timeline rapportées (les outils sont rapportés un par un)
+STAGES = ("redis_load", "intent_router", "admission", "agent_run", "llm", "history_save")
+
+# Conversations de souscription: (message, type de document joint)
+SCENARIOS = {
+    "auto": [
+        ("Voici ma carte grise pour assurer ma voiture", "carte_grise"),
+        ("Je prends l'offre 12 mois", None),
+        ("Je paie par MoMo", None),
+    ],
+    "voyage": [
+        ("Voici mon passeport pour une assurance voyage", "passport"),
+        ("Je souscris à cette offre", None),
+        ("Je paie par MoMo", None),
+    ],
+}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m loadtest", description="Banc de charge hors ligne d'AYA")
+    parser.add_argument("--conversations", type=int, default=200, help="Nombre de conversations à jouer")
+    parser.add_argument("--concurrency", type=int, default=50, help="Conversations simultanées")
+    parser.add_argument("--mix", default="auto:0.7,voyage:0.3", help="Répartition des scénarios (produit:poids,...)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Pause du client entre deux messages (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Latence d'un appel LLM (s)")
+    parser.add_argument("--vision-latency", type=float, default=2.0, help="Latence de l'analyse d'image (s)")
+    parser.add_argument("--db-latency", type=float, default=0.03, help="Latence d'une requête Supabase (s)")
+    parser.add_argument("--redis-latency", type=float, default=0.001, help="Latence d'une commande Redis en mémoire (s)")
+    parser.add_argument("--epay-latency", type=float, default=0.5, help="Latence de l'API ePay (s)")
+    parser.add_argument("--epay-error-rate", type=float, default=0.0, help="Part des appels ePay en erreur 503")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Variation des latences (fraction de la moyenne)")
+    parser.add_argument("--redis-url", default="", help="Redis local à utiliser (sinon Redis en mémoire)")
+    parser.add_argument("--redis-shards", type=int, default=1, help="Nœuds Redis en mémoire répartis par hachage cohérent")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Timeout d'une requête /api/chat (s)")
+    parser.add_argument("--seed", type=int, default=None, help="Graine aléatoire (mix et jitter)")
+    parser.add_argument("--output", default="", help="Écrit le rapport JSON dans ce fichier")
+    parser.add_argument("--log-level", default="WARNING", help="Niveau de log de l'application")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """
+    Variables d'environnement lues par app.config: à poser avant d'importer l'application
+
+    Les clés factices garantissent qu'aucun appel ne part vers un vrai service.
+    """
+    os.environ.update({
+        "REDIS_URL": args.redis_url,
+        "REDIS_TOKEN": "",
+        "REDIS_MODE": "sharded" if args.redis_shards > 1 and not args.redis_url else "single",
+        "SUPABASE_URL": "http://127.0.0.1:9",
+        "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoibG9hZHRlc3QifQ.loadtest",
+        "SUPABASE_SERVICE_KEY": "",
+        "OPENAI_API_KEY": "sk-loadtest",
+        "GEMINI_API_KEY": "loadtest",
+        "EPAY_API_KEY": "loadtest",
+        "TURN_TIMELINE_DEBUG_ENABLED": "true",
+        "ADMIN_API_KEY": LOADTEST_ADMIN_KEY,
+        "OTEL_ENABLED": "false",
+    })
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """Serveur uvicorn dans un thread (sans gestion des signaux)"""
+
+    def __init__(self, app, port: int, name: str):
+        import uvicorn
+
+        config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.url = f"http://127.0.0.1:{port}"
+        self._thread = threading.Thread(target=self.server.run, name=name, daemon=True)
+
+    def start(self, timeout: float = 30.0) -> None:
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"Serveur {self.url} non démarré")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self._thread.join(10.0)
+
+
+def install_stand_ins(args: argparse.Namespace, epay_url: str) -> Dict[str, Any]:
+    """Remplace les dépendances externes des singletons de l'application"""
+    from agents import set_tracing_disabled
+
+    from app.agents.orchestrator import aya_orchestrator
+    from app.services.mobile_money import mobile_money_service
+    from app.services.redis_client import redis_service
+    from app.services.redis_shards import ShardedRedis
+    from app.services.supabase_client import supabase_service
+    from app.utils.instrumentation import InstrumentedRedis
+    import app.tools.agent_tools as agent_tools
+    import app.tools.quotation as quotation
+
+    from loadtest.scripted_llm import ScriptedModel
+    from loadtest.stubs import Latency, MemoryRedis, MemorySupabase, make_image_processor
+
+    # Traces du SDK: elles seraient exportées vers OpenAI
+    set_tracing_disabled(True)
+
+    model = ScriptedModel(Latency(args.llm_latency, args.jitter))
+    aya_orchestrator.model = model
+    aya_orchestrator._agents.clear()
+
+    image_processor = make_image_processor(Latency(args.vision_latency, args.jitter))
+    agent_tools.image_processor = image_processor
+    quotation.image_processor = image_processor
+
+    database = MemorySupabase(Latency(args.db_latency, args.jitter))
+    supabase_service.client = database
+
+    # Avec --redis-url, le client est créé au démarrage de l'application
+    redis_nodes = []
+    if not args.redis_url:
+        redis_nodes = [MemoryRedis(Latency(args.redis_latency, args.jitter)) for _ in range(max(args.redis_shards, 1))]
+        if len(redis_nodes) > 1:
+            redis = ShardedRedis(redis_nodes, [f"memory-{index}" for index in range(len(redis_nodes))])
+        else:
+            redis = redis_nodes[0]
+        redis_service.client = InstrumentedRedis(redis)
+
+    mobile_money_service.base_url = epay_url
+
+    return {"model": model, "database": database, "redis_nodes": redis_nodes}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        product, _, weight = part.partition(":")
+        if product.strip() not in SCENARIOS:
+            raise SystemExit(f"Scénario inconnu: {product} (disponibles: {', '.join(SCENARIOS)})")
+        weights[product.strip()] = float(weight or 1)
+    return weights
+
+
+# ============================================================================
+# CONDUITE DE LA CHARGE
+# ============================================================================
+
+class Results:
+    """Mesures collectées pendant la charge"""
+
+    def __init__(self):
+        self.turn_ms: List[float] = []
+        self.turn_ms_by_step: Dict[str, List[float]] = defaultdict(list)
+        self.stage_ms: Dict[str, List[float]] = defaultdict(list)
+        self.tool_ms: Dict[str, List[float]] = defaultdict(list)
+        self.routes: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.tool_errors: Counter = Counter()
+        self.conversations = Counter()
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+
+    def record_timeline(self, timeline: Dict[str, Any]) -> None:
+        self.llm_calls += timeline.get("llm_calls", 0)
+        self.input_tokens += timeline.get("input_tokens", 0)
+        self.cached_input_tokens += timeline.get("cached_input_tokens", 0)
+
+        for event in timeline.get("events", []):
+            stage = event.get("stage")
+            if stage == "tool":
+                self.tool_ms[event.get("tool", "?")].append(event["duration_ms"])
+                if event.get("outcome") != "ok":
+                    self.tool_errors[event.get("tool", "?")] += 1
+            elif stage == "turn":
+                self.routes[event.get("route", "?")] += 1
+            elif stage in STAGES:
+                self.stage_ms[stage].append(event["duration_ms"])
+
+
+async def play_conversation(client, index: int, product: str, run_id: str, args, results: Results) -> None:
+    """Joue une conversation complète; s'arrête au premier tour en erreur"""
+    session_id = f"loadtest-{run_id}-{index}"
+    phone = f"2420{index:08d}"
+
+    for step, (message, document) in enumerate(SCENARIOS[product], start=1):
+        data = {"msg": message, "session_id": session_id, "user_phone": phone, "debug": "true"}
+        if document:
+            data["message_type"] = "image"
+            data["media_url"] = f"https://media.loadtest.invalid/{document}/{session_id}.jpg"
+
+        started = time.perf_counter()
+        try:
+            response = await client.post("/api/chat", data=data, timeout=args.timeout)
+        except Exception as e:
+            results.errors[f"transport:{type(e).__name__}"] += 1
+            results.conversations["failed"] += 1
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        results.turn_ms.append(elapsed_ms)
+        results.turn_ms_by_step[f"{product}.{step}"].append(elapsed_ms)
+
+        if response.status_code != 200:
+            results.errors[f"http_{response.status_code}"] += 1
+            results.conversations["failed"] += 1
+            return
+
+        body = response.json()
+        metadata = body.get("metadata") or {}
+        if metadata.get("turn_timeline"):
+            results.record_timeline(metadata["turn_timeline"])
+
+        reply = body.get("reply") or ""
+        if metadata.get("error"):
+            results.errors["chat_exception"] += 1
+            results.conversations["failed"] += 1
+            return
+        if metadata.get("overloaded"):
+            results.errors["overloaded"] += 1
+            results.conversations["failed"] += 1
+            return
+        if reply.startswith("Désolée") or "indisponible à cette étape" in reply:
+            results.errors["agent_error_reply"] += 1
+            results.conversations["failed"] += 1
+            return
+
+        if args.think_time:
+            await asyncio.sleep(random.uniform(0, 2 * args.think_time))
+
+    if "Paiement initié" in reply:
+        results.conversations["completed"] += 1
+    else:
+        results.errors["incomplete_workflow"] += 1
+        results.conversations["failed"] += 1
+
+
+async def drive(base_url: str, args: argparse.Namespace, results: Results) -> float:
+    """Lance toutes les conversations (au plus --concurrency simultanées); retourne la durée"""
+    import httpx
+
+    weights = parse_mix(args.mix)
+    products = random.choices(list(weights), weights=list(weights.values()), k=args.conversations)
+    run_id = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    # Clé d'administration: chronologie des tours (debug=true) dans les réponses
+    headers = {"X-Admin-Key": LOADTEST_ADMIN_KEY}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, headers=headers) as client:
+
+        async def bounded(index: int, product: str):
+            async with semaphore:
+                await play_conversation(client, index, product, run_id, args, results)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(index, product) for index, product in enumerate(products)))
+        return time.perf_counter() - started
+
+
+# ============================================================================
+# RAPPORT
+# ============================================================================
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 1) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50), 1),
+        "p95_ms": round(percentile(values, 0.95), 1),
+        "p99_ms": round(percentile(values, 0.99), 1),
+        "max_ms": round(max(values), 1) if values else 0.0,
+    }
+
+
+def dependency_report() -> Dict[str, Any]:
+    """Appels aux dépendances mesurés par l'application (même processus): nombre, erreurs, p95"""
+    from app.utils.instrumentation import DEPENDENCY_ERRORS, DEPENDENCY_SECONDS
+
+    errors = {" ".join(key): value for key, value in DEPENDENCY_ERRORS.samples()}
+    report = {}
+    for key, _, _, count in DEPENDENCY_SECONDS.samples():
+        name = " ".join(key)
+        p95 = DEPENDENCY_SECONDS.quantile(0.95, dependency=key[0], operation=key[1])
+        report[name] = {
+            "count": count,
+            "errors": int(errors.get(name, 0)),
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+    return report
+
+
+def cache_report() -> Dict[str, Any]:
+    """Consultations des caches de l'application: hits, misses, taux de hit"""
+    from app.utils.instrumentation import CACHE_LOOKUPS
+
+    report: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"hit": 0, "miss": 0})
+    for (cache, result), value in CACHE_LOOKUPS.samples():
+        report[cache][result] = int(value)
+    for values in report.values():
+        total = values["hit"] + values["miss"]
+        values["hit_ratio"] = round(values["hit"] / total, 4) if total else 0.0
+    return dict(report)
+
+
+def build_report(args: argparse.Namespace, results: Results, duration: float, stand_ins: Dict[str, Any], epay_requests: int) -> Dict[str, Any]:
+    turns = len(results.turn_ms)
+    tool_calls = sum(len(values) for values in results.tool_ms.values())
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "duration_s": round(duration, 2),
+        "throughput": {
+            "turns_per_s": round(turns / duration, 2) if duration else 0.0,
+            "conversations_per_s": round(results.conversations["completed"] / duration, 2) if duration else 0.0,
+        },
+        "conversations": {
+            "total": args.conversations,
+            "completed": results.conversations["completed"],
+            "failed": results.conversations["failed"],
+            "error_rate": round(results.conversations["failed"] / args.conversations, 4) if args.conversations else 0.0,
+        },
+        "turns": {
+            "total": turns,
+            "latency": distribution(results.turn_ms),
+            "by_step": {step: distribution(values) for step, values in sorted(results.turn_ms_by_step.items())},
+            "routes": dict(results.routes),
+        },
+        "stages": {stage: distribution(results.stage_ms[stage]) for stage in STAGES if results.stage_ms[stage]},
+        "tools": {
+            tool: {**distribution(values), "errors": results.tool_errors[tool]}
+            for tool, values in sorted(results.tool_ms.items())
+        },
+        "errors": dict(results.errors),
+        "tool_error_rate": round(sum(results.tool_errors.values()) / tool_calls, 4) if tool_calls else 0.0,
+        "dependencies": dependency_report(),
+        "caches": cache_report(),
+        "llm": {
+            "calls": results.llm_calls,
+            "input_tokens": results.input_tokens,
+            "cached_input_tokens": results.cached_input_tokens,
+        },
+        "backends": {
+            "llm_requests": stand_ins["model"].requests,
+            "supabase_rows": stand_ins["database"].counts(),
+            "epay_requests": epay_requests,
+            "redis": args.redis_url or "memory",
+            "redis_keys_per_node": [node.store.dbsize() for node in stand_ins["redis_nodes"]],
+        },
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    conversations = report["conversations"]
+    print()
+    print(f"Durée: {report['duration_s']} s")
+    print(
+        f"Conversations: {conversations['completed']}/{conversations['total']} terminées, "
+        f"{conversations['failed']} en échec ({conversations['error_rate']:.2%})"
+    )
+    print(
+        f"Débit: {report['throughput']['turns_per_s']} tours/s, "
+        f"{report['throughput']['conversations_per_s']} conversations/s"
+    )
+
+    rows = [("tour (client)", report["turns"]["latency"])]
+    rows += [(f"  {step}", values) for step, values in report["turns"]["by_step"].items()]
+    rows += [(stage, values) for stage, values in report["stages"].items()]
+    rows += [(f"outil {tool}", values) for tool, values in report["tools"].items()]
+
+    print()
+    print(f"{'étape':<36}{'n':>8}{'moy':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, values in rows:
+        print(
+            f"{name:<36}{values['count']:>8}{values['mean_ms']:>10}{values['p50_ms']:>10}"
+            f"{values['p95_ms']:>10}{values['p99_ms']:>10}{values['max_ms']:>10}"
+        )
+
+    if report["errors"]:
+        print()
+        print("Erreurs: " + ", ".join(f"{kind}={count}" for kind, count in sorted(report["errors"].items())))
+    if report["tool_error_rate"]:
+        print(f"Taux d'erreur des outils: {report['tool_error_rate']:.2%}")
+
+    failing = {name: values for name, values in report["dependencies"].items() if values["errors"]}
+    if failing:
+        print("Dépendances en erreur: " + ", ".join(
+            f"{name}={values['errors']}/{values['count']}" for name, values in sorted(failing.items())
+        ))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    configure_environment(args)
+
+    from app.main import app
+    from loadtest.epay_mock import create_epay_app
+    from loadtest.stubs import Latency
+
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    epay_app = create_epay_app(Latency(args.epay_latency, args.jitter), args.epay_error_rate)
+    epay = ServerThread(epay_app, free_port(), "loadtest-epay")
+    epay.start()
+
+    stand_ins = install_stand_ins(args, epay.url)
+    aya = ServerThread(app, free_port(), "loadtest-aya")
+    aya.start()
+
+    from app.services.redis_client import redis_service
+    if redis_service.client is None:
+        aya.stop()
+        epay.stop()
+        raise SystemExit(f"Connexion Redis impossible: {args.redis_url}")
+
+    results = Results()
+    try:
+        print(f"▶️ {args.conversations} conversations, {args.concurrency} simultanées sur {aya.url}")
+        duration = asyncio.run(drive(aya.url, args, results))
+    finally:
+        aya.stop()
+        epay.stop()
+
+    report = build_report(args, results, duration, stand_ins, epay_app.state.requests)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nRapport écrit dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+LLM scripté pour le banc de charge
+
+Implémente l'interface Model du SDK openai-agents: au lieu d'appeler OpenAI,
+il rejoue le parcours de souscription (analyse du document, devis, création
+client/souscription, paiement) en émettant de vrais appels d'outils que le
+Runner exécute. Le modèle ne décide que de l'outil suivant; les outils, les
+hooks et l'orchestrateur tournent tels quels.
+"""
+from typing import Any, Dict, List, Optional
+import ast
+import json
+import re
+import uuid
+
+from agents.items import ModelResponse
+from agents.models.interface import Model
+from agents.usage import Usage
+from openai.types.responses import (
+    ResponseFunctionToolCall,
+    ResponseOutputMessage,
+    ResponseOutputText,
+)
+from openai.types.responses.response_usage import InputTokensDetails, OutputTokensDetails
+
+from loadtest.stubs import Latency
+
+
+PHONE_PATTERN = re.compile(r"\[TÉLÉPHONE CLIENT: ([^\]]+)\]")
+MEDIA_PATTERN = re.compile(r"URL de l'image: (\S+)")
+
+# Paramètres de devis VOYAGE du scénario (ligne présente dans data/voyage.csv)
+VOYAGE_QUOTE = {"client_type": "PARTICULIER", "zone": "EUROPE", "product": "EUROPE ET SCHENGEN", "duration_days": 7}
+
+# Outils enchaînés par intention du client, selon le produit
+PLANS = {
+    ("document", "auto"): ["analyze_carte_grise", "calculate_auto_quotation"],
+    ("document", "voyage"): ["analyze_passport", "calculate_voyage_quotation"],
+    ("subscribe", "auto"): ["get_or_create_client", "create_souscription", "save_auto_details"],
+    ("subscribe", "voyage"): ["get_or_create_client", "create_souscription", "save_voyage_details"],
+    ("pay", "auto"): ["initiate_momo_payment"],
+    ("pay", "voyage"): ["initiate_momo_payment"],
+}
+
+
+def _parse_output(output: Any) -> Dict[str, Any]:
+    """Sortie d'outil transmise par le SDK (dict, JSON ou repr Python)"""
+    if isinstance(output, dict):
+        return output
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            value = parse(output)
+            if isinstance(value, dict):
+                return value
+        except Exception:
+            continue
+    return {}
+
+
+def _field(item: Any, name: str) -> Any:
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(str(_field(part, "text") or "") for part in content)
+    return ""
+
+
+class ScriptedModel(Model):
+    """
+    Modèle déterministe: un appel d'outil par requête, puis une réponse texte
+
+    L'intention du tour est lue dans le message du client (document joint,
+    choix de l'offre, paiement MoMo). Les résultats d'outils (client_id,
+    souscription_id, prime) sont mémorisés par numéro de téléphone pour
+    construire les arguments des tours suivants.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None, model: str = "scripted-loadtest"):
+        self.latency = latency or Latency()
+        self.model = model
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+
+    async def get_response(
+        self,
+        system_instructions,
+        input,
+        model_settings,
+        tools,
+        output_schema,
+        handoffs,
+        tracing,
+        *,
+        previous_response_id=None,
+        conversation_id=None,
+        prompt=None,
+    ) -> ModelResponse:
+        await self.latency.asleep()
+        self.requests += 1
+
+        items = [{"role": "user", "content": input}] if isinstance(input, str) else list(input)
+        turn = self._current_turn(items)
+        message = _text(_field(turn[0], "content")) if turn else ""
+
+        phone_match = PHONE_PATTERN.search(message)
+        phone = phone_match.group(1) if phone_match else "inconnu"
+        memory = self.sessions.setdefault(phone, {"phone": phone})
+
+        called, failed = self._remember_outputs(turn, memory)
+        if failed:
+            return self._reply(f"Désolée, une erreur est survenue: {failed}", system_instructions, items)
+
+        available = {getattr(tool, "name", None) for tool in tools}
+        for tool_name in self._plan(message, memory):
+            if tool_name in called:
+                continue
+            if tool_name not in available:
+                return self._reply(f"Outil {tool_name} indisponible à cette étape.", system_instructions, items)
+            return self._tool_call(tool_name, self._arguments(tool_name, memory), system_instructions, items)
+
+        return self._reply(self._summary(memory), system_instructions, items)
+
+    def stream_response(self, *args, **kwargs):
+        raise NotImplementedError("Le banc de charge n'utilise pas le streaming")
+
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def _current_turn(items: List[Any]) -> List[Any]:
+        """Éléments du tour en cours: depuis le dernier message utilisateur"""
+        for index in range(len(items) - 1, -1, -1):
+            if _field(items[index], "role") == "user":
+                return items[index:]
+        return []
+
+    @staticmethod
+    def _remember_outputs(turn: List[Any], memory: Dict[str, Any]):
+        """Mémorise les résultats d'outils du tour; retourne (outils appelés, erreur éventuelle)"""
+        names = {}
+        for item in turn:
+            if _field(item, "type") == "function_call":
+                names[_field(item, "call_id")] = _field(item, "name")
+
+        failed = None
+        for item in turn:
+            if _field(item, "type") != "function_call_output":
+                continue
+            name = names.get(_field(item, "call_id"))
+            output = _parse_output(_field(item, "output"))
+            if output.get("error") or output.get("success") is False:
+                failed = f"{name}: {output.get('message') or output.get('error')}"
+            memory[name] = output
+
+        return set(names.values()), failed
+
+    @staticmethod
+    def _plan(message: str, memory: Dict[str, Any]) -> List[str]:
+        media = MEDIA_PATTERN.search(message)
+        if media:
+            memory["media_url"] = media.group(1)
+            memory["product"] = "voyage" if "passport" in media.group(1) else "auto"
+            return PLANS[("document", memory["product"])]
+
+        lowered = message.lower()
+        product = memory.get("product", "auto")
+        if "momo" in lowered:
+            return PLANS[("pay", product)]
+        if "mois" in lowered or "offre" in lowered or "souscri" in lowered:
+            return PLANS[("subscribe", product)]
+        return []
+
+    @staticmethod
+    def _prime(memory: Dict[str, Any]) -> float:
+        if memory.get("product") == "voyage":
+            return float(memory.get("calculate_voyage_quotation", {}).get("tarif_ttc", 0))
+        offer = memory.get("calculate_auto_quotation", {}).get("OFFRE_12_MOIS", {})
+        return float(offer.get("PRIME_TOTALE", 0))
+
+    def _arguments(self, tool_name: str, memory: Dict[str, Any]) -> Dict[str, Any]:
+        card = memory.get("analyze_carte_grise", {})
+        passport = memory.get("analyze_passport", {})
+        prime = self._prime(memory)
+        souscription_id = memory.get("create_souscription", {}).get("souscription_id", "")
+
+        if tool_name in ("analyze_carte_grise", "analyze_passport"):
+            return {"image_url": memory["media_url"]}
+        if tool_name == "calculate_auto_quotation":
+            return {"power": int(card.get("power", 7)), "seat_number": int(card.get("seat_number", 5)), "fuel_type": card.get("fuel_type", "ESSENCE")}
+        if tool_name == "calculate_voyage_quotation":
+            return dict(VOYAGE_QUOTE)
+        if tool_name == "get_or_create_client":
+            return {"phone_number": memory["phone"], "fullname": card.get("fullname") or passport.get("full_name")}
+        if tool_name == "create_souscription":
+            voyage = memory.get("product") == "voyage"
+            return {
+                "client_id": memory.get("get_or_create_client", {}).get("client_id", ""),
+                "product_type": "NSIA VOYAGE" if voyage else "NSIA AUTO",
+                "prime_ttc": prime,
+                "coverage_duration": f"{VOYAGE_QUOTE['duration_days']}J" if voyage else "12M",
+            }
+        if tool_name == "save_auto_details":
+            return {
+                "souscription_id": souscription_id,
+                "fullname": card.get("fullname", ""),
+                "immatriculation": card.get("immatriculation", ""),
+                "power": str(card.get("power", "")),
+                "seat_number": int(card.get("seat_number", 5)),
+                "fuel_type": card.get("fuel_type", ""),
+                "brand": card.get("brand", ""),
+                "phone": memory["phone"],
+                "prime_ttc": int(prime),
+                "coverage": "12M",
+                "quotation_json": json.dumps(memory.get("calculate_auto_quotation", {})),
+                "chassis_number": card.get("chassis_number"),
+                "model": card.get("model"),
+            }
+        if tool_name == "save_voyage_details":
+            return {
+                "souscription_id": souscription_id,
+                "full_name": passport.get("full_name", ""),
+                "passport_number": passport.get("passport_number", ""),
+                "prime_ttc": str(int(prime)),
+                "coverage": f"{VOYAGE_QUOTE['duration_days']}J",
+                "nationality": passport.get("nationality"),
+            }
+        if tool_name == "initiate_momo_payment":
+            return {
+                "amount": prime,
+                "phone_number": memory["phone"],
+                "souscription_id": souscription_id,
+                "product_type": memory.get("product", "auto"),
+            }
+        return {}
+
+    @staticmethod
+    def _summary(memory: Dict[str, Any]) -> str:
+        payment = memory.get("initiate_momo_payment")
+        if payment:
+            return f"Paiement initié, référence {payment.get('reference')}."
+        if memory.get("create_souscription"):
+            return f"Souscription {memory['create_souscription'].get('souscription_id')} enregistrée. Payez-vous par MoMo?"
+        if memory.get("product"):
+            return f"Votre devis: {ScriptedModel._prime(memory):.0f} FCFA. Quelle offre choisissez-vous?"
+        return "Bonjour! Quel produit vous intéresse?"
+
+    # ------------------------------------------------------------------------
+
+    def _usage(self, system_instructions: Optional[str], items: List[Any], output_tokens: int) -> Usage:
+        """Tokens estimés (4 caractères par token), le préfixe système étant servi depuis le cache"""
+        system_tokens = len(system_instructions or "") // 4
+        input_tokens = system_tokens + sum(len(str(item)) for item in items) // 4
+        return Usage(
+            requests=1,
+            input_tokens=input_tokens,
+            input_tokens_details=InputTokensDetails(cached_tokens=system_tokens),
+            output_tokens=output_tokens,
+            output_tokens_details=OutputTokensDetails(reasoning_tokens=0),
+            total_tokens=input_tokens + output_tokens,
+        )
+
+    def _tool_call(self, name: str, arguments: Dict[str, Any], system_instructions, items) -> ModelResponse:
+        payload = json.dumps(arguments, ensure_ascii=False)
+        call = ResponseFunctionToolCall(
+            type="function_call",
+            id=f"fc_{uuid.uuid4().hex}",
+            call_id=f"call_{uuid.uuid4().hex}",
+            name=name,
+            arguments=payload,
+            status="completed",
+        )
+        return ModelResponse(output=[call], usage=self._usage(system_instructions, items, len(payload) // 4), response_id=None)
+
+    def _reply(self, text: str, system_instructions, items) -> ModelResponse:
+        message = ResponseOutputMessage(
+            type="message",
+            id=f"msg_{uuid.uuid4().hex}",
+            role="assistant",
+            status="completed",
+            content=[ResponseOutputText(type="output_text", text=text, annotations=[])],
+        )
+        return ModelResponse(output=[message], usage=self._usage(system_instructions, items, len(text) // 4), response_id=None)
@@ -0,0 +1,526 @@
+"""
+Doubles locaux des dépendances d'AYA
+
+- MemoryRedis: client Redis asyncio en mémoire (commandes utilisées par le service)
+- MemorySupabase: client PostgREST/Storage en mémoire (tables, filtres, insert, update)
+- fake_image_processor: extraction de carte grise / passeport sans fournisseur de vision
+
+Chaque double applique une latence réglable pour simuler l'aller-retour réseau.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+import asyncio
+import copy
+import hashlib
+import random
+import threading
+import time
+import uuid
+
+
+class Latency:
+    """Latence simulée: moyenne +/- jitter (fraction de la moyenne)"""
+
+    def __init__(self, mean: float = 0.0, jitter: float = 0.0):
+        self.mean = mean
+        self.jitter = jitter
+
+    def sample(self) -> float:
+        if self.mean <= 0:
+            return 0.0
+        spread = self.mean * self.jitter
+        return max(0.0, random.uniform(self.mean - spread, self.mean + spread))
+
+    def sleep(self) -> None:
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+    async def asleep(self) -> None:
+        delay = self.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+# ============================================================================
+# REDIS
+# ============================================================================
+
+class _MemoryStore:
+    """Données et commandes Redis (sans latence)"""
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def getex(self, key, ex=None, px=None, persist=False):
+        return self._data.get(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False, **kwargs):
+        if nx and key in self._data:
+            return None
+        if xx and key not in self._data:
+            return None
+        self._data[key] = value
+        return True
+
+    def expire(self, key, ttl):
+        return key in self._data
+
+    def delete(self, *keys):
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def exists(self, *keys):
+        return sum(key in self._data for key in keys)
+
+    def rpush(self, key, *values):
+        items = self._data.setdefault(key, [])
+        items.extend(values)
+        return len(items)
+
+    def lpush(self, key, *values):
+        items = self._data.setdefault(key, [])
+        for value in values:
+            items.insert(0, value)
+        return len(items)
+
+    @staticmethod
+    def _bounds(items: list, start: int, end: int):
+        size = len(items)
+        start = start + size if start < 0 else start
+        end = end + size if end < 0 else end
+        return max(start, 0), end + 1
+
+    def ltrim(self, key, start, end):
+        items = self._data.get(key, [])
+        low, high = self._bounds(items, start, end)
+        self._data[key] = items[low:high]
+        return True
+
+    def lrange(self, key, start, end):
+        items = self._data.get(key, [])
+        low, high = self._bounds(items, start, end)
+        return list(items[low:high])
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        fields = self._data.setdefault(key, {})
+        updates = dict(mapping or {})
+        if field is not None:
+            updates[field] = value
+        added = sum(name not in fields for name in updates)
+        fields.update(updates)
+        return added
+
+    def hgetall(self, key):
+        return dict(self._data.get(key, {}))
+
+    def hdel(self, key, *fields):
+        current = self._data.get(key, {})
+        return sum(current.pop(name, None) is not None for name in fields)
+
+    def hget(self, key, field):
+        return self._data.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        current = self._data.get(key, {})
+        return [current.get(name) for name in fields]
+
+    def zadd(self, key, mapping):
+        scores = self._data.setdefault(key, {})
+        added = len(set(mapping) - set(scores))
+        scores.update({member: float(score) for member, score in mapping.items()})
+        return added
+
+    def zrem(self, key, *members):
+        scores = self._data.get(key, {})
+        return sum(scores.pop(member, None) is not None for member in members)
+
+    def zscore(self, key, member):
+        return self._data.get(key, {}).get(member)
+
+    def zrangebyscore(self, key, min_score, max_score, start=None, num=None):
+        scores = self._data.get(key, {})
+        low = float("-inf") if min_score == "-inf" else float(min_score)
+        members = sorted((score, member) for member, score in scores.items() if low <= score <= float(max_score))
+        members = [member for _, member in members]
+        return members[start:start + num] if start is not None else members
+
+    # Scripts Lua de RedisService, rejoués en Python
+    def script_load(self, script):
+        return hashlib.sha1(script.encode()).hexdigest()
+
+    def evalsha(self, sha, numkeys, *keys_and_args):
+        from app.services import redis_client
+
+        scripts = {
+            self.script_load(redis_client.SAVE_STATE_SCRIPT): self._save_state,
+            self.script_load(redis_client.APPEND_MESSAGE_SCRIPT): self._append_message,
+            self.script_load(redis_client.UPDATE_FIELDS_SCRIPT): self._update_fields,
+            self.script_load(redis_client.CLAIM_EXPIRING_SCRIPT): self._claim_expiring,
+            self.script_load(redis_client.RELEASE_ARCHIVED_SCRIPT): self._release_archived,
+            self.script_load(redis_client.RATE_LIMIT_SCRIPT): self._rate_limit,
+        }
+        return scripts[sha](list(keys_and_args[:numkeys]), list(keys_and_args[numkeys:]))
+
+    def _save_state(self, keys, args):
+        state_key, history_key = keys
+        ttl, max_messages, count = args[:3]
+        last = 3 + count * 3
+        fields = self._data.get(state_key, {})
+        triplets = [args[i:i + 3] for i in range(3, last, 3)]
+
+        conflicts = []
+        for name, expected, _ in triplets:
+            current = fields.get(name)
+            digest = hashlib.sha1(current if isinstance(current, bytes) else current.encode()).hexdigest() if current is not None else ""
+            if expected != "*" and digest != expected:
+                conflicts.append(name)
+        if conflicts:
+            return conflicts
+
+        self.hset(state_key, mapping={name: value for name, _, value in triplets})
+        if len(args) > last:
+            self.rpush(history_key, *args[last:])
+            self.ltrim(history_key, -max_messages, -1)
+        return []
+
+    def _append_message(self, keys, args):
+        import msgpack
+
+        state_key, history_key = keys
+        ttl, max_messages, message, last_message = args
+        raw = self._data.get(state_key, {}).get("message_count")
+        if raw is None:
+            return 0
+        if raw[0] < 0x20 and raw[0] not in (0x09, 0x0A, 0x0D):
+            header, payload = raw[:2], raw[2:]
+            if raw[1] & 0x0F == 0x02:
+                count = header + msgpack.packb(msgpack.unpackb(payload) + 1)
+            else:
+                count = header + str(int(payload) + 1).encode()
+        else:
+            count = str(int(raw) + 1).encode()
+        self.hset(state_key, mapping={"message_count": count, "last_message": last_message})
+        self.rpush(history_key, message)
+        self.ltrim(history_key, -max_messages, -1)
+        return 1
+
+    def _update_fields(self, keys, args):
+        if keys[0] not in self._data:
+            return 0
+        pairs = args[1:]
+        self.hset(keys[0], mapping=dict(zip(pairs[::2], pairs[1::2])))
+        return 1
+
+    def _claim_expiring(self, keys, args):
+        before, limit, lease_until = args
+        session_ids = self.zrangebyscore(keys[0], "-inf", before, 0, int(limit))
+        self.zadd(keys[0], {session_id: lease_until for session_id in session_ids})
+        return session_ids
+
+    def _release_archived(self, keys, args):
+        lease_until, session_ids = float(args[0]), args[1:]
+        return sum(
+            self.zrem(keys[0], session_id)
+            for session_id in session_ids
+            if self.zscore(keys[0], session_id) == lease_until
+        )
+
+    def _rate_limit(self, keys, args):
+        now, turn_id, limits = args[0], args[1], args[2:]
+        for index, key in enumerate(keys):
+            window, limit = limits[2 * index], limits[2 * index + 1]
+            log = self._data.setdefault(key, {})
+            for member in [member for member, score in log.items() if score <= now - window]:
+                del log[member]
+            if len(log) >= limit:
+                return [index + 1, min(log.values()) + window - now]
+        for key in keys:
+            self.zadd(key, {turn_id: now})
+        return [0, 0]
+
+    def publish(self, channel, message):
+        queues = self._subscribers.get(channel, [])
+        for queue in queues:
+            queue.put_nowait({"type": "message", "channel": channel, "data": message})
+        return len(queues)
+
+    def llen(self, key):
+        return len(self._data.get(key, []))
+
+    def dbsize(self):
+        return len(self._data)
+
+    def ping(self):
+        return True
+
+
+class MemoryRedis:
+    """
+    Client Redis asyncio en mémoire (commandes utilisées par RedisService)
+
+    Chaque commande attend la latence simulée puis s'applique au magasin.
+    Les TTL sont acceptés mais ignorés: un test de charge ne dure pas assez
+    longtemps pour qu'ils expirent.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency()
+        self.store = _MemoryStore()
+
+    def __getattr__(self, name: str):
+        command = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            await self.latency.asleep()
+            return command(*args, **kwargs)
+        return call
+
+    def pipeline(self, transaction: bool = True):
+        return _MemoryPipeline(self)
+
+    def pubsub(self):
+        return _MemoryPubSub(self.store)
+
+    async def aclose(self):
+        return None
+
+
+class _MemoryPipeline:
+    """Pipeline: commandes bufferisées, un seul aller-retour à l'execute()"""
+
+    def __init__(self, redis: MemoryRedis):
+        self._redis = redis
+        self._commands: List[tuple] = []
+
+    def __getattr__(self, name: str):
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self, raise_on_error: bool = True):
+        await self._redis.latency.asleep()
+        commands, self._commands = self._commands, []
+        results = []
+        for name, args, kwargs in commands:
+            try:
+                results.append(getattr(self._redis.store, name)(*args, **kwargs))
+            except Exception as e:
+                # Comme redis-py: l'erreur d'une commande devient son résultat
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+class _MemoryPubSub:
+    """Abonnement pub/sub en mémoire (get_message avec attente bornée)"""
+
+    def __init__(self, store: _MemoryStore):
+        self._store = store
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._channels: List[str] = []
+
+    async def subscribe(self, *channels):
+        for channel in channels:
+            self._store._subscribers.setdefault(channel, []).append(self._queue)
+            self._channels.append(channel)
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: Optional[float] = 0.0):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        for channel in self._channels:
+            self._store._subscribers.get(channel, []).remove(self._queue)
+        self._channels = []
+
+
+# ============================================================================
+# SUPABASE / POSTGREST
+# ============================================================================
+
+class _Query:
+    """Requête PostgREST en mémoire (select / insert / update + filtres)"""
+
+    def __init__(self, store: "MemorySupabase", table: str):
+        self._store = store
+        self._table = table
+        self._operation = "select"
+        self._payload: Any = None
+        self._filters: List[tuple] = []
+        self._order: Optional[tuple] = None
+        self._limit: Optional[int] = None
+        self.path = f"/{table}"
+        self.http_method = "GET"
+
+    def select(self, *columns, **kwargs):
+        return self
+
+    def insert(self, data, **kwargs):
+        self._operation, self._payload, self.http_method = "insert", data, "POST"
+        return self
+
+    def update(self, data, **kwargs):
+        self._operation, self._payload, self.http_method = "update", data, "PATCH"
+        return self
+
+    def upsert(self, data, on_conflict: str = "id", **kwargs):
+        self._operation, self._payload, self.http_method = "upsert", data, "POST"
+        self._conflict = on_conflict
+        return self
+
+    def delete(self, **kwargs):
+        self._operation, self.http_method = "delete", "DELETE"
+        return self
+
+    def eq(self, column, value):
+        self._filters.append((column, lambda current: str(current) == str(value)))
+        return self
+
+    def in_(self, column, values):
+        accepted = {str(value) for value in values}
+        self._filters.append((column, lambda current: str(current) in accepted))
+        return self
+
+    def order(self, column, desc: bool = False, **kwargs):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, size: int, **kwargs):
+        self._limit = size
+        return self
+
+    def _matches(self, row: Dict[str, Any]) -> bool:
+        return all(check(row.get(column)) for column, check in self._filters)
+
+    def execute(self):
+        self._store.latency.sleep()
+        return SimpleNamespace(data=self._store.run(self), count=None)
+
+
+class _Bucket:
+    def __init__(self, store: "MemorySupabase", bucket: str):
+        self._store = store
+        self._bucket = bucket
+
+    def upload(self, path, file, file_options=None):
+        self._store.latency.sleep()
+        self._store.files[(self._bucket, path)] = len(file) if file else 0
+        return SimpleNamespace(path=path, full_path=f"{self._bucket}/{path}")
+
+    def get_public_url(self, path, options=None):
+        return f"http://supabase.loadtest.invalid/storage/v1/object/public/{self._bucket}/{path}"
+
+
+class MemorySupabase:
+    """Client Supabase en mémoire: table() PostgREST et storage.from_()"""
+
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency()
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.files: Dict[tuple, int] = {}
+        self.storage = SimpleNamespace(from_=lambda bucket: _Bucket(self, bucket))
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def run(self, query: _Query) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self.tables.setdefault(query._table, [])
+
+            if query._operation == "insert":
+                payloads = query._payload if isinstance(query._payload, list) else [query._payload]
+                inserted = []
+                for payload in payloads:
+                    row = {"id": str(uuid.uuid4()), "created_at": datetime.utcnow().isoformat(), **copy.deepcopy(payload)}
+                    rows.append(row)
+                    inserted.append(copy.deepcopy(row))
+                return inserted
+
+            if query._operation == "upsert":
+                payloads = query._payload if isinstance(query._payload, list) else [query._payload]
+                for payload in payloads:
+                    key = payload.get(query._conflict)
+                    rows[:] = [row for row in rows if row.get(query._conflict) != key]
+                    rows.append(copy.deepcopy(payload))
+                return copy.deepcopy(payloads)
+
+            matched = [row for row in rows if query._matches(row)]
+
+            if query._operation == "update":
+                for row in matched:
+                    row.update(copy.deepcopy(query._payload))
+            elif query._operation == "delete":
+                self.tables[query._table] = [row for row in rows if not query._matches(row)]
+
+            if query._order:
+                column, desc = query._order
+                matched.sort(key=lambda row: str(row.get(column) or ""), reverse=desc)
+            if query._limit is not None:
+                matched = matched[:query._limit]
+
+            return copy.deepcopy(matched)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {name: len(rows) for name, rows in self.tables.items()}
+
+
+# ============================================================================
+# VISION
+# ============================================================================
+
+CARTE_GRISE = {
+    "fullname": "MOUKALA Jean",
+    "immatriculation": "CG-{n}-LT",
+    "power": "7",
+    "seat_number": "5",
+    "fuel_type": "ESSENCE",
+    "brand": "TOYOTA",
+    "chassis_number": "JTD{n:010d}",
+    "phone": "N/A",
+    "model": "COROLLA",
+    "address": "Brazzaville",
+    "profession": "Commerçant",
+    "content": "Informations extraites avec succès",
+}
+
+PASSPORT = {
+    "full_name": "NGOMA Marie",
+    "passport_number": "OA{n:07d}",
+    "nationality": "CONGOLAISE",
+    "date_of_birth": "12 MAR 1990",
+    "place_of_birth": "Pointe-Noire",
+    "sex": "F",
+    "profession": "Enseignante",
+    "issue_date": "01 JAN 2022",
+    "expiry_date": "01 JAN 2027",
+    "place_of_issue": "Brazzaville",
+    "country_code": "COG",
+    "type": "P",
+    "content": "Informations extraites avec succès",
+}
+
+
+def make_image_processor(latency: Latency):
+    """
+    Remplaçant de quotation.image_processor (appelé dans un thread)
+
+    Le document est déduit de l'URL (".../carte_grise/..." ou ".../passport/...").
+    """
+    def fake_image_processor(image_path: str, vision_model: str = "", vision_instruction=None, response_schema=None) -> dict:
+        latency.sleep()
+        n = abs(hash(image_path)) % 10_000_000
+        template = PASSPORT if "passport" in image_path else CARTE_GRISE
+        return {key: value.format(n=n) if "{n" in value else value for key, value in template.items()}
+
+    return fake_image_processor
@@ -0,0 +1,35 @@
+"""
+Configuration des tests (python -m pytest tests)
+
+Les variables lues par app.config sont posées avant tout import de
+l'application: clés factices, aucun appel ne part vers un vrai service.
+"""
+import os
+
+import pytest
+
+os.environ.update({
+    "REDIS_URL": "",
+    "REDIS_TOKEN": "",
+    "REDIS_MODE": "single",
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoidGVzdCJ9.test",
+    "SUPABASE_SERVICE_KEY": "",
+    "OPENAI_API_KEY": "sk-test",
+    "GEMINI_API_KEY": "test",
+    "EPAY_API_KEY": "test",
+    "OTEL_ENABLED": "false",
+})
+
+
+@pytest.fixture
+def memory_redis():
+    """RedisService branché sur le Redis en mémoire du test de charge"""
+    from loadtest.stubs import MemoryRedis
+    from app.services.redis_client import redis_service
+
+    previous = redis_service.client
+    redis_service.client = MemoryRedis()
+    redis_service._degraded.clear()
+    yield redis_service.client
+    redis_service.client = previous
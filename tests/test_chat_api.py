@@ -0,0 +1,52 @@
+"""
+/api/chat: chronologie des tours réservée à la clé d'administration
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api import chat
+from app.config import settings
+
+
+@pytest.fixture
+def client(memory_redis, monkeypatch):
+    from app.agents.orchestrator import aya_orchestrator
+
+    async def process_conversation(**kwargs):
+        with kwargs["timeline"].stage("agent_run"):
+            pass
+        return "Bonjour!"
+
+    monkeypatch.setattr(aya_orchestrator, "process_conversation", process_conversation)
+    monkeypatch.setattr(settings, "TURN_TIMELINE_DEBUG_ENABLED", True)
+    monkeypatch.setattr(settings, "ADMIN_API_KEY", "secret-admin")
+
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def _post(client, headers=None):
+    async def scenario():
+        async with client:
+            return await client.post("/api/chat", headers=headers or {}, data={
+                "msg": "Bonjour", "session_id": "debug-session", "user_phone": "+242060000008", "debug": "true",
+            })
+    return asyncio.run(scenario())
+
+
+def test_debug_without_admin_key_hides_the_timeline(client):
+    response = _post(client)
+    assert response.status_code == 200
+    assert "turn_timeline" not in response.json()["metadata"]
+
+
+def test_debug_with_a_wrong_admin_key_hides_the_timeline(client):
+    assert "turn_timeline" not in _post(client, {"X-Admin-Key": "wrong"}).json()["metadata"]
+
+
+def test_debug_with_the_admin_key_returns_the_timeline(client):
+    assert "turn_timeline" in _post(client, {"X-Admin-Key": "secret-admin"}).json()["metadata"]
@@ -0,0 +1,245 @@
+"""
+Jobs de chat asynchrones: refus quand la file est pleine, polling depuis
+Redis (job en file ou évincé de la mémoire), statut des tours en échec,
+validation du callback_url (soumission et envoi)
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.api import chat
+from app.services import chat_jobs
+from app.services.chat_jobs import ChatJobManager, InvalidCallbackURL, validate_callback_url
+from app.services.message_dedupe import message_deduplicator
+
+
+def _client() -> httpx.AsyncClient:
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def _form(message_id: str) -> dict:
+    return {
+        "msg": "Bonjour",
+        "session_id": "job-session",
+        "user_phone": "+242060000001",
+        "async_mode": "true",
+        "message_id": message_id,
+    }
+
+
+def test_queue_full_releases_the_dedupe_claim(memory_redis, monkeypatch):
+    from app.services.redis_client import redis_service
+
+    # Pool non démarré: submit lève ChatJobQueueFull
+    monkeypatch.setattr(chat, "chat_job_manager", ChatJobManager())
+
+    async def scenario():
+        async with _client() as client:
+            first = await client.post("/api/chat", data=_form("m-503"))
+            assert first.status_code == 503
+            assert await redis_service.get_message_record("job-session", "m-503") is None
+            assert not message_deduplicator._inflight
+
+            # La redélivrance est traitée comme un nouveau message, pas comme un doublon en cours
+            retry = await client.post("/api/chat", data=_form("m-503"))
+            assert retry.status_code == 503
+
+    asyncio.run(scenario())
+
+
+def test_job_is_served_from_redis_after_eviction(memory_redis, monkeypatch):
+    from app.agents.orchestrator import aya_orchestrator
+
+    async def process_conversation(**kwargs):
+        return f"Réponse à {kwargs['user_message']}"
+
+    monkeypatch.setattr(aya_orchestrator, "process_conversation", process_conversation)
+    manager = ChatJobManager(workers=1, queue_size=4)
+    monkeypatch.setattr(chat, "chat_job_manager", manager)
+
+    async def scenario():
+        await manager.start()
+        try:
+            async with _client() as client:
+                accepted = await client.post("/api/chat", data=_form("m-poll"))
+                assert accepted.status_code == 202
+                job_id = accepted.json()["job_id"]
+
+                await manager._queue.join()
+                assert job_id not in manager._jobs
+
+                polled = await client.get(f"/api/chat/jobs/{job_id}")
+                assert polled.status_code == 200
+                assert polled.json()["status"] == "completed"
+                assert polled.json()["reply"] == "Réponse à Bonjour"
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_unsaved_job_stays_in_memory_until_its_ttl(monkeypatch):
+    from app.agents.orchestrator import aya_orchestrator
+    from app.config import settings
+    from app.services.redis_client import redis_service
+
+    async def process_conversation(**kwargs):
+        return "ok"
+
+    monkeypatch.setattr(aya_orchestrator, "process_conversation", process_conversation)
+    monkeypatch.setattr(redis_service, "client", None)
+    monkeypatch.setattr(settings, "CHAT_JOB_TTL", 0.05)
+    manager = ChatJobManager(workers=1, queue_size=4)
+
+    async def scenario():
+        await manager.start()
+        try:
+            job = await manager.submit("ttl-session", "+242060000002", "Bonjour")
+            await manager._queue.join()
+            assert (await manager.get(job["job_id"]))["status"] == "completed"
+
+            await asyncio.sleep(0.1)
+            assert job["job_id"] not in manager._jobs
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+def test_queued_job_is_visible_from_other_instances(memory_redis, monkeypatch):
+    manager = ChatJobManager(workers=1, queue_size=4)
+    monkeypatch.setattr(chat, "chat_job_manager", manager)
+
+    async def scenario():
+        # File sans worker: le job reste en attente
+        manager._queue = asyncio.Queue(maxsize=4)
+        async with _client() as client:
+            accepted = await client.post("/api/chat", data=_form("m-queued"))
+            assert accepted.status_code == 202
+
+        other_instance = ChatJobManager()
+        job = await other_instance.get(accepted.json()["job_id"])
+        assert job["status"] == "queued"
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("reply_name", ["ERROR_REPLY", "BUSY_REPLY"])
+def test_apology_replies_mark_the_job_failed(memory_redis, monkeypatch, reply_name):
+    from app.agents import orchestrator
+    from app.services.redis_client import redis_service
+
+    async def process_conversation(**kwargs):
+        return getattr(orchestrator, reply_name)
+
+    monkeypatch.setattr(orchestrator.aya_orchestrator, "process_conversation", process_conversation)
+    manager = ChatJobManager(workers=1, queue_size=4)
+    monkeypatch.setattr(chat, "chat_job_manager", manager)
+
+    async def scenario():
+        await manager.start()
+        try:
+            async with _client() as client:
+                accepted = await client.post("/api/chat", data=_form(f"m-{reply_name}"))
+                await manager._queue.join()
+
+                polled = (await client.get(f"/api/chat/jobs/{accepted.json()['job_id']}")).json()
+                assert polled["status"] == "failed"
+                assert polled["reply"] == getattr(orchestrator, reply_name)
+
+            # Le message n'est pas mémorisé: la redélivrance relancera un tour
+            assert await redis_service.get_message_record("job-session", f"m-{reply_name}") is None
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://hooks.example.com/cb",
+    "http://127.0.0.1:8000/cb",
+    "http://localhost/cb",
+    "http://10.1.2.3/cb",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/cb",
+])
+def test_callback_url_rejects_internal_targets(url):
+    with pytest.raises(InvalidCallbackURL):
+        asyncio.run(validate_callback_url(url))
+
+
+def test_callback_url_allowlist(monkeypatch):
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "CHAT_JOB_CALLBACK_ALLOWED_HOSTS", "hooks.example.com")
+    asyncio.run(validate_callback_url("https://hooks.example.com/aya"))
+    with pytest.raises(InvalidCallbackURL):
+        asyncio.run(validate_callback_url("https://other.example.com/aya"))
+
+
+def _resolving_to(monkeypatch, *addresses):
+    answers = iter(addresses)
+    monkeypatch.setattr(
+        chat_jobs.socket, "getaddrinfo",
+        lambda host, port, **kwargs: [(2, 1, 6, "", (next(answers), port))]
+    )
+
+
+def _recording_client(monkeypatch, requests: list):
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient
+    monkeypatch.setattr(
+        chat_jobs.httpx, "AsyncClient",
+        lambda **kwargs: client(transport=httpx.MockTransport(handler), **kwargs)
+    )
+
+
+def _finished_job(callback_url: str) -> dict:
+    return {
+        "job_id": "cb-job", "status": "completed", "reply": "ok", "session_id": "cb-session",
+        "metadata": {}, "error": None, "callback_url": callback_url,
+    }
+
+
+def test_callback_connects_to_the_validated_address(monkeypatch):
+    requests = []
+    _resolving_to(monkeypatch, "93.184.216.34")
+    _recording_client(monkeypatch, requests)
+
+    assert asyncio.run(ChatJobManager()._deliver(_finished_job("https://hooks.example.com:8443/aya?x=1")))
+    request = requests[0]
+    assert str(request.url) == "https://93.184.216.34:8443/aya?x=1"
+    assert request.headers["host"] == "hooks.example.com:8443"
+    assert request.extensions["sni_hostname"] == "hooks.example.com"
+
+
+def test_callback_rebound_to_an_internal_address_is_not_sent(monkeypatch):
+    requests = []
+    # Adresse publique à la soumission, puis loopback au moment de l'envoi
+    _resolving_to(monkeypatch, "93.184.216.34", "127.0.0.1")
+    _recording_client(monkeypatch, requests)
+
+    asyncio.run(validate_callback_url("http://rebind.example.com/cb"))
+    assert not asyncio.run(ChatJobManager()._deliver(_finished_job("http://rebind.example.com/cb")))
+    assert requests == []
+
+
+def test_invalid_callback_url_is_refused_before_the_claim(memory_redis):
+    from app.services.redis_client import redis_service
+
+    async def scenario():
+        async with _client() as client:
+            response = await client.post(
+                "/api/chat", data={**_form("m-cb"), "callback_url": "http://127.0.0.1/cb"}
+            )
+            assert response.status_code == 400
+            assert await redis_service.get_message_record("job-session", "m-cb") is None
+
+    asyncio.run(scenario())
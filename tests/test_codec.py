@@ -0,0 +1,154 @@
+"""
+Codec des valeurs de session: aller-retour, compression, valeurs héritées
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.models.state import ConversationState
+from app.utils.codec import (
+    ENCODING_JSON,
+    ENCODING_MSGPACK,
+    FLAG_ZLIB,
+    SCHEMA_VERSION,
+    Codec,
+    codec,
+)
+
+VALUES = [
+    None,
+    True,
+    0,
+    -42,
+    3.5,
+    "Où en est mon paiement ? 🙏",
+    [],
+    {"role": "user", "content": "Bonjour", "nested": {"places": 5, "energie": ["ESSENCE", "DIESEL"]}},
+]
+
+
+@pytest.mark.parametrize("name,encoding", [("msgpack", ENCODING_MSGPACK), ("json", ENCODING_JSON)])
+@pytest.mark.parametrize("value", VALUES)
+def test_round_trip(name, encoding, value):
+    subject = Codec(name, compress_min_bytes=512)
+    data = subject.encode(value)
+
+    assert data[0] == SCHEMA_VERSION
+    assert data[1] == encoding
+    assert subject.decode(data) == (value, SCHEMA_VERSION)
+
+
+@pytest.mark.parametrize("name", ["msgpack", "json"])
+def test_large_values_are_compressed(name):
+    subject = Codec(name, compress_min_bytes=64)
+    value = {"content": "Je souhaite assurer mon véhicule. " * 40}
+    data = subject.encode(value)
+
+    assert data[1] & FLAG_ZLIB
+    assert len(data) < len(json.dumps(value))
+    assert subject.decode(data) == (value, SCHEMA_VERSION)
+
+
+def test_incompressible_values_are_stored_as_is():
+    subject = Codec("msgpack", compress_min_bytes=8)
+    data = subject.encode("x7Kq")
+    assert not data[1] & FLAG_ZLIB
+
+
+def test_msgpack_values_decode_with_a_json_codec():
+    # Changement de SESSION_CODEC: les valeurs déjà écrites restent lisibles
+    data = Codec("msgpack").encode({"a": [1, 2]})
+    assert Codec("json").decode(data) == ({"a": [1, 2]}, SCHEMA_VERSION)
+
+
+@pytest.mark.parametrize("raw", ['{"a": 1}', b'{"a": 1}', b'  {"a": 1}', b'\n{"a": 1}'])
+def test_headerless_json_is_legacy(raw):
+    assert codec.decode(raw) == ({"a": 1}, None)
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(ValueError):
+        codec.decode(bytes((SCHEMA_VERSION, 0x0F)) + b"payload")
+
+
+def test_conversation_state_hash_round_trip():
+    state = ConversationState(
+        session_id="codec-session",
+        user_phone="+242060000004",
+        product_type="auto",
+        collected_data={"carte_grise": {"power": 7, "fuel_type": "ESSENCE"}},
+    )
+    state.add_message("user", "Bonjour")
+    state.add_message("assistant", "Bonjour! 👋")
+
+    fields = state.to_redis_hash()
+    messages = [codec.encode(message) for message in state.to_redis_dict()["message_history"]]
+    restored = ConversationState.from_redis_hash(fields, messages)
+
+    assert restored.model_dump() == state.model_dump()
+    assert restored.dirty_fields() == {}
+
+
+def test_add_message_keeps_message_count_encoded(memory_redis):
+    from app.services.redis_client import redis_service
+
+    async def scenario():
+        state = ConversationState(session_id="count-session", user_phone="+242060000005")
+        state.add_message("user", "Bonjour")
+        await redis_service.save_conversation_state("count-session", state)
+
+        assert await redis_service.add_message_to_history("count-session", "assistant", "Bonjour! 👋")
+        assert not await redis_service.add_message_to_history("absent-session", "assistant", "Bonjour")
+
+        raw = await memory_redis.hget(redis_service._get_state_key("count-session"), "message_count")
+        assert codec.decode(raw) == (2, SCHEMA_VERSION)
+
+        restored = await redis_service.get_conversation_state("count-session")
+        assert restored.message_count == 2
+        assert restored.last_message == "Bonjour! 👋"
+
+        # Ajouts concurrents: aucun incrément perdu
+        await asyncio.gather(*(
+            redis_service.add_message_to_history("count-session", "user", f"message {i}") for i in range(20)
+        ))
+        restored = await redis_service.get_conversation_state("count-session")
+        assert restored.message_count == 22
+
+    asyncio.run(scenario())
+
+
+def test_rebase_keeps_both_counter_increments():
+    state = ConversationState(session_id="rebase-session", user_phone="+242060000010", message_count=4)
+    state.token_usage = {"llm_calls": 2, "input_tokens": 100}
+    loaded = ConversationState.from_redis_hash(state.to_redis_hash(), [])
+
+    # Un autre écrivain a compté 1 message et 1 appel entre-temps; nous aussi
+    loaded.message_count += 1
+    loaded.add_token_usage({"llm_calls": 1, "input_tokens": 50, "output_tokens": 10})
+    loaded.rebase_field("message_count", codec.encode(5))
+    loaded.rebase_field("token_usage", codec.encode({"llm_calls": 3, "input_tokens": 130}))
+
+    assert loaded.message_count == 6
+    assert loaded.token_usage == {"llm_calls": 4, "input_tokens": 180, "output_tokens": 10}
+
+
+def test_concurrent_turns_add_up_their_token_usage(memory_redis):
+    from app.services.redis_client import redis_service
+
+    async def scenario():
+        state = ConversationState(session_id="usage-session", user_phone="+242060000011")
+        state.add_token_usage({"llm_calls": 1, "input_tokens": 100})
+        await redis_service.save_conversation_state("usage-session", state)
+
+        first = await redis_service.get_conversation_state("usage-session")
+        second = await redis_service.get_conversation_state("usage-session")
+        first.add_token_usage({"llm_calls": 1, "input_tokens": 40})
+        second.add_token_usage({"llm_calls": 2, "input_tokens": 70})
+        await redis_service.save_conversation_state("usage-session", first)
+        await redis_service.save_conversation_state("usage-session", second)
+
+        restored = await redis_service.get_conversation_state("usage-session")
+        assert restored.token_usage == {"llm_calls": 4, "input_tokens": 210}
+
+    asyncio.run(scenario())
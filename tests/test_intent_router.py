@@ -0,0 +1,112 @@
+"""
+Routeur d'intentions: scores des handlers et décisions de routage
+"""
+import asyncio
+
+import pytest
+
+from app.agents.intent_router import (
+    GREETING_REPLY,
+    PRODUCTS_MENU,
+    GreetingHandler,
+    PaymentStatusHandler,
+    detect_product_types,
+    intent_router,
+    normalize_text,
+    tokenize,
+)
+from app.config import settings
+from app.models.state import ConversationState
+
+
+def _state(**fields) -> ConversationState:
+    return ConversationState(session_id="router-session", user_phone="+242060000003", **fields)
+
+
+def _route(message, state=None, media_url=None):
+    return asyncio.run(intent_router.route(message, state, media_url))
+
+
+def test_normalize_text_strips_accents_punctuation_and_emojis():
+    assert normalize_text("Où en est mon PAIEMENT ?! 🙏") == "ou en est mon paiement"
+    assert tokenize("Multirisque-Habitation") == ["multirisque", "habitation"]
+
+
+def test_detect_product_types():
+    assert detect_product_types("Je veux assurer ma voiture") == ["auto"]
+    assert detect_product_types("voyage et maison") == ["voyage", "mrh"]
+    assert detect_product_types("") == []
+
+
+@pytest.mark.parametrize("message,intent", [
+    ("Bonjour", "greeting"),
+    ("bonsoir madame", "greeting"),
+    ("Quels produits proposez-vous ?", "product_list"),
+    ("Quel est le prix de la MRH ?", "mrh_prices"),
+    ("Combien coûte l'individuelle accident ?", "iac_prices"),
+])
+def test_frequent_intents_are_routed(message, intent):
+    match = _route(message)
+    assert match is not None
+    assert match.intent == intent
+    assert match.confidence >= settings.INTENT_ROUTER_MIN_CONFIDENCE
+
+
+def test_replies_are_the_canned_texts():
+    assert _route("Bonjour").reply == GREETING_REPLY
+    assert _route("Quels produits proposez-vous ?").reply == PRODUCTS_MENU
+
+
+@pytest.mark.parametrize("message", [
+    "Bonjour, je veux assurer ma Toyota Corolla de 7 chevaux",
+    "MRH",
+    "Je veux la MRH standard et premium, quel prix ?",
+    "",
+])
+def test_complex_or_ambiguous_messages_go_to_the_llm(message):
+    assert _route(message) is None
+
+
+def test_greeting_mid_conversation_is_not_routed():
+    state = _state()
+    state.add_message("user", "Je veux une assurance auto")
+    assert GreetingHandler().classify(tokenize("Bonjour"), state) == 0.0
+    assert _route("Bonjour", state) is None
+
+
+def test_media_always_goes_to_the_llm():
+    assert _route("Bonjour", media_url="https://example.com/carte.jpg") is None
+
+
+@pytest.mark.parametrize("message,confidence", [
+    ("Où en est mon paiement ?", 0.85),
+    ("Mon paiement est-il validé ?", 0.85),
+    ("où ça en est le paiement", 0.85),
+    ("Je veux payer par Airtel ou MoMo ?", 0.5),
+    ("Je veux toujours payer", 0.5),
+    ("Bonjour, est-ce que mon paiement a bien été reçu ?", 0.85),
+    # Plusieurs intentions: le statut seul ne répondrait pas à la demande
+    ("le paiement est passé mais je veux changer de formule et ajouter ma femme", 0.5),
+    ("Bonjour", 0.0),
+])
+def test_payment_status_needs_a_status_phrase(message, confidence):
+    state = _state(payment_reference="AYA-REF-1")
+    assert PaymentStatusHandler().classify(tokenize(message), state) == confidence
+
+
+def test_payment_status_without_reference_is_not_routed():
+    assert PaymentStatusHandler().classify(tokenize("Où en est mon paiement ?"), _state()) == 0.0
+
+
+def test_pending_payment_status_is_answered(memory_redis):
+    state = _state(payment_reference="AYA-REF-2", payment_status="en_attente")
+    match = _route("Où en est mon paiement ?", state)
+    assert match.intent == "payment_status"
+    assert "AYA-REF-2" in match.reply
+    assert "en attente" in match.reply
+
+
+def test_long_mixed_intent_message_goes_to_the_llm(memory_redis):
+    state = _state(payment_reference="AYA-REF-3", payment_status="en_attente")
+    message = "le paiement est passé mais je veux changer de formule et ajouter ma femme"
+    assert _route(message, state) is None
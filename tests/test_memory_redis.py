@@ -0,0 +1,193 @@
+"""
+Redis en mémoire du test de charge: rejeu des scripts Lua de RedisService
+
+Le test de charge n'est fiable que si ces rejeux se comportent comme les
+scripts exécutés par Redis; chaque cas suit la sémantique documentée au-dessus
+du script dans app/services/redis_client.py.
+"""
+import asyncio
+import hashlib
+import time
+
+import pytest
+
+from app.services import redis_client
+from app.services.redis_client import redis_service
+from app.utils.codec import SCHEMA_VERSION, Codec, codec
+from loadtest.stubs import MemoryRedis
+
+
+def _run(redis: MemoryRedis, script: str, keys: list, args: list):
+    return asyncio.run(redis.evalsha(redis_client._sha1(script), len(keys), *keys, *args))
+
+
+def _digest(value: bytes) -> str:
+    return hashlib.sha1(value).hexdigest()
+
+
+# ----------------------------------------------------------------------------
+# SAVE_STATE_SCRIPT: écriture conditionnelle des champs + ajout des messages
+# ----------------------------------------------------------------------------
+
+def test_save_state_writes_fields_and_appends_capped_history():
+    redis = MemoryRedis()
+    conflicts = _run(redis, redis_client.SAVE_STATE_SCRIPT, ["s:state", "s:history"], [
+        3600, 2, 2,
+        "step", "", b"welcome",
+        "phone", "*", b"+242",
+        b"m1", b"m2", b"m3",
+    ])
+
+    assert conflicts == []
+    assert redis.store.hgetall("s:state") == {"step": b"welcome", "phone": b"+242"}
+    assert redis.store.lrange("s:history", 0, -1) == [b"m2", b"m3"]
+
+
+def test_save_state_rejects_stale_fields_and_writes_nothing():
+    redis = MemoryRedis()
+    redis.store.hset("s:state", mapping={"step": b"quote", "phone": b"+242"})
+
+    conflicts = _run(redis, redis_client.SAVE_STATE_SCRIPT, ["s:state", "s:history"], [
+        3600, 10, 2,
+        "step", _digest(b"welcome"), b"payment",
+        "phone", _digest(b"+242"), b"+243",
+        b"m1",
+    ])
+
+    assert conflicts == ["step"]
+    assert redis.store.hgetall("s:state") == {"step": b"quote", "phone": b"+242"}
+    assert redis.store.lrange("s:history", 0, -1) == []
+
+
+def test_save_state_accepts_matching_digests_and_unconditional_fields():
+    redis = MemoryRedis()
+    redis.store.hset("s:state", mapping={"step": b"quote", "phone": b"+242"})
+
+    conflicts = _run(redis, redis_client.SAVE_STATE_SCRIPT, ["s:state", "s:history"], [
+        3600, 10, 2,
+        "step", _digest(b"quote"), b"payment",
+        "phone", "*", b"+243",
+    ])
+
+    assert conflicts == []
+    assert redis.store.hgetall("s:state") == {"step": b"payment", "phone": b"+243"}
+
+
+def test_save_state_treats_an_absent_field_as_empty_digest():
+    redis = MemoryRedis()
+    redis.store.hset("s:state", mapping={"step": b"quote"})
+
+    assert _run(redis, redis_client.SAVE_STATE_SCRIPT, ["s:state", "s:history"], [
+        3600, 10, 1, "product", _digest(b"auto"), b"mrh",
+    ]) == ["product"]
+    assert _run(redis, redis_client.SAVE_STATE_SCRIPT, ["s:state", "s:history"], [
+        3600, 10, 1, "product", "", b"mrh",
+    ]) == []
+
+
+# ----------------------------------------------------------------------------
+# APPEND_MESSAGE_SCRIPT: ajout d'un message, compteur incrémenté dans son encodage
+# ----------------------------------------------------------------------------
+
+@pytest.mark.parametrize("name", ["msgpack", "json"])
+def test_append_message_increments_the_encoded_count(name):
+    subject = Codec(name)
+    redis = MemoryRedis()
+    redis.store.hset("s:state", mapping={"message_count": subject.encode(4)})
+
+    assert _run(redis, redis_client.APPEND_MESSAGE_SCRIPT, ["s:state", "s:history"], [3600, 2, b"m1", b"last"]) == 1
+    assert _run(redis, redis_client.APPEND_MESSAGE_SCRIPT, ["s:state", "s:history"], [3600, 2, b"m2", b"last"]) == 1
+    assert _run(redis, redis_client.APPEND_MESSAGE_SCRIPT, ["s:state", "s:history"], [3600, 2, b"m3", b"last"]) == 1
+
+    raw = redis.store.hget("s:state", "message_count")
+    assert raw[:2] == subject.encode(0)[:2]
+    assert codec.decode(raw) == (7, SCHEMA_VERSION)
+    assert redis.store.hget("s:state", "last_message") == b"last"
+    assert redis.store.lrange("s:history", 0, -1) == [b"m2", b"m3"]
+
+
+def test_append_message_keeps_legacy_counts_readable():
+    redis = MemoryRedis()
+    redis.store.hset("s:state", mapping={"message_count": b"9"})
+    _run(redis, redis_client.APPEND_MESSAGE_SCRIPT, ["s:state", "s:history"], [3600, 10, b"m1", b"last"])
+    assert codec.decode(redis.store.hget("s:state", "message_count")) == (10, None)
+
+
+def test_append_message_needs_an_existing_session():
+    redis = MemoryRedis()
+    assert _run(redis, redis_client.APPEND_MESSAGE_SCRIPT, ["s:state", "s:history"], [3600, 10, b"m1", b"last"]) == 0
+    assert redis.store.get("s:history") is None
+
+
+# ----------------------------------------------------------------------------
+# UPDATE_FIELDS_SCRIPT: écriture directe si la session existe
+# ----------------------------------------------------------------------------
+
+def test_update_fields_only_on_existing_sessions():
+    redis = MemoryRedis()
+    assert _run(redis, redis_client.UPDATE_FIELDS_SCRIPT, ["s:state"], [0, "step", b"quote"]) == 0
+    assert redis.store.get("s:state") is None
+
+    redis.store.hset("s:state", mapping={"step": b"welcome", "phone": b"+242"})
+    assert _run(redis, redis_client.UPDATE_FIELDS_SCRIPT, ["s:state"], [3600, "step", b"quote"]) == 1
+    assert redis.store.hgetall("s:state") == {"step": b"quote", "phone": b"+242"}
+
+
+# ----------------------------------------------------------------------------
+# CLAIM_EXPIRING_SCRIPT / RELEASE_ARCHIVED_SCRIPT: archiveur de sessions
+# ----------------------------------------------------------------------------
+
+def test_claim_leases_due_sessions_and_release_keeps_resumed_ones(memory_redis):
+    index = redis_service._get_expiry_index_key()
+    memory_redis.store.zadd(index, {"due-1": 100, "due-2": 110, "due-3": 120, "later": 500})
+
+    async def scenario():
+        claimed = await redis_service.claim_expiring_sessions(before=150, limit=2, lease_until=200)
+        assert claimed == ["due-1", "due-2"]
+        assert memory_redis.store.zscore(index, "due-1") == 200
+
+        # Bail en cours: le lot suivant ne reprend que les sessions non réservées
+        assert await redis_service.claim_expiring_sessions(before=150, limit=10, lease_until=210) == ["due-3"]
+
+        # due-2 a été reprise pendant l'archivage: son échéance a changé, elle reste indexée
+        memory_redis.store.zadd(index, {"due-2": 900})
+        await redis_service.release_archived_sessions(["due-1", "due-2"], 200)
+        assert memory_redis.store.zscore(index, "due-1") is None
+        assert memory_redis.store.zscore(index, "due-2") == 900
+
+    asyncio.run(scenario())
+
+
+# ----------------------------------------------------------------------------
+# RATE_LIMIT_SCRIPT: fenêtres glissantes par numéro et par session
+# ----------------------------------------------------------------------------
+
+def test_rate_limit_counts_admitted_turns_only(memory_redis):
+    phone = "+242060000007"
+    limits = [("", 60, 3), ("session:s1", 60, 2)]
+
+    async def scenario():
+        assert await redis_service.hit_rate_limits(phone, limits, "t1") is None
+        assert await redis_service.hit_rate_limits(phone, limits, "t2") is None
+
+        # Limite de session atteinte: le tour refusé n'est pas compté pour le numéro
+        index, retry_after = await redis_service.hit_rate_limits(phone, limits, "t3")
+        assert index == 1
+        assert 0 < retry_after <= 60
+
+        other_session = [("", 60, 3), ("session:s2", 60, 2)]
+        assert await redis_service.hit_rate_limits(phone, other_session, "t4") is None
+        index, _ = await redis_service.hit_rate_limits(phone, other_session, "t5")
+        assert index == 0
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_window_slides():
+    redis = MemoryRedis()
+    now = int(time.time() * 1000)
+    keys = ["ratelimit:{p}"]
+
+    assert _run(redis, redis_client.RATE_LIMIT_SCRIPT, keys, [now, "t1", 1000, 1]) == [0, 0]
+    assert _run(redis, redis_client.RATE_LIMIT_SCRIPT, keys, [now + 400, "t2", 1000, 1]) == [1, 600]
+    assert _run(redis, redis_client.RATE_LIMIT_SCRIPT, keys, [now + 1000, "t3", 1000, 1]) == [0, 0]
@@ -0,0 +1,41 @@
+"""
+Profileur par requête: déclenchement réservé à la clé d'administration
+"""
+import pytest
+
+from app.config import settings
+from app.utils.profiler import request_profiler
+
+
+def _scope(headers=(), query=b""):
+    return {"type": "http", "path": "/api/chat", "headers": list(headers), "query_string": query}
+
+
+@pytest.fixture
+def admin_key(monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_API_KEY", "secret-admin")
+    return "secret-admin"
+
+
+def test_unmarked_requests_are_not_profiled(admin_key):
+    assert not request_profiler.wants(_scope([(b"x-admin-key", admin_key.encode())]))
+
+
+@pytest.mark.parametrize("scope", [
+    _scope([(b"x-aya-profile", b"1")]),
+    _scope(query=b"profile=1"),
+    _scope([(b"x-aya-profile", b"1"), (b"x-admin-key", b"wrong")]),
+])
+def test_profile_requests_need_the_admin_key(admin_key, scope):
+    assert not request_profiler.wants(scope)
+
+
+def test_profile_requests_with_the_admin_key(admin_key):
+    key = (b"x-admin-key", admin_key.encode())
+    assert request_profiler.wants(_scope([(b"x-aya-profile", b"1"), key]))
+    assert request_profiler.wants(_scope([key], query=b"profile=true"))
+
+
+def test_no_admin_key_configured_disables_profiles(monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_API_KEY", "")
+    assert not request_profiler.wants(_scope([(b"x-aya-profile", b"1"), (b"x-admin-key", b"")]))
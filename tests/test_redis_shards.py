@@ -0,0 +1,74 @@
+"""
+Répartition des clés: hash tags, anneau de hachage cohérent, client réparti
+"""
+import asyncio
+from collections import Counter
+
+import pytest
+
+from app.services.redis_shards import HashRing, ShardedRedis, hash_tag
+from loadtest.stubs import MemoryRedis
+
+NAMES = ["redis-0:6379", "redis-1:6379", "redis-2:6379", "redis-3:6379"]
+KEYS = [f"session:{{{i}}}:state" for i in range(4000)]
+
+
+@pytest.mark.parametrize("key,tag", [
+    ("session:{abc}:state", b"abc"),
+    (b"session:{abc}:history", b"abc"),
+    ("session:{}:state", b"session:{}:state"),
+    ("payment_session:REF-1", b"payment_session:REF-1"),
+    ("a{b}{c}", b"b"),
+])
+def test_hash_tag(key, tag):
+    assert hash_tag(key) == tag
+
+
+def test_keys_of_a_session_share_a_node():
+    ring = HashRing(NAMES)
+    for i in range(200):
+        assert ring.node_for(f"session:{{{i}}}:state") == ring.node_for(f"session:{{{i}}}:history")
+
+
+def test_placement_is_stable_across_instances():
+    first, second = HashRing(NAMES), HashRing(NAMES)
+    assert [first.node_for(key) for key in KEYS] == [second.node_for(key) for key in KEYS]
+
+
+def test_keys_are_spread_evenly():
+    ring = HashRing(NAMES)
+    counts = Counter(ring.node_for(key) for key in KEYS)
+    assert set(counts) == set(range(len(NAMES)))
+    expected = len(KEYS) / len(NAMES)
+    assert all(abs(count - expected) / expected < 0.25 for count in counts.values())
+
+
+def test_adding_a_node_moves_about_one_key_in_n():
+    before = HashRing(NAMES)
+    after = HashRing(NAMES + ["redis-4:6379"])
+    moved = [key for key in KEYS if before.node_for(key) != after.node_for(key)]
+
+    # Seules les clés reprises par le nouveau nœud changent de place
+    assert all(after.node_for(key) == len(NAMES) for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.3
+
+
+def test_sharded_client_and_pipeline_route_by_key():
+    nodes = [MemoryRedis() for _ in NAMES]
+    client = ShardedRedis(nodes, NAMES)
+
+    async def scenario():
+        for i in range(20):
+            await client.set(f"session:{{{i}}}:state", f"v{i}")
+
+        pipe = client.pipeline(transaction=False)
+        for i in range(20):
+            pipe.get(f"session:{{{i}}}:state")
+        assert await pipe.execute() == [f"v{i}" for i in range(20)]
+
+        for i in range(20):
+            key = f"session:{{{i}}}:state"
+            assert client.node(key).store.get(key) == f"v{i}"
+            assert sum(node.store.get(key) is not None for node in nodes) == 1
+
+    asyncio.run(scenario())
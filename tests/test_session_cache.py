@@ -0,0 +1,154 @@
+"""
+Cache L1 des sessions: LRU + TTL, invalidation pub/sub, prolongation du TTL
+"""
+import asyncio
+import time
+
+from app.config import settings
+from app.models.state import ConversationState
+from app.services.session_cache import SessionCache, session_cache
+
+FIELDS = {"session_id": b"\x01\x02s"}
+
+
+async def _until(condition) -> None:
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition jamais remplie")
+
+
+def _active_cache(**kwargs) -> SessionCache:
+    cache = SessionCache(**kwargs)
+    cache._listening = True
+    return cache
+
+
+def test_not_served_until_subscribed():
+    cache = SessionCache()
+    cache.put("s1", FIELDS, [])
+    assert cache.get("s1") is None
+    assert cache.peek("s1") is None
+
+
+def test_put_get_and_lru_eviction():
+    cache = _active_cache(max_entries=2)
+    cache.put("s1", FIELDS, [b"m1"])
+    cache.put("s2", FIELDS, [])
+    assert cache.get("s1")[:2] == (FIELDS, [b"m1"])
+
+    # s1 vient d'être lu: s2 est le moins récent
+    cache.put("s3", FIELDS, [])
+    assert cache.get("s2") is None
+    assert cache.get("s1") is not None
+    assert cache.get("s3") is not None
+    assert cache.hits == 3 and cache.misses == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = _active_cache(ttl=0.05)
+    cache.put("s1", FIELDS, [])
+    time.sleep(0.06)
+    assert cache.get("s1") is None
+    assert cache.peek("s1") is None
+
+
+def test_update_extends_an_entry_but_never_creates_one():
+    cache = _active_cache()
+    cache.update("s1", FIELDS, [b"m1"])
+    assert cache.peek("s1") is None
+
+    cache.put("s1", FIELDS, [b"m1"])
+    cache.update("s1", {"step": b"x"}, [b"m2"])
+    fields, messages, _ = cache.get("s1")
+    assert fields == {"step": b"x"}
+    assert messages == [b"m1", b"m2"]
+
+
+def test_own_invalidations_are_ignored_remote_ones_evict():
+    cache = _active_cache()
+    other = SessionCache()
+    cache.put("s1", FIELDS, [])
+
+    cache._on_message(cache.invalidation_message("s1"))
+    assert cache.get("s1") is not None
+
+    cache._on_message(other.invalidation_message("s1").encode())
+    assert cache.get("s1") is None
+
+
+def test_pubsub_invalidation_between_workers(memory_redis):
+    async def scenario():
+        worker_a, worker_b = SessionCache(), SessionCache()
+        worker_a.start(memory_redis)
+        worker_b.start(memory_redis)
+        try:
+            await _until(lambda: worker_a.active and worker_b.active)
+
+            worker_a.put("s1", FIELDS, [])
+            await memory_redis.publish(settings.SESSION_CACHE_CHANNEL, worker_b.invalidation_message("s1"))
+            await _until(lambda: worker_a.peek("s1") is None)
+        finally:
+            await worker_a.stop()
+            await worker_b.stop()
+
+    asyncio.run(scenario())
+
+
+def test_cache_hit_with_touch_extends_the_session_ttl(memory_redis):
+    from app.services.redis_client import redis_service
+
+    expired = []
+    expire = memory_redis.store.expire
+    memory_redis.store.expire = lambda key, ttl: (expired.append(key), expire(key, ttl))[1]
+
+    async def scenario():
+        session_cache.start(memory_redis)
+        try:
+            await _until(lambda: session_cache.active)
+
+            state = ConversationState(session_id="touch-session", user_phone="+242060000006")
+            await redis_service.save_conversation_state("touch-session", state)
+            await redis_service.get_conversation_state("touch-session")
+            assert session_cache.get("touch-session") is not None
+
+            expired.clear()
+            assert await redis_service.get_conversation_state("touch-session", touch=True) is not None
+            await asyncio.gather(*redis_service._touches)
+            assert sorted(expired) == sorted([
+                redis_service._get_state_key("touch-session"),
+                redis_service._get_history_key("touch-session"),
+            ])
+        finally:
+            await session_cache.stop()
+
+    asyncio.run(scenario())
+
+
+def test_invalidation_is_republished_after_a_script_reload(memory_redis):
+    from redis.exceptions import NoScriptError
+
+    from app.services.redis_client import redis_service
+
+    events = []
+    evalsha, publish = memory_redis.store.evalsha, memory_redis.store.publish
+
+    def flushed_once(*args):
+        # SCRIPT FLUSH / redémarrage de Redis: le premier EVALSHA échoue
+        if not events:
+            events.append("noscript")
+            raise NoScriptError("NOSCRIPT No matching script")
+        events.append("write")
+        return evalsha(*args)
+
+    memory_redis.store.evalsha = flushed_once
+    memory_redis.store.publish = lambda channel, message: (events.append("publish"), publish(channel, message))[1]
+
+    async def scenario():
+        state = ConversationState(session_id="reload-session", user_phone="+242060000009")
+        await redis_service.save_conversation_state("reload-session", state)
+
+    asyncio.run(scenario())
+    # Invalidation du pipeline publiée avant l'écriture, puis republiée après
+    assert events == ["noscript", "publish", "write", "publish"]
@@ -0,0 +1,58 @@
+"""
+Devis spéculatifs: report dans l'état et retrait des devis obsolètes
+"""
+from app.models.state import ConversationState
+from app.tools.speculation import QuoteSpeculator
+
+PRICING = {f"OFFRE_{months}_MOIS": {"PRIME_TOTALE": months * 10000} for months in (3, 6, 12)}
+GRID = {"ZONE 1": {"ESSENTIEL": 25000}}
+
+
+def _speculator(results: dict) -> QuoteSpeculator:
+    speculator = QuoteSpeculator()
+    speculator.peek = results.get
+    return speculator
+
+
+def _state(**collected) -> ConversationState:
+    return ConversationState(
+        session_id="speculation-session",
+        user_phone="+242060000008",
+        current_step="info_collection",
+        collected_data=collected,
+    )
+
+
+def test_auto_quote_is_recorded_and_presented():
+    speculator = _speculator({QuoteSpeculator.auto_key(7, 5, "ESSENCE", "VOITURE", "PROMENADE/AFFAIRES"): PRICING})
+    state = _state(carte_grise={"power": "7 CV", "seat_number": 5, "fuel_type": "Essence"})
+
+    speculator.record(state)
+    assert state.collected_data["devis_precalcule"]["result"] == PRICING
+    assert "12 mois: 120,000 FCFA" in speculator.precomputed_fact(state)
+
+
+def test_new_carte_grise_drops_the_previous_quote():
+    speculator = _speculator({QuoteSpeculator.auto_key(7, 5, "ESSENCE", "VOITURE", "PROMENADE/AFFAIRES"): PRICING})
+    state = _state(carte_grise={"power": 7, "seat_number": 5, "fuel_type": "ESSENCE"})
+    speculator.record(state)
+
+    # Devis du nouveau véhicule pas encore terminé: l'ancien n'est plus présenté
+    state.collected_data["carte_grise"] = {"power": 11, "seat_number": 5, "fuel_type": "DIESEL"}
+    assert speculator.precomputed_fact(state) is None
+
+    speculator.record(state)
+    assert "devis_precalcule" not in state.collected_data
+
+
+def test_changed_trip_duration_drops_the_voyage_grid():
+    speculator = _speculator({QuoteSpeculator.voyage_key("PARTICULIER", 15): GRID})
+    state = _state(passport={"full_name": "Jean Dupont"}, trip_duration=15)
+    speculator.record(state)
+    assert "ZONE 1 / ESSENTIEL: 25,000 FCFA" in speculator.precomputed_fact(state)
+
+    state.collected_data["trip_duration"] = 30
+    assert speculator.precomputed_fact(state) is None
+
+    speculator.record(state)
+    assert "devis_precalcule" not in state.collected_data